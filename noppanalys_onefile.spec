@@ -19,6 +19,15 @@ a = Analysis(
         'sklearn.neighbors.quad_tree',
         'sklearn.tree._utils',
         'pywt._extensions._cwt',
+        # Importeras vid första användning (lazy_import) och syns inte för analysen
+        'pywt',
+        'scipy.stats',
+        'sklearn.decomposition',
+        'sklearn.preprocessing',
+        'sklearn.svm',
+        'sklearn.neural_network',
+        'sklearn.ensemble',
+        'sklearn.model_selection',
     ],
     hookspath=[],
     hooksconfig={},
@@ -0,0 +1,11 @@
+"""Benchmark för Noppanalys - syntetiska textilbilder och reproducerbar tidsmätning
+
+Körs från src-katalogen:
+
+    python -m benchmark run --sizes 1 5 --output resultat.json
+    python -m benchmark compare resultat.json baslinje.json
+    python -m benchmark parity --images prov1.jpg prov2.jpg
+"""
+from benchmark.synthetic import generate_textile, image_shape_for_megapixels
+from benchmark.parity import run_parity, build_corpus
+from benchmark.suite import run_suite, compare_results, load_results, save_results
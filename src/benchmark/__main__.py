@@ -0,0 +1,88 @@
+"""Kommandorad för benchmarken: python -m benchmark run|compare|parity"""
+import argparse
+import json
+import sys
+
+from benchmark.parity import build_corpus, format_summary, run_parity
+from benchmark.suite import (BENCHMARK_SIZES, WORKER_COUNTS, compare_results, format_comparison,
+                             load_results, run_suite, save_results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmark", description="Noppanalys benchmark")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="Kör benchmarken på syntetiska bilder")
+    run_parser.add_argument('--sizes', type=float, nargs='+', default=list(BENCHMARK_SIZES),
+                            help="Bildstorlekar i megapixlar")
+    run_parser.add_argument('--methods', nargs='+', help="Analysmetoder (standard: alla)")
+    run_parser.add_argument('--repeats', type=int, default=3, help="Antal tidsmätta körningar per metod")
+    run_parser.add_argument('--workers', type=int, nargs='*', default=list(WORKER_COUNTS),
+                            help="Antal arbetsprocesser för skalningsmätning (tom lista hoppar över)")
+    run_parser.add_argument('--scaling-size', type=float, default=1, help="Bildstorlek för skalningsmätning (MP)")
+    run_parser.add_argument('--pattern', choices=['knit', 'woven'], default='knit')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--parameters', type=json.loads, default=None,
+                            help='Analysparametrar som JSON, t.ex. \'{"threshold": 90}\'')
+    run_parser.add_argument('--no-memory', action='store_true', help="Hoppa över minnesmätning")
+    run_parser.add_argument('--time-budget', type=float, default=600.0,
+                            help="Hoppa över storlekar där en metod uppskattas ta längre tid (s)")
+    run_parser.add_argument('--output', default='benchmark_resultat.json')
+    run_parser.add_argument('--baseline', help="Jämför mot sparad baslinje efter körningen")
+    run_parser.add_argument('--tolerance', type=float, default=0.10)
+
+    compare_parser = commands.add_parser('compare', help="Jämför två sparade resultat")
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('--tolerance', type=float, default=0.10)
+
+    parity_parser = commands.add_parser('parity', help="Jämför snabba kärnor mot referenskoden")
+    parity_parser.add_argument('--images', nargs='*', default=[], help="Riktiga bilder att ta med i korpusen")
+    parity_parser.add_argument('--size', type=float, default=0.1, help="Storlek på syntetiska bilder (MP)")
+    parity_parser.add_argument('--seeds', type=int, nargs='+', default=[0])
+    parity_parser.add_argument('--max-megapixels', type=float, default=0.25,
+                               help="Riktiga bilder skalas ner till högst denna storlek")
+    parity_parser.add_argument('--kernels', nargs='+', help="Kärnor att testa (standard: alla i FAST_PATHS)")
+    parity_parser.add_argument('--methods', nargs='+', help="Metoder att testa från ände till ände (standard: alla)")
+    parity_parser.add_argument('--parameters', type=json.loads, nargs='+', default=None,
+                               help="En eller flera parameteruppsättningar som JSON")
+    parity_parser.add_argument('--repeats', type=int, default=1)
+    parity_parser.add_argument('--output', help="Spara rapporten som JSON")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'parity':
+        corpus = build_corpus(args.images, megapixels=args.size, seeds=args.seeds,
+                              max_megapixels=args.max_megapixels)
+        report = run_parity(corpus, kernels=args.kernels, methods=args.methods,
+                            parameter_sets=args.parameters, repeats=args.repeats)
+        print(format_summary(report['summary']))
+        if args.output:
+            save_results(report, args.output)
+            print(f"Rapport sparad: {args.output}")
+        return 0 if all(entry['passed'] for entry in report['summary'].values()) else 1
+
+    if args.command == 'run':
+        results = run_suite(sizes=args.sizes, methods=args.methods, repeats=args.repeats,
+                            measure_memory=not args.no_memory, worker_counts=args.workers,
+                            scaling_size=args.scaling_size, pattern=args.pattern, seed=args.seed,
+                            parameters=args.parameters, time_budget=args.time_budget)
+        save_results(results, args.output)
+        print(f"Resultat sparat: {args.output}")
+        if not args.baseline:
+            return 0
+        current, baseline = results, load_results(args.baseline)
+    else:
+        current, baseline = load_results(args.current), load_results(args.baseline)
+
+    rows, regressions = compare_results(current, baseline, tolerance=args.tolerance)
+    print(format_comparison(rows))
+    if regressions:
+        print(f"{len(regressions)} regression(er) över {args.tolerance:.0%}")
+        return 1
+    print("Inga regressioner")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+"""Paritetstest: snabba kärnor mot referenskoden (orakel) på syntetiska och riktiga bilder"""
+import time
+
+import cv2
+import numpy as np
+from scipy import ndimage
+
+from benchmark.synthetic import PATTERNS, generate_textile
+from noppanalys_headless import HeadlessAnalyzer, read_image
+from noppanalys_kernels import FAST_PATHS, fast_paths
+from noppanalys_metrics import mask_iou
+
+# Toleranser för flyttalsjämförelser (feature maps och stats)
+RTOL = 1e-6
+ATOL = 1e-8
+# Minsta IoU mellan referens- och snabb mask för att räknas som samma resultat
+MIN_IOU = 0.999
+
+
+def compare_arrays(reference, candidate, rtol=RTOL, atol=ATOL):
+    """Jämför två arrayer inom tolerans"""
+    reference = np.asarray(reference)
+    candidate = np.asarray(candidate)
+    if reference.shape != candidate.shape:
+        return {'passed': False, 'reason': f"form {reference.shape} != {candidate.shape}"}
+    difference = np.abs(reference.astype(np.float64) - candidate.astype(np.float64))
+    max_abs = float(difference.max()) if difference.size else 0.0
+    passed = bool(np.allclose(candidate, reference, rtol=rtol, atol=atol))
+    return {'passed': passed, 'max_abs_diff': max_abs}
+
+
+def arrays_match(reference, candidate, rtol=RTOL, atol=ATOL):
+    """Arrayvärda stats: flyttal inom tolerans, övriga exakt (olika form eller typ räknas som avvikelse)"""
+    try:
+        reference = np.asarray(reference)
+        candidate = np.asarray(candidate)
+        if reference.shape != candidate.shape:
+            return False
+        if not (reference.dtype.kind in 'fc' or candidate.dtype.kind in 'fc'):
+            return bool(np.array_equal(reference, candidate))
+        return bool(np.allclose(candidate.astype(np.float64), reference.astype(np.float64),
+                                rtol=rtol, atol=atol, equal_nan=True))
+    except (TypeError, ValueError):
+        return False
+
+
+def compare_stats(reference, candidate, rtol=RTOL, atol=ATOL, prefix=''):
+    """Jämför stats-dictar fält för fält, returnerar lista av avvikande fält"""
+    mismatches = []
+    for key in sorted(set(reference) | set(candidate)):
+        name = f"{prefix}{key}"
+        if key not in reference or key not in candidate:
+            mismatches.append({'field': name, 'reference': reference.get(key), 'candidate': candidate.get(key)})
+            continue
+
+        ref_value, cand_value = reference[key], candidate[key]
+        if isinstance(ref_value, dict) and isinstance(cand_value, dict):
+            mismatches.extend(compare_stats(ref_value, cand_value, rtol, atol, prefix=f"{name}."))
+        elif isinstance(ref_value, (int, float, np.number)) and isinstance(cand_value, (int, float, np.number)):
+            if not np.isclose(float(cand_value), float(ref_value), rtol=rtol, atol=atol):
+                mismatches.append({'field': name, 'reference': ref_value, 'candidate': cand_value})
+        elif isinstance(ref_value, (np.ndarray, list, tuple)) or isinstance(cand_value, (np.ndarray, list, tuple)):
+            if not arrays_match(ref_value, cand_value, rtol, atol):
+                mismatches.append({'field': name, 'reference': ref_value, 'candidate': cand_value})
+        elif ref_value != cand_value:
+            mismatches.append({'field': name, 'reference': ref_value, 'candidate': cand_value})
+    return mismatches
+
+
+def compare_results(reference, candidate, rtol=RTOL, atol=ATOL, min_iou=MIN_IOU):
+    """Jämför (mask, feature_map, stats) från en analysmetod"""
+    ref_mask, ref_features, ref_stats = reference
+    cand_mask, cand_features, cand_stats = candidate
+    if ref_mask is None or cand_mask is None:
+        return {'passed': ref_mask is None and cand_mask is None, 'reason': "metoden gav inget resultat"}
+
+    iou = mask_iou(ref_mask, cand_mask)
+    features = compare_arrays(ref_features, cand_features, rtol, atol)
+    mismatches = compare_stats(ref_stats, cand_stats, rtol, atol)
+    return {
+        'passed': iou >= min_iou and features['passed'] and not mismatches,
+        'iou': iou,
+        'feature_max_abs_diff': features.get('max_abs_diff'),
+        'stats_mismatches': mismatches
+    }
+
+
+def timed_run(func, repeats):
+    """Bästa tid av repeats körningar; globala slumptalsfröet nollställs så att DPCA blir deterministisk"""
+    best = None
+    output = None
+    for _ in range(repeats):
+        np.random.seed(0)
+        start = time.perf_counter()
+        output = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return output, best
+
+
+def kernel_checks(analyzer):
+    """Kärnorna som testas: namn -> (körfunktion, jämförelse)"""
+    def run_local_variance():
+        return analyzer.local_variance(analyzer.lbp_rgb[0])
+
+    def run_lbp():
+        analyzer.process_image()
+        return list(analyzer.lbp_rgb)
+
+    def run_dpca_feature_map():
+        return analyzer.create_dpca_feature_map(analyzer.gray_image)
+
+    # Morfologiska masken ger många regioner av varierande form att räkna på
+    stats_mask, stats_features, _ = analyzer.detect_nops_morphological()
+
+    def run_pilling_stats():
+        return analyzer.calculate_pilling_stats(stats_mask, stats_features)
+
+    binary = analyzer.morphological_binary(analyzer.morphological_enhance(analyzer.gray_image))
+    distance = ndimage.distance_transform_edt(binary)
+
+    def run_watershed():
+        return analyzer.watershed_mask(binary, distance, distance.max())
+
+    def compare_channels(reference, candidate):
+        results = [compare_arrays(r, c) for r, c in zip(reference, candidate)]
+        return {'passed': all(r['passed'] for r in results),
+                'max_abs_diff': max(r.get('max_abs_diff', np.inf) for r in results)}
+
+    def compare_stats_result(reference, candidate):
+        mismatches = compare_stats(reference, candidate)
+        return {'passed': not mismatches, 'stats_mismatches': mismatches}
+
+    return {
+        'local_variance': (run_local_variance, compare_arrays),
+        'lbp': (run_lbp, compare_channels),
+        'dpca_feature_map': (run_dpca_feature_map, compare_arrays),
+        'pilling_stats': (run_pilling_stats, compare_stats_result),
+        'watershed': (run_watershed, compare_arrays)
+    }
+
+
+def build_corpus(image_paths=(), megapixels=0.1, seeds=(0,), max_megapixels=0.25):
+    """Lista av (namn, bild): syntetiska bilder i alla mönster plus riktiga bilder, nedskalade vid behov.
+
+    Referenskoden har Python-loopar per pixel, så riktiga bilder skalas ner till
+    max_megapixels för att orakelkörningen ska ta rimlig tid.
+    """
+    corpus = []
+    for pattern in PATTERNS:
+        for seed in seeds:
+            image, _ = generate_textile(megapixels, pattern=pattern, seed=seed)
+            corpus.append((f"syntetisk-{pattern}-{seed}", image))
+
+    for path in image_paths:
+        image = read_image(path)
+        if image is None:
+            print(f"Kunde inte läsa {path} - hoppas över")
+            continue
+        pixels = image.shape[0] * image.shape[1]
+        if pixels > max_megapixels * 1_000_000:
+            scale = (max_megapixels * 1_000_000 / pixels) ** 0.5
+            size = (max(1, int(image.shape[1] * scale)), max(1, int(image.shape[0] * scale)))
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        corpus.append((path, image))
+    return corpus
+
+
+def run_parity(corpus, kernels=None, methods=None, parameter_sets=None, repeats=1):
+    """Kör referens och snabb variant för varje kärna och metod på varje bild.
+
+    Varje kärna testas för sig (bara dess flagga på). Metoderna testas från
+    ände till ände med alla valda kärnor på samtidigt, inklusive LBP-förbearbetning.
+    """
+    kernels = list(kernels or FAST_PATHS)
+    parameter_sets = parameter_sets or [{}]
+    all_off = {name: False for name in FAST_PATHS}
+    selected_on = {**all_off, **{name: True for name in kernels}}
+    rows = []
+
+    for image_name, image in corpus:
+        for parameters in parameter_sets:
+            analyzer = HeadlessAnalyzer(parameters)
+            with fast_paths(**all_off):
+                analyzer.set_image(image)
+                analyzer.process_image()
+            label = image_name if not parameters else f"{image_name} {parameters}"
+
+            with fast_paths(**all_off):
+                checks = kernel_checks(analyzer)
+            for name in kernels:
+                run, compare = checks[name]
+                with fast_paths(**all_off):
+                    reference, reference_seconds = timed_run(run, repeats)
+                with fast_paths(**{**all_off, name: True}):
+                    candidate, fast_seconds = timed_run(run, repeats)
+                rows.append({'image': label, 'kind': 'kärna', 'check': name,
+                             'reference_seconds': reference_seconds, 'fast_seconds': fast_seconds,
+                             'speedup': reference_seconds / max(fast_seconds, 1e-9),
+                             **compare(reference, candidate)})
+                print_row(rows[-1])
+
+            for method_name in (methods or analyzer.available_methods):
+                def run_method():
+                    analyzer.process_image()
+                    return analyzer.run_method(method_name)
+
+                with fast_paths(**all_off):
+                    reference, reference_seconds = timed_run(run_method, repeats)
+                with fast_paths(**selected_on):
+                    candidate, fast_seconds = timed_run(run_method, repeats)
+                rows.append({'image': label, 'kind': 'metod', 'check': method_name,
+                             'reference_seconds': reference_seconds, 'fast_seconds': fast_seconds,
+                             'speedup': reference_seconds / max(fast_seconds, 1e-9),
+                             **compare_results(reference, candidate)})
+                print_row(rows[-1])
+
+    return {'kernels': kernels, 'rows': rows, 'summary': summarize(rows)}
+
+
+def print_row(row):
+    """Skriv ut en rad direkt så att långa orakelkörningar syns medan de pågår"""
+    status = "OK " if row['passed'] else "FEL"
+    extra = f"  IoU {row['iou']:.4f}" if 'iou' in row else ""
+    print(f"  {status} {row['kind']:<6} {row['check']:<20} {row['speedup']:7.1f}x "
+          f"({row['reference_seconds']:.3f} s -> {row['fast_seconds']:.3f} s){extra}  [{row['image']}]")
+
+
+def summarize(rows):
+    """Per kärna/metod: klarade alla bilder, samt median- och minsta speedup"""
+    summary = {}
+    for row in rows:
+        entry = summary.setdefault(row['check'], {'kind': row['kind'], 'passed': True, 'speedups': []})
+        entry['passed'] = entry['passed'] and row['passed']
+        entry['speedups'].append(row['speedup'])
+    for entry in summary.values():
+        speedups = entry.pop('speedups')
+        entry['median_speedup'] = float(np.median(speedups))
+        entry['min_speedup'] = float(np.min(speedups))
+    return summary
+
+
+def format_summary(summary):
+    """Sammanfattning: vilka snabba kärnor som kan slås på som standard"""
+    lines = [f"{'Kontroll':<22} {'Typ':<6} {'Paritet':<8} {'Median':>8} {'Minst':>8}"]
+    for name, entry in summary.items():
+        lines.append(f"{name:<22} {entry['kind']:<6} {'OK' if entry['passed'] else 'FEL':<8} "
+                     f"{entry['median_speedup']:7.1f}x {entry['min_speedup']:7.1f}x")
+    ready = [name for name, entry in summary.items()
+             if entry['kind'] == 'kärna' and entry['passed'] and entry['median_speedup'] > 1.0]
+    lines.append("")
+    lines.append("Kan slås på som standard i FAST_PATHS: " + (", ".join(ready) if ready else "inga"))
+    return "\n".join(lines)
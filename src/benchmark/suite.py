@@ -0,0 +1,245 @@
+"""Tidsmätning av alla analysmetoder på syntetiska bilder, med JSON-resultat och baslinjejämförelse"""
+import json
+import multiprocessing
+import os
+import platform
+import time
+
+import cv2
+import numpy as np
+
+from benchmark.synthetic import generate_textile
+from noppanalys_headless import HeadlessAnalyzer
+from noppanalys_instrumentation import StageTimer, json_default
+
+BENCHMARK_SIZES = (1, 5, 20, 50)
+WORKER_COUNTS = (1, 2, 4)
+RESULTS_VERSION = 1
+
+
+def environment_info():
+    """Miljö som resultaten mättes i - jämförelser mellan olika maskiner är vanskliga"""
+    import scipy
+    import skimage
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'scipy': scipy.__version__,
+        'scikit-image': skimage.__version__
+    }
+
+
+def benchmark_method(analyzer, method_name, repeats=3, measure_memory=True):
+    """Mät en metod på analysatorns aktuella bild.
+
+    Tiden är bästa av repeats körningar utan tracemalloc. Minnestoppen mäts i en
+    separat körning eftersom tracemalloc gör Python-tunga steg mycket långsammare.
+    """
+    durations = []
+    stages = None
+    stats = {}
+    for _ in range(repeats):
+        timer = StageTimer()
+        start = time.perf_counter()
+        nop_mask, feature_map, stats = analyzer.run_method(method_name, timer)
+        durations.append(time.perf_counter() - start)
+        if nop_mask is None:
+            return {'method': method_name, 'error': 'Metoden gav inget resultat'}
+        if stages is None or durations[-1] == min(durations):
+            stages = timer.to_dict()['stages']
+
+    result = {
+        'method': method_name,
+        'seconds': min(durations),
+        'seconds_all': durations,
+        'stages': stages,
+        'num_pills': int(stats.get('num_pills', 0)),
+        'nop_percentage': float(stats.get('nop_percentage', 0.0))
+    }
+
+    if measure_memory:
+        timer = StageTimer(track_memory=True)
+        with timer.stage('total'):
+            analyzer.run_method(method_name)
+        result['peak_bytes'] = timer.stages[0]['peak_bytes']
+
+    return result
+
+
+def _init_scaling_worker(megapixels, pattern, seed, parameters, barrier):
+    """Förbered en arbetsprocess: generera bilden en gång och vänta in de andra vid start"""
+    global _worker_analyzer, _worker_barrier
+    # En tråd per process så att skalningen mäts mellan processer, inte inom OpenCV
+    cv2.setNumThreads(1)
+    image, _ = generate_textile(megapixels, pattern=pattern, seed=seed)
+    _worker_analyzer = HeadlessAnalyzer(parameters)
+    _worker_analyzer.set_image(image)
+    _worker_analyzer.process_image()
+    _worker_barrier = barrier
+
+
+def _scaling_job(method_name):
+    """Kör en analys när alla arbetsprocesser är redo, returnerar (start, slut) i väggklocktid"""
+    _worker_barrier.wait()
+    start = time.time()
+    _worker_analyzer.run_method(method_name)
+    return start, time.time()
+
+
+def measure_worker_scaling(method_name, megapixels, worker_counts=WORKER_COUNTS, pattern='knit',
+                           seed=0, parameters=None):
+    """Genomströmning när flera bilder analyseras samtidigt i separata processer"""
+    context = multiprocessing.get_context('spawn')
+    rows = []
+    for workers in worker_counts:
+        barrier = context.Barrier(workers)
+        with context.Pool(workers, initializer=_init_scaling_worker,
+                          initargs=(megapixels, pattern, seed, parameters, barrier)) as pool:
+            spans = pool.map(_scaling_job, [method_name] * workers, chunksize=1)
+        wall = max(end for _, end in spans) - min(start for start, _ in spans)
+        rows.append({'workers': workers, 'seconds': wall, 'images_per_second': workers / wall})
+
+    base = rows[0]['images_per_second'] / rows[0]['workers']
+    for row in rows:
+        row['speedup'] = row['images_per_second'] / base
+        row['efficiency'] = row['speedup'] / row['workers']
+    return {'method': method_name, 'megapixels': megapixels, 'rows': rows}
+
+
+def run_suite(sizes=BENCHMARK_SIZES, methods=None, repeats=3, measure_memory=True,
+              worker_counts=WORKER_COUNTS, scaling_size=1, pattern='knit', seed=0,
+              parameters=None, time_budget=600.0):
+    """Kör hela benchmarken och returnera en JSON-serialiserbar resultat-dict.
+
+    En metod hoppas över på större storlekar om den linjärt uppskattade tiden
+    överstiger time_budget sekunder (t.ex. LBP:s Python-varians på 50 MP).
+    """
+    analyzer = HeadlessAnalyzer(parameters)
+    methods = list(methods or analyzer.available_methods)
+    unknown = [name for name in methods if name not in analyzer.available_methods]
+    if unknown:
+        raise ValueError(f"Okända analysmetoder: {', '.join(unknown)}")
+
+    results = []
+    last_measured = {}
+    for megapixels in sizes:
+        image, truth = generate_textile(megapixels, pattern=pattern, seed=seed)
+        load_timer = StageTimer()
+        analyzer.original_image = image
+        analyzer.full_original_image = image
+        analyzer.preprocess_image(load_timer)
+        with load_timer.stage('lbp'):
+            analyzer.process_image()
+        print(f"{megapixels} MP ({image.shape[1]}x{image.shape[0]}, {truth['pill_count']} noppor): "
+              f"förbearbetning {load_timer.total_seconds():.2f} s")
+
+        for method_name in methods:
+            entry = {'megapixels': megapixels, 'shape': image.shape[:2], 'true_pills': truth['pill_count']}
+            previous = last_measured.get(method_name)
+            if previous is not None:
+                estimate = previous[1] * megapixels / previous[0]
+                if estimate > time_budget:
+                    entry.update({'method': method_name, 'skipped': True,
+                                  'reason': f"uppskattad tid {estimate:.0f} s > {time_budget:.0f} s"})
+                    print(f"  {method_name:<20} hoppas över ({entry['reason']})")
+                    results.append(entry)
+                    continue
+
+            entry.update(benchmark_method(analyzer, method_name, repeats, measure_memory))
+            entry['preprocess_seconds'] = load_timer.total_seconds()
+            results.append(entry)
+
+            if 'seconds' in entry:
+                last_measured[method_name] = (megapixels, entry['seconds'])
+                memory = f", topp {entry['peak_bytes'] / 2**20:.0f} MB" if 'peak_bytes' in entry else ""
+                print(f"  {method_name:<20} {entry['seconds']:8.2f} s{memory}")
+            else:
+                print(f"  {method_name:<20} fel: {entry['error']}")
+        del image, truth
+
+    scaling = []
+    if worker_counts:
+        worker_counts = [w for w in worker_counts if w <= (os.cpu_count() or 1)] or [1]
+        for method_name in methods:
+            measured = last_measured.get(method_name)
+            if measured is None or measured[1] * scaling_size / measured[0] > time_budget:
+                continue
+            row = measure_worker_scaling(method_name, scaling_size, worker_counts, pattern, seed, parameters)
+            scaling.append(row)
+            print(f"  Skalning {method_name}: " +
+                  ", ".join(f"{r['workers']}: {r['speedup']:.2f}x" for r in row['rows']))
+
+    return {
+        'version': RESULTS_VERSION,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': environment_info(),
+        'settings': {
+            'sizes': list(sizes), 'repeats': repeats, 'pattern': pattern, 'seed': seed,
+            'parameters': parameters or {}, 'scaling_size': scaling_size, 'time_budget': time_budget
+        },
+        'results': results,
+        'scaling': scaling
+    }
+
+
+def save_results(results, path):
+    """Spara benchmarkresultat som JSON"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, default=json_default, ensure_ascii=False, indent=2)
+
+
+def load_results(path):
+    """Läs benchmarkresultat eller baslinje från JSON"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare_results(current, baseline, tolerance=0.10, memory_tolerance=0.20):
+    """Jämför mot baslinje, returnerar (rader, regressioner).
+
+    En regression är en metod/storlek som blivit mer än tolerance långsammare
+    (eller memory_tolerance mer minneskrävande) än i baslinjen.
+    """
+    def key(entry):
+        return entry['method'], entry['megapixels']
+
+    baseline_entries = {key(entry): entry for entry in baseline['results'] if 'seconds' in entry}
+    rows = []
+    regressions = []
+    for entry in current['results']:
+        reference = baseline_entries.get(key(entry))
+        if reference is None or 'seconds' not in entry:
+            continue
+
+        row = {
+            'method': entry['method'],
+            'megapixels': entry['megapixels'],
+            'seconds': entry['seconds'],
+            'baseline_seconds': reference['seconds'],
+            'time_ratio': entry['seconds'] / reference['seconds']
+        }
+        if 'peak_bytes' in entry and reference.get('peak_bytes'):
+            row['memory_ratio'] = entry['peak_bytes'] / reference['peak_bytes']
+
+        row['regression'] = (row['time_ratio'] > 1 + tolerance or
+                             row.get('memory_ratio', 1.0) > 1 + memory_tolerance)
+        rows.append(row)
+        if row['regression']:
+            regressions.append(row)
+
+    return rows, regressions
+
+
+def format_comparison(rows):
+    """Textuppställning av en baslinjejämförelse"""
+    lines = [f"{'Metod':<20} {'MP':>4} {'Tid (s)':>9} {'Baslinje':>9} {'Kvot':>6} {'Minne':>6}"]
+    for row in rows:
+        memory = f"{row['memory_ratio']:6.2f}" if 'memory_ratio' in row else f"{'-':>6}"
+        flag = "  REGRESSION" if row['regression'] else ""
+        lines.append(f"{row['method']:<20} {row['megapixels']:>4} {row['seconds']:9.2f} "
+                     f"{row['baseline_seconds']:9.2f} {row['time_ratio']:6.2f} {memory}{flag}")
+    return "\n".join(lines)
@@ -0,0 +1,125 @@
+"""Deterministisk generator av syntetiska stickade/vävda textilbilder med kända noppor"""
+import math
+
+import cv2
+import numpy as np
+
+PATTERNS = ('knit', 'woven')
+
+
+def image_shape_for_megapixels(megapixels, aspect=4 / 3):
+    """(höjd, bredd) för en bild med ungefär angivet antal megapixlar"""
+    width = int(round(math.sqrt(megapixels * 1_000_000 * aspect)))
+    height = int(round(width / aspect))
+    return height, width
+
+
+def knit_tile(period=12, course=10):
+    """En rapport av slätstickning: V-formade maskor i varje maskstav"""
+    y, x = np.mgrid[:course, :period].astype(np.float32)
+    u = np.abs(x / period - 0.5)
+    v = y / course
+    # Avstånd till maskans ben som lutar utåt nedåt i raden
+    legs = np.exp(-((u - 0.35 * v - 0.08) / 0.09) ** 2)
+    return 0.35 + 0.65 * legs
+
+
+def woven_tile(period=8):
+    """En rapport av tuskaft: varp och inslag går omväxlande över och under"""
+    y, x = np.mgrid[:2 * period, :2 * period].astype(np.float32)
+    warp = np.cos(np.pi * (x % period) / period - np.pi / 2) ** 2
+    weft = np.cos(np.pi * (y % period) / period - np.pi / 2) ** 2
+    warp_on_top = ((x // period + y // period) % 2) == 0
+    return 0.3 + 0.7 * np.where(warp_on_top, warp, weft)
+
+
+def place_pills(rng, shape, count, radius_range, max_attempts=50):
+    """Slumpa nopplägen utan överlapp, returnerar lista av (x, y, r)"""
+    height, width = shape
+    pills = []
+    centers = np.empty((0, 2), dtype=np.float64)
+    radii = np.empty(0, dtype=np.float64)
+
+    for _ in range(count):
+        for _ in range(max_attempts):
+            r = int(rng.integers(radius_range[0], radius_range[1] + 1))
+            # Marginal så att nopparnas mjuka kant (r + 2) ryms i bilden
+            x = int(rng.integers(r + 2, width - r - 2))
+            y = int(rng.integers(r + 2, height - r - 2))
+            # Minst två pixlars mellanrum så att nopporna går att räkna var för sig
+            if len(pills) == 0 or np.all(np.hypot(centers[:, 0] - x, centers[:, 1] - y) > radii + r + 2):
+                pills.append((x, y, r))
+                centers = np.vstack([centers, (x, y)])
+                radii = np.append(radii, r)
+                break
+    return pills
+
+
+def draw_pill(image, mask, rng, x, y, r, brightness):
+    """Rita en fluffig nopp (mjuk kant och fiberbrus) och markera den i facitmasken"""
+    pad = r + 2
+    y0, y1 = y - pad, y + pad + 1
+    x0, x1 = x - pad, x + pad + 1
+    yy, xx = np.mgrid[y0:y1, x0:x1]
+    distance = np.hypot(xx - x, yy - y)
+
+    alpha = np.clip(1.5 * (1.0 - distance / (r + 1)), 0.0, 1.0)[..., None]
+    fibres = rng.normal(0.0, 12.0, alpha.shape[:2])[..., None]
+    patch = image[y0:y1, x0:x1].astype(np.float32)
+    pill_color = np.clip(patch.mean(axis=(0, 1)) + brightness + fibres, 0, 255)
+    image[y0:y1, x0:x1] = np.clip(patch * (1 - alpha) + pill_color * alpha, 0, 255).astype(np.uint8)
+
+    mask[y0:y1, x0:x1][distance <= r] = 1
+
+
+def generate_textile(megapixels=1.0, pattern='knit', pill_count=None, pill_density=40,
+                     pill_radius=(3, 8), color=(90, 120, 150), noise=6.0, seed=0, shape=None):
+    """Syntetisk textilbild (BGR) med kända noppor.
+
+    Samma argument ger alltid samma bild. Antalet noppor är pill_count, eller
+    pill_density per megapixel om det inte anges. Returnerar (bild, facit) där
+    facit innehåller nopplägen, radier, antal, noppyta och en binär facitmask.
+    """
+    if pattern not in PATTERNS:
+        raise ValueError(f"Okänt mönster: {pattern} (välj bland {', '.join(PATTERNS)})")
+
+    rng = np.random.default_rng(seed)
+    height, width = shape if shape is not None else image_shape_for_megapixels(megapixels)
+    if pill_count is None:
+        pill_count = int(round(pill_density * height * width / 1_000_000))
+
+    # Textur: en rapport upprepas över bilden, förskjuten slumpmässigt
+    tile = knit_tile() if pattern == 'knit' else woven_tile()
+    reps_y = height // tile.shape[0] + 2
+    reps_x = width // tile.shape[1] + 2
+    oy = int(rng.integers(0, tile.shape[0]))
+    ox = int(rng.integers(0, tile.shape[1]))
+    texture = np.tile(tile, (reps_y, reps_x))[oy:oy + height, ox:ox + width]
+
+    # Långsam belysningsvariation och sensorbrus
+    gradient = np.linspace(-8, 8, width, dtype=np.float32)[None, :]
+    gray = texture * 90.0 + 80.0 + gradient
+    gray += noise * rng.standard_normal((height, width), dtype=np.float32)
+    gray = np.clip(gray, 0, 255).astype(np.uint8)
+    del texture
+
+    # Färgsätt genom att skala gråbilden per kanal (BGR)
+    tint = np.asarray(color, dtype=np.float32) / 128.0
+    image = cv2.merge([cv2.convertScaleAbs(gray, alpha=float(t)) for t in tint])
+    del gray
+
+    mask = np.zeros((height, width), dtype=np.uint8)
+    pills = place_pills(rng, (height, width), pill_count, pill_radius)
+    for x, y, r in pills:
+        draw_pill(image, mask, rng, x, y, r, brightness=float(rng.uniform(50, 80)))
+
+    truth = {
+        'pattern': pattern,
+        'seed': seed,
+        'shape': (height, width),
+        'pills': pills,
+        'pill_count': len(pills),
+        'pill_area': int(mask.sum()),
+        'mask': mask
+    }
+    return image, truth
@@ -0,0 +1,183 @@
+"""Beständig resultatcache på disk, nycklad på bildinnehåll, metod och parametrar"""
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from noppanalys_instrumentation import json_default
+
+# Höj versionen när en analysmetod ändras så att gamla resultat inte används
+CACHE_VERSION = 3
+
+DEFAULT_MAX_BYTES = 1024 * 2**20
+
+# Parametrar (nycklar i get_parameter_snapshot, plus elevmodellens filidentitet
+# student_model från run_detection) som påverkar respektive metod.
+# Metoder som saknas här nycklas på alla parametrar.
+METHOD_PARAMETERS = {
+    "LBP + Varians": ('threshold', 'weights'),
+    "Fourier + Gauss": ('threshold', 'gauss_sigma'),
+    "Morfologisk": (),
+    "Wavelet Transform": ('threshold', 'wavelet', 'wavelet_pyramid', 'wavelet_level', 'size_reference'),
+    "Kombinerad": ('threshold', 'weights', 'gauss_sigma', 'wavelet', 'wavelet_pyramid', 'wavelet_level',
+                   'size_reference', 'lazy_consensus'),
+    "DPCA + ML": ('patch_size', 'sampling_step', 'num_filters', 'classifier',
+                  'feature_augment', 'cross_validation', 'distilled', 'student_model')
+}
+
+
+def default_cache_dir():
+    """Cachekatalog: NOPPANALYS_CACHE_DIR, annars användarens cachekatalog"""
+    if os.environ.get('NOPPANALYS_CACHE_DIR'):
+        return os.environ['NOPPANALYS_CACHE_DIR']
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+        return os.path.join(base, 'Noppanalys', 'cache')
+    base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'noppanalys')
+
+
+def image_digest(image):
+    """Snabb innehållshash av avkodade pixlar (form och datatyp ingår)"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{image.shape}{image.dtype}".encode())
+    digest.update(np.ascontiguousarray(image).data)
+    return digest.hexdigest()
+
+
+def pack_mask(mask):
+    """Binär mask som bitpackade bytes (1 bit per pixel)"""
+    return np.packbits(np.asarray(mask) > 0)
+
+
+def unpack_mask(bits, shape):
+    """Återställ en uint8-mask (0/1) från pack_mask"""
+    count = int(np.prod(shape))
+    return np.unpackbits(bits, count=count).reshape(shape)
+
+
+class ResultCache:
+    """Innehållsadresserad cache: en .npz (mask + feature map) och en .json (stats) per post.
+
+    Storleken hålls under max_bytes genom att de minst nyligen använda posterna
+    tas bort (LRU via filernas ändringstid, som uppdateras vid träff).
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def make_key(self, digest, method_name, parameters):
+        """Nyckel av bildhash, metod och de parametrar som påverkar metoden"""
+        relevant = METHOD_PARAMETERS.get(method_name)
+        if relevant is not None:
+            parameters = {name: parameters[name] for name in relevant if name in parameters}
+        payload = json.dumps({'version': CACHE_VERSION, 'image': digest, 'method': method_name,
+                              'parameters': parameters}, sort_keys=True, default=json_default)
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=20).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + '.npz', base + '.json'
+
+    def get(self, key):
+        """(mask, feature_map, stats) för nyckeln, eller None vid miss"""
+        array_path, stats_path = self._paths(key)
+        try:
+            with open(stats_path, 'r', encoding='utf-8') as f:
+                stats = json.load(f)
+            with np.load(array_path) as data:
+                mask = unpack_mask(data['mask_bits'], tuple(data['mask_shape']))
+                feature_map = data['feature_map'].astype(np.float32)
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+
+        # Markera som nyligen använd för LRU
+        try:
+            os.utime(stats_path)
+        except OSError:
+            pass
+        self.hits += 1
+        stats['cached'] = True
+        return mask, feature_map, stats
+
+    def put(self, key, mask, feature_map, stats):
+        """Spara ett resultat och håll cachen under storleksgränsen"""
+        array_path, stats_path = self._paths(key)
+        feature_map = np.asarray(feature_map)
+        # float16 räcker för visning - stats sparas exakt i JSON
+        if feature_map.size and np.isfinite(feature_map).all() and np.abs(feature_map).max() < 65000:
+            feature_map = feature_map.astype(np.float16)
+
+        with self._lock:
+            tmp_array = array_path + '.tmp.npz'
+            tmp_stats = stats_path + '.tmp'
+            try:
+                np.savez(tmp_array, mask_bits=pack_mask(mask), mask_shape=np.array(mask.shape),
+                         feature_map=feature_map)
+                with open(tmp_stats, 'w', encoding='utf-8') as f:
+                    json.dump(stats, f, default=json_default, ensure_ascii=False)
+                os.replace(tmp_array, array_path)
+                # Stats skrivs sist så att en post bara syns när båda filerna finns
+                os.replace(tmp_stats, stats_path)
+            except OSError as e:
+                print(f"Kunde inte spara i resultatcachen: {e}")
+                for path in (tmp_array, tmp_stats):
+                    if os.path.exists(path):
+                        os.remove(path)
+                return
+            self.evict(keep=key)
+
+    def entries(self):
+        """Lista av (senast använd, storlek, nyckel) för alla poster"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            key = name[:-len('.json')]
+            array_path, stats_path = self._paths(key)
+            try:
+                used = os.path.getmtime(stats_path)
+                size = os.path.getsize(stats_path) + os.path.getsize(array_path)
+            except OSError:
+                continue
+            entries.append((used, size, key))
+        return entries
+
+    def size_bytes(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep=None):
+        """Ta bort minst nyligen använda poster tills cachen ryms i max_bytes (utom keep)"""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            self._remove(key)
+            total -= size
+
+    def clear(self):
+        """Töm cachen, returnerar antal frigjorda bytes"""
+        with self._lock:
+            freed = 0
+            for _, size, key in self.entries():
+                self._remove(key)
+                freed += size
+            return freed
+
+    def _remove(self, key):
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
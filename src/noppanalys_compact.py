@@ -0,0 +1,68 @@
+"""Kompakt lagring av analysresultat: bitpackad mask och kvantiserad feature map.
+
+Jämförelseläget håller ett resultat per metod i minnet. I stället för en full
+uint8-mask och en float64-feature map sparas masken med 1 bit per pixel och
+feature map som uint8 med linjär skala (1/64 av float64). Visningen skalar
+ändå om feature map till färgskalan, så kvantiseringen syns inte i panelerna.
+Stats sparas exakt.
+"""
+import numpy as np
+
+from noppanalys_cache import pack_mask, unpack_mask
+
+# Antal nivåer i den kvantiserade feature map
+FEATURE_LEVELS = 255
+
+
+def quantize_features(feature_map):
+    """Feature map som (uint8-data, min, max); icke-ändliga värden sätts till min"""
+    values = np.asarray(feature_map, dtype=np.float32)
+    finite = np.isfinite(values)
+    if not finite.any():
+        return np.zeros(values.shape, dtype=np.uint8), 0.0, 0.0
+
+    low = float(values[finite].min())
+    high = float(values[finite].max())
+    if high <= low:
+        return np.zeros(values.shape, dtype=np.uint8), low, high
+
+    scaled = (np.where(finite, values, low) - low) * (FEATURE_LEVELS / (high - low))
+    return np.rint(scaled).astype(np.uint8), low, high
+
+
+def dequantize_features(data, low, high):
+    """Återställ en float32-feature map från quantize_features"""
+    if high <= low:
+        return np.full(data.shape, low, dtype=np.float32)
+    return data.astype(np.float32) * np.float32((high - low) / FEATURE_LEVELS) + np.float32(low)
+
+
+class CompactResult:
+    """Ett analysresultat (mask, feature map, stats) i komprimerad form.
+
+    mask och features packas upp vid varje åtkomst - anroparen ska bara hålla
+    den uppackade arrayen så länge den behövs för att rita en panel.
+    """
+
+    def __init__(self, mask, feature_map, stats):
+        mask = np.asarray(mask)
+        self.shape = mask.shape
+        self.mask_bits = pack_mask(mask)
+        self.feature_shape = np.shape(feature_map)
+        self.feature_data, self.feature_min, self.feature_max = quantize_features(feature_map)
+        self.stats = stats
+
+    @property
+    def mask(self):
+        """Masken som uint8 (0/1) i full upplösning"""
+        return unpack_mask(self.mask_bits, self.shape)
+
+    @property
+    def features(self):
+        """Feature map som float32 i full upplösning"""
+        return dequantize_features(self.feature_data, self.feature_min, self.feature_max)
+
+    @property
+    def nbytes(self):
+        """Minnesåtgång för de komprimerade arrayerna"""
+        return self.mask_bits.nbytes + self.feature_data.nbytes
@@ -0,0 +1,352 @@
+"""Destillering av Ensemble-klassificeraren (SVM + MLP + Random Forest, soft voting) till en snabb elevmodell
+
+Körs från src-katalogen:
+
+    python noppanalys_distill.py bilder/*.jpg --samples 200 --workers 4
+    python noppanalys_distill.py --feature-store --samples 200
+
+Ensemblen i classify_with_advanced_ml tränas om kring varje bild, vilket tar
+sekunder per bild. Här körs den (läraren) en gång per featurevektor från
+featurebanken och/eller bilderna, plus slumpmässigt skalade varianter av dem,
+och dess sannolikheter för grad 1-5 sparas. Eleven är en multinomial logistisk
+regression på de features som bäst skiljer lärarens grader åt, tränad mot
+lärarens sannolikheter (mjuka etiketter via sample_weight). Eleven sparas som
+JSON och körs med ren numpy - ingen sklearn behövs vid inferens.
+
+Överensstämmelse (samma grad), genomsnittlig sannolikhetsskillnad och tid per
+bild för lärare och elev mäts på vektorer som eleven inte tränats på och
+sparas tillsammans med modellen. GUI:t och HeadlessAnalyzer använder eleven
+för "Ensemble" när det finns en för featuretypen (avstängbart med parametern
+distilled).
+"""
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from noppanalys_instrumentation import json_default
+from noppanalys_learning import GRADES, feature_kind
+
+# Slumpmässiga skalfaktorer för varianterna av de verkliga featurevektorerna
+AUGMENT_SCALE = (0.6, 1.4)
+
+DEFAULT_SAMPLES = 200
+DEFAULT_STUDENT_FEATURES = 16
+DEFAULT_HOLDOUT = 0.25
+
+_worker_analyzer = None
+
+
+def default_student_path():
+    """Elevmodellernas fil: NOPPANALYS_STUDENTS, annars i användarens datakatalog"""
+    if os.environ.get('NOPPANALYS_STUDENTS'):
+        return os.environ['NOPPANALYS_STUDENTS']
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+        return os.path.join(base, 'Noppanalys', 'elevmodeller.json')
+    base = os.environ.get('XDG_DATA_HOME', os.path.join(os.path.expanduser('~'), '.local', 'share'))
+    return os.path.join(base, 'noppanalys', 'elevmodeller.json')
+
+
+class DistilledStudent:
+    """Multinomial logistisk regression på utvalda features, utvärderad med numpy"""
+
+    def __init__(self, columns, mean, scale, coef, intercept, classes, report=None):
+        self.columns = np.asarray(columns, dtype=int)
+        self.mean = np.asarray(mean, dtype=float)
+        self.scale = np.asarray(scale, dtype=float)
+        self.coef = np.asarray(coef, dtype=float)
+        self.intercept = np.asarray(intercept, dtype=float)
+        self.classes = np.asarray(classes, dtype=int)
+        self.report = report or {}
+
+    def predict_proba(self, matrix):
+        """Sannolikhet per grad (kolumner i classes-ordning) för varje rad"""
+        matrix = np.atleast_2d(np.asarray(matrix, dtype=float))
+        scaled = (matrix[:, self.columns] - self.mean) / self.scale
+        logits = scaled @ self.coef.T + self.intercept
+        logits -= logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+    def predict(self, features):
+        """(grad, konfidens) för en featurevektor"""
+        probabilities = self.predict_proba(features)[0]
+        best = int(np.argmax(probabilities))
+        return int(self.classes[best]), float(probabilities[best])
+
+    def to_dict(self):
+        return {'columns': self.columns, 'mean': self.mean, 'scale': self.scale, 'coef': self.coef,
+                'intercept': self.intercept, 'classes': self.classes, 'report': self.report}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['columns'], data['mean'], data['scale'], data['coef'], data['intercept'],
+                   data['classes'], data.get('report'))
+
+
+class StudentStore:
+    """JSON-fil med en elevmodell per featuretyp"""
+
+    def __init__(self, path=None):
+        self.path = path or default_student_path()
+        self.lock = threading.Lock()
+        self.students = None
+        self.loaded_identity = None
+
+    def identity(self):
+        """(ändringstid, storlek) för filen, None om den saknas - ändras när eleverna tränas om"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def load(self):
+        """Läs elevmodellerna, på nytt om filen ändrats; en saknad eller trasig fil ger inga elever"""
+        with self.lock:
+            identity = self.identity()
+            if self.students is None or identity != self.loaded_identity:
+                self.students = {}
+                self.loaded_identity = identity
+                try:
+                    with open(self.path, encoding='utf-8') as f:
+                        data = json.load(f)
+                    self.students = {kind: DistilledStudent.from_dict(student) for kind, student in data.items()}
+                except FileNotFoundError:
+                    pass
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Kunde inte läsa elevmodellerna: {e}")
+            return self.students
+
+    def get(self, kind):
+        """Elevmodellen för featuretypen, None om ingen har destillerats"""
+        return self.load().get(kind)
+
+    def save(self, kind, student):
+        """Spara (eller ersätt) elevmodellen för featuretypen"""
+        students = dict(self.load())
+        students[kind] = student
+        payload = json.dumps({name: model.to_dict() for name, model in students.items()},
+                             default=json_default, ensure_ascii=False, indent=1)
+        with self.lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(payload)
+            os.replace(temp_path, self.path)
+            self.students = students
+            self.loaded_identity = self.identity()
+
+
+def teacher_probabilities(analyzer, features):
+    """Ensemblens sannolikheter för grad 1-5 (saknade grader får 0)"""
+    features = np.asarray(features, dtype=float)
+    clf, scaler, _, _ = analyzer.train_advanced_classifier(features, "Ensemble")
+    probabilities = clf.predict_proba(scaler.transform(features.reshape(1, -1)))[0]
+    result = np.zeros(len(GRADES))
+    for grade, probability in zip(clf.classes_, probabilities):
+        result[GRADES.index(int(grade))] = probability
+    return result
+
+
+def augment_vectors(vectors, count, seed=0):
+    """count vektorer: de verkliga först, sedan slumpmässigt skalade varianter av dem"""
+    vectors = np.asarray(vectors, dtype=float)
+    rng = np.random.default_rng(seed)
+    if count <= len(vectors):
+        return vectors[rng.permutation(len(vectors))[:count]]
+    sources = vectors[rng.integers(0, len(vectors), count - len(vectors))]
+    factors = rng.uniform(*AUGMENT_SCALE, size=sources.shape)
+    return np.vstack([vectors, sources * factors])
+
+
+def _init_worker():
+    global _worker_analyzer
+    from noppanalys_headless import HeadlessAnalyzer
+    _worker_analyzer = HeadlessAnalyzer()
+
+
+def _teacher_job(features):
+    start = time.perf_counter()
+    probabilities = teacher_probabilities(_worker_analyzer, features)
+    return probabilities, time.perf_counter() - start
+
+
+def label_with_teacher(vectors, workers=1):
+    """(sannolikheter, sekunder per vektor) från ensemblen, i samma ordning som vektorerna"""
+    if workers > 1:
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool:
+            results = list(pool.map(_teacher_job, vectors))
+    else:
+        _init_worker()
+        results = [_teacher_job(features) for features in vectors]
+    return np.array([probabilities for probabilities, _ in results]), np.array([seconds for _, seconds in results])
+
+
+def select_columns(matrix, probabilities, count):
+    """Index för de count features som bäst skiljer lärarens grader åt (F-test), i stigande ordning"""
+    if count >= matrix.shape[1]:
+        return np.arange(matrix.shape[1])
+    f_classif = importlib.import_module('sklearn.feature_selection').f_classif
+    labels = np.argmax(probabilities, axis=1)
+    if len(np.unique(labels)) < 2:
+        # En enda grad: behåll de features som varierar mest
+        scores = np.std(matrix, axis=0) / (np.abs(np.mean(matrix, axis=0)) + 1e-8)
+    else:
+        scores, _ = f_classif(matrix, labels)
+    scores = np.nan_to_num(scores, nan=0.0)
+    return np.sort(np.argsort(scores)[::-1][:count])
+
+
+def fit_student(matrix, probabilities, count=DEFAULT_STUDENT_FEATURES):
+    """Elevmodell tränad mot lärarens sannolikheter: varje vektor en gång per grad, viktad med sannolikheten"""
+    linear_model = importlib.import_module('sklearn.linear_model')
+    columns = select_columns(matrix, probabilities, count)
+    selected = matrix[:, columns]
+    mean = selected.mean(axis=0)
+    scale = selected.std(axis=0)
+    scale[scale == 0] = 1.0
+    scaled = (selected - mean) / scale
+
+    n, k = probabilities.shape
+    X = np.repeat(scaled, k, axis=0)
+    y = np.tile(np.array(GRADES), n)
+    weights = probabilities.ravel()
+    keep = weights > 1e-6
+    model = linear_model.LogisticRegression(C=10.0, max_iter=2000)
+    model.fit(X[keep], y[keep], sample_weight=weights[keep])
+    if len(model.classes_) == 1:
+        raise ValueError("Läraren gav bara en grad - eleven behöver minst två")
+    coef, intercept = model.coef_, model.intercept_
+    if coef.shape[0] == 1:
+        # Två grader: sklearn sparar en rad, softmax behöver en per grad
+        coef = np.vstack([-coef[0] / 2, coef[0] / 2])
+        intercept = np.array([-intercept[0] / 2, intercept[0] / 2])
+    return DistilledStudent(columns, mean, scale, coef, intercept, model.classes_)
+
+
+def student_report(student, matrix, probabilities, teacher_seconds):
+    """Överensstämmelse och tid för eleven jämfört med läraren på vektorerna"""
+    start = time.perf_counter()
+    for row in matrix:
+        student.predict(row)
+    student_seconds = (time.perf_counter() - start) / max(len(matrix), 1)
+
+    predicted = student.predict_proba(matrix)
+    full = np.zeros_like(probabilities)
+    for column, grade in enumerate(student.classes):
+        full[:, GRADES.index(int(grade))] = predicted[:, column]
+    teacher_grades = np.array(GRADES)[np.argmax(probabilities, axis=1)]
+    student_grades = np.array(GRADES)[np.argmax(full, axis=1)]
+    return {
+        'samples': len(matrix),
+        'agreement': float(np.mean(teacher_grades == student_grades)),
+        'within_one': float(np.mean(np.abs(teacher_grades - student_grades) <= 1)),
+        'probability_mae': float(np.mean(np.abs(full - probabilities))),
+        'teacher_ms': float(np.mean(teacher_seconds) * 1000),
+        'student_ms': student_seconds * 1000,
+        'speedup': float(np.mean(teacher_seconds) / max(student_seconds, 1e-9)),
+        'teacher_grades': {int(g): int(np.sum(teacher_grades == g)) for g in GRADES}
+    }
+
+
+def distill(vectors, samples=DEFAULT_SAMPLES, student_features=DEFAULT_STUDENT_FEATURES,
+            holdout=DEFAULT_HOLDOUT, workers=1, seed=0):
+    """Destillera ensemblen över vektorerna; returnerar eleven med utvärderingen i student.report"""
+    matrix = augment_vectors(vectors, samples, seed)
+    start = time.perf_counter()
+    probabilities, teacher_seconds = label_with_teacher(list(matrix), workers)
+    labelled = time.perf_counter() - start
+
+    order = np.random.default_rng(seed).permutation(len(matrix))
+    test_count = int(round(len(matrix) * holdout)) if len(matrix) > 4 else 0
+    test, train = order[:test_count], order[test_count:]
+    student = fit_student(matrix[train], probabilities[train], student_features)
+    evaluated = test if len(test) else train
+    student.report = student_report(student, matrix[evaluated], probabilities[evaluated], teacher_seconds[evaluated])
+    student.report.update({'train_samples': len(train), 'holdout': len(test) > 0,
+                           'real_vectors': len(vectors), 'labelling_seconds': labelled,
+                           'features': len(student.columns), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')})
+    return student
+
+
+def stored_vectors(feature_store, kind=None):
+    """Featurevektorer för avancerade features ur featurebanken, per featuretyp"""
+    vectors = {}
+    for name in feature_store.kinds():
+        if not name.startswith('advanced/') or (kind and name != kind):
+            continue
+        matrix = feature_store.table(name).matrix()
+        if len(matrix):
+            vectors[name] = np.asarray(matrix, dtype=float)
+    return vectors
+
+
+def format_student_report(kind, report):
+    """Kort textsammanfattning av en elevmodells utvärdering"""
+    basis = "ej tränade vektorer" if report.get('holdout') else "träningsvektorerna"
+    return (f"{kind}: {report['features']} features, {report['train_samples']} träningsvektorer "
+            f"({report['real_vectors']} verkliga)\n"
+            f"  Överensstämmelse med ensemblen: {report['agreement']:.1%} samma grad, "
+            f"{report['within_one']:.1%} inom en grad, sannolikhetsfel {report['probability_mae']:.3f} "
+            f"({report['samples']} {basis})\n"
+            f"  Tid per bild: ensemble {report['teacher_ms']:.0f} ms, elev {report['student_ms']:.3f} ms "
+            f"({report['speedup']:.0f}x)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Destillera Ensemble-klassificeraren till en snabb elevmodell")
+    parser.add_argument('images', nargs='*', help="Bildfiler eller mönster, t.ex. bilder/*.jpg")
+    parser.add_argument('--feature-store', nargs='?', const='', default=None,
+                        help="Ta också featurevektorer ur featurebanken (valfri katalog)")
+    parser.add_argument('--parameters', type=json.loads, default=None,
+                        help='Analysparametrar som JSON, t.ex. \'{"patch_size": 7}\'')
+    parser.add_argument('--samples', type=int, default=DEFAULT_SAMPLES,
+                        help="Antal vektorer att låta ensemblen klassificera (inklusive varianter)")
+    parser.add_argument('--features', type=int, default=DEFAULT_STUDENT_FEATURES, help="Antal features för eleven")
+    parser.add_argument('--holdout', type=float, default=DEFAULT_HOLDOUT, help="Andel vektorer för utvärdering")
+    parser.add_argument('--workers', type=int, default=1, help="Antal processer för ensemblen")
+    parser.add_argument('--output', default=None, help="Fil för elevmodellerna (standard: användarens)")
+    args = parser.parse_args(argv)
+
+    from noppanalys_features import FeatureStore
+    from noppanalys_headless import expand_paths
+    from noppanalys_inference import collect_features
+
+    store = FeatureStore(args.feature_store or None) if args.feature_store is not None else None
+    vectors = stored_vectors(store) if store is not None else {}
+    if args.images:
+        _, image_vectors, errors = collect_features(expand_paths(args.images), True, args.parameters, store)
+        for path, error in errors:
+            print(f"Fel i {path}: {error}")
+        for features in image_vectors:
+            kind = feature_kind('advanced', features)
+            vectors[kind] = np.vstack([vectors[kind], features]) if kind in vectors else np.array([features])
+    if not vectors:
+        parser.error("Inga featurevektorer - ange bilder eller --feature-store")
+
+    students = StudentStore(args.output)
+    for kind, matrix in vectors.items():
+        print(f"Destillerar {kind}: {len(matrix)} verkliga vektorer, {args.samples} till ensemblen...")
+        try:
+            student = distill(matrix, args.samples, args.features, args.holdout, args.workers)
+        except ValueError as e:
+            print(f"Fel: {e}")
+            continue
+        students.save(kind, student)
+        print(format_student_report(kind, student.report))
+    print(f"Elevmodeller sparade i {students.path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
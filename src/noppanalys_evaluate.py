@@ -0,0 +1,284 @@
+"""Utvärdering mot facit: noggrannhet, tid och minne per metod över ett annoterat dataset
+
+Körs från src-katalogen:
+
+    python noppanalys_evaluate.py dataset/manifest.csv --workers 4 --output utvardering.jsonl
+
+Manifestet är en CSV-fil med kolumnerna image, mask och grade (mask och grade
+får vara tomma). Sökvägar är relativa manifestets katalog. Masken är en
+binär bild där operatörens noppor är vita, grade är noppgraden 1-5 enligt
+ISO 12945-2.
+
+Per bild och metod mäts pixel-IoU, precision och täckning per noppa (en noppa
+räknas som träffad när minst MIN_PILL_OVERLAP av den mindre av två
+överlappande komponenter täcks), noppgrad (för metoder som ger en), tid och
+minnestopp. Minnestoppen mäts med tracemalloc i en separat körning eftersom
+tracemalloc gör Python-tunga steg långsammare. Sammanställningen visar vilka
+metoder som ligger på Pareto-fronten mellan tid och noggrannhet.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+from noppanalys_headless import HeadlessAnalyzer, read_image
+from noppanalys_instrumentation import StageTimer, append_jsonl
+from noppanalys_metrics import mask_iou
+
+# Andel av den mindre komponenten som måste överlappa för att en noppa ska räknas som träffad
+MIN_PILL_OVERLAP = 0.2
+
+# Noggrannhetsmått som kan användas för Pareto-fronten
+ACCURACY_METRICS = ('iou', 'f1', 'grade_accuracy')
+
+
+def load_manifest(path):
+    """Lista av {'image', 'mask', 'grade'} med absoluta sökvägar (mask/grade None om de saknas)"""
+    base = os.path.dirname(os.path.abspath(path))
+    entries = []
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            image = (row.get('image') or '').strip()
+            if not image:
+                continue
+            mask = (row.get('mask') or '').strip()
+            grade = (row.get('grade') or '').strip()
+            entries.append({
+                'image': os.path.join(base, image),
+                'mask': os.path.join(base, mask) if mask else None,
+                'grade': int(float(grade)) if grade else None
+            })
+    return entries
+
+
+def read_truth_mask(path):
+    """Facitmask som boolesk array, None om den inte kan läsas"""
+    mask = read_image(path)
+    if mask is None:
+        return None
+    return cv2.cvtColor(mask, cv2.COLOR_BGR2GRAY) > 127
+
+
+def match_pills(truth, mask, min_overlap=MIN_PILL_OVERLAP):
+    """Matcha sammanhängande komponenter, returnerar (träffade detekterade, detekterade, träffade facit, facit)"""
+    truth_count, truth_labels = cv2.connectedComponents(np.asarray(truth, dtype=np.uint8), connectivity=8)
+    mask_count, mask_labels = cv2.connectedComponents((np.asarray(mask) > 0).astype(np.uint8), connectivity=8)
+    truth_count -= 1
+    mask_count -= 1
+    if truth_count == 0 or mask_count == 0:
+        return 0, mask_count, 0, truth_count
+
+    truth_areas = np.bincount(truth_labels.ravel(), minlength=truth_count + 1)
+    mask_areas = np.bincount(mask_labels.ravel(), minlength=mask_count + 1)
+
+    # Överlapp per par (facit, detekterad) via en gemensam etikett
+    both = (truth_labels > 0) & (mask_labels > 0)
+    pair_ids = truth_labels[both].astype(np.int64) * (mask_count + 1) + mask_labels[both]
+    pairs, overlaps = np.unique(pair_ids, return_counts=True)
+    truth_ids, mask_ids = pairs // (mask_count + 1), pairs % (mask_count + 1)
+    smaller = np.minimum(truth_areas[truth_ids], mask_areas[mask_ids])
+    matched = overlaps >= min_overlap * smaller
+
+    matched_detections = len(np.unique(mask_ids[matched]))
+    matched_truth = len(np.unique(truth_ids[matched]))
+    return matched_detections, mask_count, matched_truth, truth_count
+
+
+def evaluate_method(analyzer, method_name, truth_mask=None, truth_grade=None, measure_memory=True):
+    """Kör en metod på analysatorns aktuella bild och jämför mot facit"""
+    # LBP och waveletpyramiden räknas om för varje metod så att tiden inte beror på vilken metod som kördes före
+    analyzer.lbp_rgb = None
+    analyzer.wavelet_pyramids = {}
+    timer = StageTimer()
+    start = time.perf_counter()
+    nop_mask, _, stats = analyzer.run_method(method_name, timer)
+    seconds = time.perf_counter() - start
+    if nop_mask is None:
+        return {'method': method_name, 'error': 'Metoden gav inget resultat'}
+
+    row = {'method': method_name, 'seconds': seconds, 'num_pills': int(stats.get('num_pills', 0)),
+           'nop_percentage': float(stats.get('nop_percentage', 0.0))}
+
+    if truth_mask is not None:
+        if truth_mask.shape != nop_mask.shape:
+            row['error'] = f"Facitmaskens storlek {truth_mask.shape} skiljer sig från bildens {nop_mask.shape}"
+        else:
+            row['iou'] = mask_iou(truth_mask, nop_mask)
+            matched_detections, detections, matched_truth, truth_pills = match_pills(truth_mask, nop_mask)
+            row['precision'] = matched_detections / detections if detections else (1.0 if not truth_pills else 0.0)
+            row['recall'] = matched_truth / truth_pills if truth_pills else 1.0
+            total = row['precision'] + row['recall']
+            row['f1'] = 2 * row['precision'] * row['recall'] / total if total else 0.0
+            row['truth_pills'] = truth_pills
+
+    if 'pilling_grade' in stats:
+        row['pilling_grade'] = int(stats['pilling_grade'])
+        if truth_grade is not None:
+            row['grade_error'] = row['pilling_grade'] - truth_grade
+
+    if measure_memory:
+        analyzer.lbp_rgb = None
+        analyzer.wavelet_pyramids = {}
+        memory_timer = StageTimer(track_memory=True)
+        with memory_timer.stage('total'):
+            analyzer.run_method(method_name)
+        row['peak_bytes'] = memory_timer.stages[0]['peak_bytes']
+    return row
+
+
+def _init_worker(parameters):
+    """Förbered en arbetsprocess med en analysator för alla bilder"""
+    global _worker_analyzer
+    _worker_analyzer = HeadlessAnalyzer(parameters)
+
+
+def _evaluate_job(entry, methods, measure_memory):
+    """Utvärdera alla metoder på en bild i datasetet"""
+    image = read_image(entry['image'])
+    if image is None:
+        raise ValueError(f"Kunde inte läsa bildfilen: {entry['image']}")
+    truth_mask = read_truth_mask(entry['mask']) if entry['mask'] else None
+    if entry['mask'] and truth_mask is None:
+        raise ValueError(f"Kunde inte läsa facitmasken: {entry['mask']}")
+
+    _worker_analyzer.set_image(image, entry['image'])
+    rows = []
+    for method_name in methods:
+        row = evaluate_method(_worker_analyzer, method_name, truth_mask, entry['grade'], measure_memory)
+        row.update({'image': entry['image'], 'megapixels': image.shape[0] * image.shape[1] / 1e6,
+                    'truth_grade': entry['grade']})
+        rows.append(row)
+    return rows
+
+
+def run_evaluation(entries, methods, parameters=None, workers=None, measure_memory=True, output=None):
+    """Utvärdera alla metoder på alla bilder i en processpool, returnerar en rad per bild och metod"""
+    rows = []
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers or multiprocessing.cpu_count(), mp_context=context,
+                             initializer=_init_worker, initargs=(parameters or {},)) as pool:
+        futures = {pool.submit(_evaluate_job, entry, methods, measure_memory): entry for entry in entries}
+        for done, future in enumerate(as_completed(futures), start=1):
+            entry = futures[future]
+            try:
+                image_rows = future.result()
+            except Exception as e:
+                print(f"Fel i {entry['image']}: {e}")
+                continue
+            rows.extend(image_rows)
+            if output:
+                for row in image_rows:
+                    append_jsonl(output, row)
+            print(f"[{done}/{len(entries)}] {os.path.basename(entry['image'])}")
+    return rows
+
+
+def summarize_methods(rows):
+    """En rad per metod med medelvärden över bilderna"""
+    summary = {}
+    for method_name in dict.fromkeys(row['method'] for row in rows):
+        method_rows = [row for row in rows if row['method'] == method_name and 'error' not in row]
+        entry = {'method': method_name, 'images': len(method_rows),
+                 'errors': sum(1 for row in rows if row['method'] == method_name and 'error' in row)}
+        for name in ('seconds', 'iou', 'precision', 'recall', 'f1', 'peak_bytes'):
+            values = [row[name] for row in method_rows if name in row]
+            if values:
+                entry[name] = float(np.mean(values))
+        megapixels = sum(row['megapixels'] for row in method_rows)
+        if megapixels:
+            entry['seconds_per_megapixel'] = sum(row['seconds'] for row in method_rows) / megapixels
+        if method_rows and 'peak_bytes' in method_rows[0]:
+            entry['max_peak_bytes'] = max(row['peak_bytes'] for row in method_rows)
+
+        graded = [row for row in method_rows if 'grade_error' in row]
+        if graded:
+            errors = np.array([row['grade_error'] for row in graded])
+            entry['grade_accuracy'] = float(np.mean(errors == 0))
+            entry['grade_within_one'] = float(np.mean(np.abs(errors) <= 1))
+            entry['grade_mae'] = float(np.mean(np.abs(errors)))
+        summary[method_name] = entry
+    return list(summary.values())
+
+
+def pareto_front(summary, accuracy='iou'):
+    """Markera metoder som ingen annan metod slår i både tid och noggrannhet"""
+    candidates = [entry for entry in summary if accuracy in entry]
+    for entry in summary:
+        entry['pareto'] = accuracy in entry and not any(
+            other is not entry and other['seconds'] <= entry['seconds'] and other[accuracy] >= entry[accuracy]
+            and (other['seconds'] < entry['seconds'] or other[accuracy] > entry[accuracy])
+            for other in candidates)
+    return sorted(summary, key=lambda entry: entry['seconds'])
+
+
+def format_pareto_table(summary, accuracy='iou'):
+    """Textuppställning: en rad per metod, snabbast först, * för Pareto-fronten"""
+    def value(entry, name, fmt):
+        return format(entry[name], fmt) if name in entry else '-'
+
+    lines = [f"=== UTVÄRDERING MOT FACIT - TID MOT {accuracy.upper()} ===", ""]
+    lines.append(f"{'':<2}{'Metod':<18} {'Bilder':<7} {'Tid (s)':<8} {'s/MP':<7} {'Minne MB':<9} {'IoU':<7} "
+                 f"{'Prec.':<7} {'Täckn.':<7} {'F1':<7} {'Grad':<7} {'±1':<7}")
+    lines.append("-" * 100)
+    for entry in summary:
+        memory = format(entry['peak_bytes'] / 2**20, '.0f') if 'peak_bytes' in entry else '-'
+        lines.append(f"{'*' if entry.get('pareto') else ' ':<2}{entry['method']:<18} {entry['images']:<7} "
+                     f"{value(entry, 'seconds', '.2f'):<8} {value(entry, 'seconds_per_megapixel', '.2f'):<7} "
+                     f"{memory:<9} {value(entry, 'iou', '.3f'):<7} {value(entry, 'precision', '.3f'):<7} "
+                     f"{value(entry, 'recall', '.3f'):<7} {value(entry, 'f1', '.3f'):<7} "
+                     f"{value(entry, 'grade_accuracy', '.2f'):<7} {value(entry, 'grade_within_one', '.2f'):<7}")
+    lines.append("")
+    lines.append("* = Pareto-front (ingen annan metod är både snabbare och noggrannare)")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Utvärdera analysmetoderna mot operatörsannoterat facit")
+    parser.add_argument('manifest', help="CSV med kolumnerna image, mask, grade")
+    parser.add_argument('--method', action='append', dest='methods',
+                        help="Analysmetod, kan anges flera gånger (standard: alla tillgängliga)")
+    parser.add_argument('--parameters', type=json.loads, default=None,
+                        help='Analysparametrar som JSON, t.ex. \'{"threshold": 90}\'')
+    parser.add_argument('--accuracy', choices=ACCURACY_METRICS, default='iou',
+                        help="Noggrannhetsmått för Pareto-fronten")
+    parser.add_argument('--workers', type=int, default=None, help="Antal arbetsprocesser (standard: antal kärnor)")
+    parser.add_argument('--no-memory', action='store_true', help="Hoppa över minnesmätningen (halverar körtiden)")
+    parser.add_argument('--limit', type=int, default=None, help="Utvärdera bara de första N bilderna")
+    parser.add_argument('--output', default=None, help="JSONL-fil för en rad per bild och metod")
+    parser.add_argument('--summary', default=None, help="JSON-fil för sammanställningen per metod")
+    args = parser.parse_args(argv)
+
+    entries = load_manifest(args.manifest)[:args.limit]
+    if not entries:
+        print("Manifestet innehåller inga bilder")
+        return 1
+
+    available = list(HeadlessAnalyzer().available_methods)
+    methods = args.methods or available
+    unknown = [name for name in methods if name not in available]
+    if unknown:
+        print(f"Okända analysmetoder: {', '.join(unknown)}")
+        return 1
+
+    start = time.perf_counter()
+    rows = run_evaluation(entries, methods, args.parameters, args.workers, not args.no_memory, args.output)
+    summary = pareto_front(summarize_methods(rows), args.accuracy)
+    print()
+    print(format_pareto_table(summary, args.accuracy))
+    print(f"\n{len(entries)} bilder x {len(methods)} metoder på {time.perf_counter() - start:.1f} s")
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            json.dump({'manifest': args.manifest, 'accuracy': args.accuracy, 'methods': summary}, f,
+                      ensure_ascii=False, indent=2)
+    return 0 if rows else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
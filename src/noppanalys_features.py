@@ -0,0 +1,196 @@
+"""Beständig featurebank: en rad featurevärden per analyserad bild, minnesmappad på disk
+
+Varje featuretyp (t.ex. avancerade features med eller utan utökade
+texturfeatures) har en katalog med
+
+    data.f32       float32-matris, en kolumn per feature och en rad per bild
+    index.jsonl    en rad per matrisrad: bildhash, parametrar, bild och tid
+
+Raderna läggs alltid till sist och skrivs aldrig om. Matrisen läses med
+np.memmap, så träning, utvärdering och batchvis predict_proba kan gå igenom
+den i block utan att allt läses in i minnet. Indexet är det som gäller: en
+matrisrad utan indexrad (avbrott mitt i en skrivning) ignoreras och skrivs
+över av nästa rad. En skrivande process åt gången.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from noppanalys_instrumentation import json_default
+
+DTYPE = np.float32
+DEFAULT_BATCH_ROWS = 4096
+
+
+def default_feature_dir():
+    """Featurebankens katalog: NOPPANALYS_FEATURES, annars i användarens datakatalog"""
+    if os.environ.get('NOPPANALYS_FEATURES'):
+        return os.environ['NOPPANALYS_FEATURES']
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+        return os.path.join(base, 'Noppanalys', 'features')
+    base = os.environ.get('XDG_DATA_HOME', os.path.join(os.path.expanduser('~'), '.local', 'share'))
+    return os.path.join(base, 'noppanalys', 'features')
+
+
+def parameter_key(parameters):
+    """Kort nyckel för de parametrar som påverkar featurevektorn"""
+    payload = json.dumps(parameters or {}, sort_keys=True, default=json_default)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=8).hexdigest()
+
+
+class FeatureTable:
+    """Featurematris och index för en featuretyp (fast antal kolumner)"""
+
+    def __init__(self, directory, kind):
+        self.kind = kind
+        self.directory = os.path.join(directory, kind.replace('/', '_'))
+        self.data_path = os.path.join(self.directory, 'data.f32')
+        self.index_path = os.path.join(self.directory, 'index.jsonl')
+        self.lock = threading.Lock()
+        self.columns = None
+        self.records = []
+        self.rows = {}
+        self._memmap = None
+        self.load_index()
+
+    def load_index(self):
+        """Läs indexet: (bildhash, parameternyckel) -> radnummer"""
+        self.records = []
+        self.rows = {}
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Halvskriven sista rad efter avbrott
+                if record['row'] != len(self.records):
+                    continue
+                self.columns = record['columns']
+                self.records.append(record)
+                self.rows[(record['digest'], record['parameters_key'])] = record['row']
+
+    def __len__(self):
+        return len(self.records)
+
+    def matrix(self):
+        """Skrivskyddad np.memmap (rader x kolumner) över alla indexerade rader"""
+        if not self.records:
+            return np.empty((0, self.columns or 0), dtype=DTYPE)
+        if self._memmap is None or self._memmap.shape[0] != len(self.records):
+            self._memmap = np.memmap(self.data_path, dtype=DTYPE, mode='r', shape=(len(self.records), self.columns))
+        return self._memmap
+
+    def get(self, digest, parameters=None):
+        """Featurevektorn för en bild och parametrar, None om den inte finns i banken"""
+        with self.lock:
+            row = self.rows.get((digest, parameter_key(parameters)))
+            if row is None:
+                return None
+            return np.array(self.matrix()[row])
+
+    def append(self, digest, features, parameters=None, **info):
+        """Lägg till en rad (om bilden inte redan finns), returnerar radnumret"""
+        features = np.asarray(features, dtype=DTYPE).ravel()
+        key = (digest, parameter_key(parameters))
+        with self.lock:
+            if key in self.rows:
+                return self.rows[key]
+            if self.columns is not None and len(features) != self.columns:
+                raise ValueError(f"{self.kind}: {len(features)} features, banken har {self.columns} kolumner")
+
+            os.makedirs(self.directory, exist_ok=True)
+            row = len(self.records)
+            # Mappningen släpps innan filen växer (krävs på Windows)
+            self._memmap = None
+            # Matrisraden skrivs före indexraden; en rad utan index skrivs över här
+            with open(self.data_path, 'ab') as f:
+                if f.tell() != row * features.nbytes:
+                    f.truncate(row * features.nbytes)
+                f.write(features.tobytes())
+            record = {'row': row, 'digest': digest, 'parameters_key': key[1], 'parameters': parameters or {},
+                      'columns': len(features), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), **info}
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, default=json_default, ensure_ascii=False) + "\n")
+
+            self.columns = len(features)
+            self.records.append(record)
+            self.rows[key] = row
+            return row
+
+    def rows_for(self, digests, parameters=None):
+        """Radnummer för bildhasharna (None där bilden saknas), i samma ordning"""
+        parameters_key = parameter_key(parameters)
+        return [self.rows.get((digest, parameters_key)) for digest in digests]
+
+    def iter_batches(self, batch_rows=DEFAULT_BATCH_ROWS, rows=None):
+        """Block av (radnummer, matrisutsnitt) - bara det aktuella blocket läses in i minnet"""
+        matrix = self.matrix()
+        if rows is None:
+            for start in range(0, matrix.shape[0], batch_rows):
+                stop = min(start + batch_rows, matrix.shape[0])
+                yield np.arange(start, stop), np.asarray(matrix[start:stop])
+            return
+        rows = np.asarray(rows, dtype=np.int64)
+        for start in range(0, len(rows), batch_rows):
+            selected = rows[start:start + batch_rows]
+            yield selected, matrix[selected]
+
+    def predict_proba(self, scaler, model, batch_rows=DEFAULT_BATCH_ROWS, rows=None):
+        """predict_proba för alla (eller valda) rader, blockvis; returnerar (radnummer, sannolikheter)"""
+        all_rows, probabilities = [], []
+        for batch, values in self.iter_batches(batch_rows, rows):
+            if scaler is not None:
+                values = scaler.transform(values)
+            all_rows.append(batch)
+            probabilities.append(model.predict_proba(values))
+        if not all_rows:
+            return np.empty(0, dtype=np.int64), np.empty((0, 0))
+        return np.concatenate(all_rows), np.concatenate(probabilities)
+
+
+class FeatureStore:
+    """Featurebank med en FeatureTable per featuretyp"""
+
+    def __init__(self, directory=None):
+        self.directory = directory or default_feature_dir()
+        self.tables = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def table(self, kind):
+        """FeatureTable för featuretypen (öppnas första gången)"""
+        with self.lock:
+            if kind not in self.tables:
+                self.tables[kind] = FeatureTable(self.directory, kind)
+            return self.tables[kind]
+
+    def kinds(self):
+        """Featuretyper som finns på disk"""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name.replace('_', '/', 1) for name in os.listdir(self.directory)
+                      if os.path.exists(os.path.join(self.directory, name, 'index.jsonl')))
+
+    def get_or_compute(self, kind, digest, parameters, compute, **info):
+        """Featurevektorn ur banken, eller beräknad med compute() och sparad"""
+        table = self.table(kind)
+        features = table.get(digest, parameters)
+        if features is not None:
+            self.hits += 1
+            return features.astype(float)
+        self.misses += 1
+        # Samma precision som i banken, så att resultatet inte beror på om vektorn var sparad
+        features = np.asarray(compute(), dtype=DTYPE).astype(float)
+        try:
+            table.append(digest, features, parameters, **info)
+        except (OSError, ValueError) as e:
+            print(f"Kunde inte spara i featurebanken: {e}")
+        return features
@@ -0,0 +1,245 @@
+"""Noppanalys utan grafiskt gränssnitt - kör analysmetoderna direkt på bilder
+
+Batchkörning från src-katalogen:
+
+    python noppanalys_headless.py bilder/*.jpg --method "Fourier + Gauss" --output resultat.jsonl
+"""
+import argparse
+import glob
+import json
+import sys
+
+from noppanalys_cache import DEFAULT_MAX_BYTES, ResultCache
+from noppanalys_distill import StudentStore
+from noppanalys_features import FeatureStore
+from noppanalys_gui import NoppAnalysApp, PYWT_AVAILABLE, SKLEARN_AVAILABLE
+from noppanalys_instrumentation import StageTimer, append_jsonl
+from noppanalys_loader import DEFAULT_PREFETCH, DEFAULT_PREFETCH_BYTES, ImageSource, read_image
+
+# Samma standardvärden som kontrollerna i GUI:t (namn utan _var-suffix)
+DEFAULT_PARAMETERS = {
+    'threshold': 85,
+    'red': 0.2,
+    'green': 0.3,
+    'blue': 0.5,
+    'gauss_sigma': 2.0,
+    'wavelet': 'db4',
+    'wavelet_pyramid': False,
+    'wavelet_level': 0,
+    'size_reference': 0.1,
+    'patch_size': 5,
+    'sampling_step': 1,
+    'show_grid': False,
+    'num_filters': 8,
+    'classifier': 'Ensemble',
+    'feature_augment': True,
+    'cross_validation': False,
+    'distilled': True,
+    'lazy_consensus': False,
+    'transfer_learning': True
+}
+
+
+class Parameter:
+    """Ersättning för tk-variabler - samma get/set-gränssnitt utan Tk"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+class HeadlessAnalyzer(NoppAnalysApp):
+    """Analysmetoderna från NoppAnalysApp utan fönster, för batch och benchmark"""
+
+    def __init__(self, parameters=None, track_memory=False, cache=None, feature_store=None):
+        # NoppAnalysApp.__init__ bygger GUI:t och anropas därför inte
+        self.root = None
+        self.original_image = None
+        self.full_original_image = None
+        self.gray_image = None
+        self.lbp_rgb = None
+        self.wavelet_pyramids = {}
+        self.image_path = None
+        self.roi_coords = None
+
+        # LBP parametrar
+        self.radius = 1
+        self.n_points = 8 * self.radius
+        self.method = 'uniform'
+
+        self.track_memory = track_memory
+        self.stage_timer = None
+        self.load_timer = None
+
+        # Resultatcache (ResultCache) används bara om en skickas in
+        self.result_cache = cache
+        self.use_cache_var = Parameter(cache is not None)
+        self.image_digest = None
+
+        # Featurebank (FeatureStore) används bara om en skickas in
+        self.feature_store = feature_store
+
+        # Online-modellen för noppgrad tränas bara från GUI:t
+        self.grade_learner = None
+        self.grade_sample = None
+
+        # Destillerade elevmodeller för Ensemble, samma som i GUI:t
+        self.student_store = StudentStore()
+
+        for name, value in DEFAULT_PARAMETERS.items():
+            setattr(self, f"{name}_var", Parameter(value))
+        self.set_parameters(parameters or {})
+
+        self.basic_methods = {
+            "LBP + Varians": self.detect_nops_lbp,
+            "Fourier + Gauss": self.detect_nops_fourier,
+            "Morfologisk": self.detect_nops_morphological
+        }
+        self.experimental_methods = {}
+        if PYWT_AVAILABLE:
+            self.experimental_methods["Wavelet Transform"] = self.detect_nops_wavelet
+            self.experimental_methods["Kombinerad"] = self.detect_nops_combined
+        if SKLEARN_AVAILABLE:
+            self.experimental_methods["DPCA + ML"] = self.detect_nops_dpca
+        self.available_methods = {**self.basic_methods, **self.experimental_methods}
+
+    def show_error(self, title, message):
+        """Fel skrivs ut istället för att visas i en dialogruta"""
+        print(f"{title}: {message}")
+
+    def set_parameters(self, parameters):
+        """Sätt analysparametrar, t.ex. {'threshold': 90, 'wavelet': 'haar'}"""
+        for name, value in parameters.items():
+            if name not in DEFAULT_PARAMETERS:
+                raise ValueError(f"Okänd parameter: {name}")
+            getattr(self, f"{name}_var").set(value)
+
+    def set_image(self, image, image_path=None, load_timer=None):
+        """Använd en BGR-bild och förbearbeta den som vid inläsning i GUI:t"""
+        self.original_image = image
+        self.full_original_image = image
+        self.image_path = image_path
+        self.preprocess_image(load_timer or StageTimer(track_memory=self.track_memory))
+
+    def run_method(self, method_name, timer=None):
+        """Kör en analysmetod, returnerar (mask, feature_map, stats)"""
+        method_func = self.available_methods.get(method_name)
+        if method_func is None:
+            raise ValueError(f"Okänd analysmetod: {method_name}")
+
+        self.stage_timer = timer
+        try:
+            return self.run_detection(method_name, method_func)
+        finally:
+            self.stage_timer = None
+
+    def analyze_file(self, file_path, methods):
+        """Läs en bild och kör metoderna, returnerar en post per metod (samma format som JSONL-exporten)"""
+        load_timer = StageTimer()
+        image = read_image(file_path, timer=load_timer)
+        if image is None:
+            raise ValueError(f"Kunde inte läsa bildfilen: {file_path}")
+        return self.analyze_image(image, file_path, methods, load_timer)
+
+    def analyze_image(self, image, file_path, methods, load_timer=None):
+        """Kör metoderna på en redan inläst bild, returnerar en post per metod"""
+        self.set_image(image, file_path, load_timer)
+
+        records = []
+        for method_name in methods:
+            timer = StageTimer(track_memory=self.track_memory)
+            nop_mask, feature_map, stats = self.run_method(method_name, timer)
+            if nop_mask is None:
+                continue
+            stats['timings'] = timer.to_dict()
+            stats['load_timings'] = self.load_timer.to_dict()
+            records.append(self.create_timing_record(method_name, stats))
+        return records
+
+
+def run_batch(file_paths, methods, parameters=None, output=None, cache=None, prefetch=DEFAULT_PREFETCH,
+              prefetch_bytes=DEFAULT_PREFETCH_BYTES, max_megapixels=None, feature_store=None):
+    """Analysera bilder i tur och ordning, posterna läggs till i output (JSONL) om angiven.
+
+    Nästa prefetch bilder läses och avkodas i bakgrunden medan den aktuella
+    analyseras. max_megapixels avkodar i reducerad upplösning (förhandsvisning).
+    """
+    analyzer = HeadlessAnalyzer(parameters, cache=cache, feature_store=feature_store)
+    unknown = [name for name in methods if name not in analyzer.available_methods]
+    if unknown:
+        raise ValueError(f"Okända analysmetoder: {', '.join(unknown)}")
+
+    all_records = []
+    with ImageSource(file_paths, prefetch=prefetch, max_bytes=prefetch_bytes,
+                     max_megapixels=max_megapixels) as source:
+        for loaded in source:
+            file_path = loaded.path
+            try:
+                if loaded.image is None:
+                    raise ValueError(loaded.error)
+                records = analyzer.analyze_image(loaded.image, file_path, methods, loaded.timer)
+            except Exception as e:
+                print(f"Fel i {file_path}: {e}")
+                continue
+
+            for record in records:
+                stats = record['stats']
+                origin = " (cache)" if stats.get('cached') else ""
+                print(f"{file_path}: {record['method']}: {stats['num_pills']} noppor, "
+                      f"{stats['nop_percentage']:.2f}%{origin}")
+                if output:
+                    append_jsonl(output, record)
+            all_records.extend(records)
+    return all_records
+
+
+def expand_paths(patterns):
+    """Expandera jokertecken (behövs i Windows där skalet inte gör det)"""
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        paths.extend(matches if matches else [pattern])
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Noppanalys utan grafiskt gränssnitt")
+    parser.add_argument('images', nargs='+', help="Bildfiler (jokertecken tillåtna)")
+    parser.add_argument('--method', action='append', dest='methods',
+                        help="Analysmetod, kan anges flera gånger (standard: LBP + Varians)")
+    parser.add_argument('--parameters', type=json.loads, default=None,
+                        help='Analysparametrar som JSON, t.ex. \'{"threshold": 90}\'')
+    parser.add_argument('--output', default='noppanalys_resultat.jsonl', help="JSONL-fil att lägga till resultat i")
+    parser.add_argument('--cache-dir', help="Katalog för resultatcachen")
+    parser.add_argument('--cache-size-mb', type=float, default=DEFAULT_MAX_BYTES / 2**20)
+    parser.add_argument('--no-cache', action='store_true', help="Analysera om även om resultat finns i cachen")
+    parser.add_argument('--prefetch', type=int, default=DEFAULT_PREFETCH,
+                        help="Antal bilder som läses och avkodas i förväg")
+    parser.add_argument('--prefetch-mb', type=float, default=DEFAULT_PREFETCH_BYTES / 2**20,
+                        help="Högsta minne för förhämtade bilder")
+    parser.add_argument('--preview-mp', type=float, default=None,
+                        help="Förhandsvisning: avkoda i reducerad upplösning ned till ungefär så många megapixlar")
+    parser.add_argument('--feature-store', nargs='?', const='', default=None,
+                        help="Spara/återanvänd DPCA:s avancerade features i featurebanken (valfri katalog)")
+    args = parser.parse_args(argv)
+
+    feature_store = FeatureStore(args.feature_store or None) if args.feature_store is not None else None
+    cache = None
+    if not args.no_cache:
+        cache = ResultCache(args.cache_dir, max_bytes=int(args.cache_size_mb * 2**20))
+
+    records = run_batch(expand_paths(args.images), args.methods or ["LBP + Varians"],
+                        parameters=args.parameters, output=args.output, cache=cache, prefetch=args.prefetch,
+                        prefetch_bytes=int(args.prefetch_mb * 2**20), max_megapixels=args.preview_mp,
+                        feature_store=feature_store)
+    print(f"{len(records)} resultat tillagda i {args.output}")
+    return 0 if records else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""Batchvis gradering: featurevektorer från många bilder klassificeras i ett fåtal vektoriserade anrop
+
+Körs från src-katalogen:
+
+    python noppanalys_inference.py bilder/*.jpg --model online --batch-size 512 --threads 2
+
+Featurevektorerna samlas först in (med förhämtning av bilderna och, för
+avancerade features, featurebanken), staplas till en matris och graderas
+sedan i block om batch_size rader: scaler.transform och predict_proba körs en
+gång per block, block körs parallellt i threads trådar. Graderna returneras i
+samma ordning som bilderna.
+
+Bara redan tränade modeller kan köras batchvis: den regelbaserade graderingen
+(classify_pilling_grade), online-modellen från operatörsetiketterna och andra
+anpassade scaler/modell-par. classify_with_advanced_ml tränar en ny modell
+kring varje enskild bild och går därför inte att batcha.
+"""
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from noppanalys_features import FeatureStore
+from noppanalys_headless import HeadlessAnalyzer, expand_paths
+from noppanalys_instrumentation import append_jsonl
+from noppanalys_learning import OnlineGradeClassifier, feature_kind, rule_based_grades
+from noppanalys_loader import ImageSource
+
+DEFAULT_BATCH_SIZE = 256
+
+
+class BatchGradeClassifier:
+    """Graderar en stapel featurevektorer i block, med en tränad modell eller de regelbaserade trösklarna"""
+
+    def __init__(self, model=None, scaler=None, batch_size=DEFAULT_BATCH_SIZE, threads=1):
+        self.model = model
+        self.scaler = scaler
+        self.batch_size = max(1, batch_size)
+        self.threads = max(1, threads or 1)
+
+    def predict_block(self, block):
+        """(grader, konfidenser) för ett block rader"""
+        if self.model is None:
+            return rule_based_grades(block)
+        if self.scaler is not None:
+            block = self.scaler.transform(block)
+        probabilities = self.model.predict_proba(block)
+        best = np.argmax(probabilities, axis=1)
+        return np.asarray(self.model.classes_)[best].astype(int), probabilities[np.arange(len(best)), best]
+
+    def predict_matrix(self, matrix):
+        """(grader, konfidenser) för varje rad, i radordning"""
+        matrix = np.atleast_2d(np.asarray(matrix, dtype=float))
+        if len(matrix) == 0:
+            return np.empty(0, dtype=int), np.empty(0)
+        blocks = [matrix[start:start + self.batch_size] for start in range(0, len(matrix), self.batch_size)]
+        if self.threads == 1 or len(blocks) == 1:
+            results = [self.predict_block(block) for block in blocks]
+        else:
+            # numpy och sklearn släpper GIL i de tunga stegen; map behåller ordningen
+            with ThreadPoolExecutor(max_workers=self.threads) as pool:
+                results = list(pool.map(self.predict_block, blocks))
+        return (np.concatenate([grades for grades, _ in results]),
+                np.concatenate([confidences for _, confidences in results]))
+
+    def predict(self, feature_vectors):
+        """(grader, konfidenser) för en lista featurevektorer av samma längd, i samma ordning"""
+        return self.predict_matrix(np.vstack([np.asarray(features, dtype=float) for features in feature_vectors]))
+
+
+def collect_features(file_paths, advanced=False, parameters=None, feature_store=None, prefetch=2):
+    """Featurevektor per bild (DPCA-features, eller avancerade features via featurebanken).
+
+    Returnerar (sökvägar, vektorer, fel) - sökvägar och vektorer hör ihop
+    index för index, bilder som inte kunde läsas hamnar i fel.
+    """
+    analyzer = HeadlessAnalyzer(parameters, feature_store=feature_store)
+    paths, vectors, errors = [], [], []
+    with ImageSource(file_paths, prefetch=prefetch) as source:
+        for loaded in source:
+            if loaded.image is None:
+                errors.append((loaded.path, loaded.error))
+                continue
+            analyzer.set_image(loaded.image, loaded.path)
+            gray = cv2.cvtColor(loaded.image, cv2.COLOR_BGR2GRAY)
+            if advanced:
+                features = analyzer.stored_features('advanced', {'feature_augment': True},
+                                                    lambda: analyzer.extract_advanced_features(gray))
+            else:
+                features = analyzer.extract_dpca_features(gray)
+            paths.append(loaded.path)
+            vectors.append(features)
+    return paths, vectors, errors
+
+
+def online_classifier(kind, batch_size=DEFAULT_BATCH_SIZE, threads=1):
+    """BatchGradeClassifier med online-modellen från operatörsetiketterna, None om den har för få etiketter"""
+    learner = OnlineGradeClassifier()
+    if not learner.is_ready(kind):
+        return None
+    scaler, model, _ = learner.model(kind)
+    return BatchGradeClassifier(model, scaler, batch_size, threads)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batchvis noppgradering av många bilder")
+    parser.add_argument('images', nargs='+', help="Bildfiler eller mönster, t.ex. bilder/*.jpg")
+    parser.add_argument('--model', choices=('rules', 'online'), default='rules',
+                        help="rules = regelbaserad DPCA-gradering, online = modellen från operatörsetiketterna")
+    parser.add_argument('--advanced', action='store_true',
+                        help="Använd avancerade features (sparas i featurebanken) istället för DPCA-features")
+    parser.add_argument('--parameters', type=json.loads, default=None,
+                        help='Analysparametrar som JSON, t.ex. \'{"patch_size": 7}\'')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Rader per predict_proba-anrop")
+    parser.add_argument('--threads', type=int, default=1, help="Antal trådar för blocken")
+    parser.add_argument('--feature-store', default=None, help="Katalog för featurebanken (standard: användarens)")
+    parser.add_argument('--output', default=None, help="JSONL-fil för en rad per bild")
+    args = parser.parse_args(argv)
+
+    if args.model == 'rules' and args.advanced:
+        parser.error("Den regelbaserade graderingen använder DPCA-features (utan --advanced)")
+
+    start = time.perf_counter()
+    store = FeatureStore(args.feature_store) if args.advanced else None
+    paths, vectors, errors = collect_features(expand_paths(args.images), args.advanced, args.parameters, store)
+    for path, error in errors:
+        print(f"Fel i {path}: {error}")
+    if not vectors:
+        print("Inga bilder kunde läsas")
+        return 1
+    collected = time.perf_counter()
+
+    kind = feature_kind('advanced' if args.advanced else 'dpca', vectors[0])
+    if args.model == 'online':
+        classifier = online_classifier(kind, args.batch_size, args.threads)
+        if classifier is None:
+            print(f"Online-modellen har för få etiketter för {kind}")
+            return 1
+    else:
+        classifier = BatchGradeClassifier(batch_size=args.batch_size, threads=args.threads)
+    grades, confidences = classifier.predict(vectors)
+    classified = time.perf_counter()
+
+    for path, grade, confidence in zip(paths, grades, confidences):
+        print(f"{path}: grad {grade} ({confidence:.0%})")
+        if args.output:
+            append_jsonl(args.output, {'image': path, 'model': args.model, 'kind': kind,
+                                       'pilling_grade': int(grade), 'confidence': float(confidence)})
+    print(f"{len(paths)} bilder: features {collected - start:.2f} s, "
+          f"gradering {(classified - collected) * 1000:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
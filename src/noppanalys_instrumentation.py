@@ -0,0 +1,292 @@
+"""Tidsmätning, minnesmätning och profilering per pipelinesteg för Noppanalys"""
+import cProfile
+import importlib.util
+import io
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# Samplande profilerare används om den finns installerad, annars cProfile
+PYINSTRUMENT_AVAILABLE = importlib.util.find_spec('pyinstrument') is not None
+
+# AnalysisProfiler som är aktiv i tråden - StageTimer meddelar den vid varje stegbyte
+_active_profiler = threading.local()
+
+
+def _profiler_checkpoint(stage):
+    """Låt trådens aktiva profilerare mäta minnet vid ett stegbyte"""
+    profiler = getattr(_active_profiler, 'profiler', None)
+    if profiler is not None:
+        profiler.checkpoint(stage)
+
+
+class StageTimer:
+    """Samlar tidsåtgång och (valfritt) minnestopp per pipelinesteg.
+
+    Steg kan nästlas, t.ex. när Kombinerad kör de andra metoderna. Nästlade
+    steg får sökvägsnamn som 'lbp/variance'. Minnestoppen mäts med tracemalloc
+    och anger hur mycket som allokerats utöver nivån när steget startade.
+    """
+
+    def __init__(self, track_memory=False):
+        self.track_memory = track_memory
+        self.stages = []
+        self._stack = []
+        self._started_tracing = False
+
+    @contextmanager
+    def stage(self, name):
+        """Mät ett steg: with timer.stage('variance'): ..."""
+        path = '/'.join([frame['name'] for frame in self._stack] + [name])
+        frame = {'name': name, 'start_memory': 0, 'peak': 0}
+
+        if self.track_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            # Profileraren läser toppen innan den nollställs för det nya steget
+            _profiler_checkpoint(path)
+            current, peak = tracemalloc.get_traced_memory()
+            # Spara föräldrastegets topp innan toppen nollställs för det nya steget
+            if self._stack:
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+            frame['start_memory'] = current
+            frame['peak'] = current
+
+        # Platsen reserveras vid start så att stegen listas i körordning
+        index = len(self.stages)
+        self.stages.append(None)
+        self._stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._stack.pop()
+            record = {'stage': path, 'seconds': elapsed}
+            _profiler_checkpoint(path)
+
+            if self.track_memory and tracemalloc.is_tracing():
+                peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                record['peak_bytes'] = peak - frame['start_memory']
+                if self._stack:
+                    self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+                elif self._started_tracing:
+                    tracemalloc.stop()
+                    self._started_tracing = False
+
+            self.stages[index] = record
+
+    def record(self, name, seconds):
+        """Lägg till ett steg som mätts utanför timern (t.ex. ritning i huvudtråden)"""
+        self.stages.append({'stage': name, 'seconds': seconds})
+
+    def total_seconds(self):
+        """Summerad tid för steg på översta nivån"""
+        return sum(record['seconds'] for record in self.stages
+                   if record is not None and '/' not in record['stage'])
+
+    def to_dict(self):
+        """Tidsuppdelning som dict - läggs i stats['timings']"""
+        return {
+            'total_seconds': self.total_seconds(),
+            'stages': [dict(record) for record in self.stages if record is not None]
+        }
+
+    def format_report(self):
+        """Textuppställning av stegen för resultatpanelen"""
+        lines = []
+        for record in self.stages:
+            if record is None:
+                continue
+            depth = record['stage'].count('/')
+            name = record['stage'].rsplit('/', 1)[-1]
+            line = f"  {'  ' * depth}{name:<{16 - 2 * depth}} {record['seconds'] * 1000:8.1f} ms"
+            if 'peak_bytes' in record:
+                line += f"  topp {record['peak_bytes'] / 2**20:6.1f} MB"
+            lines.append(line)
+        lines.append(f"  {'Totalt':<16} {self.total_seconds() * 1000:8.1f} ms")
+        return "\n".join(lines)
+
+
+def timed_stage(timer, name):
+    """timer.stage(name) om en timer finns, annars en tom kontext"""
+    return timer.stage(name) if timer is not None else nullcontext()
+
+
+def json_default(value):
+    """Gör numpy-värden och -arrayer JSON-serialiserbara"""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
+
+
+def append_jsonl(path, record):
+    """Lägg till en post som en JSON-rad - en rad per analyserad bild vid batchkörning"""
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, default=json_default, ensure_ascii=False) + "\n")
+
+
+def _frame_name(frame):
+    """Läsbart namn för en pyinstrument-ram"""
+    return f"{frame.function} ({frame.file_path_short}:{frame.line_no})"
+
+
+def _real_children(frame):
+    """Barnramar utan pyinstruments syntetiska [self]-ramar (deras tid räknas som egen tid)"""
+    return [child for child in frame.children if not getattr(child, 'is_synthetic', False)]
+
+
+class AnalysisProfiler:
+    """Profilerar en hel analyskörning: cProfile eller pyinstrument samt tracemalloc.
+
+    Används som kontext i den tråd som kör analysen (profilerarna mäter bara
+    tråden där de startas):
+
+        profiler = AnalysisProfiler("bild_profil")
+        with profiler:
+            ...
+        paths = profiler.save()
+    """
+
+    def __init__(self, output_base, top_n=25):
+        self.output_base = output_base
+        self.top_n = top_n
+        self.profiler = None
+        self.snapshot = None
+        self.max_live_stage = None
+        self.max_live_bytes = 0
+        self.peak_bytes = 0
+        self.elapsed = 0.0
+        self._started_tracing = False
+        self._start = None
+
+    def __enter__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        tracemalloc.reset_peak()
+        _active_profiler.profiler = self
+
+        if PYINSTRUMENT_AVAILABLE:
+            from pyinstrument import Profiler
+            self.profiler = Profiler()
+            self.profiler.start()
+        else:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.elapsed = time.perf_counter() - self._start
+        if PYINSTRUMENT_AVAILABLE:
+            self.profiler.stop()
+        else:
+            self.profiler.disable()
+
+        _active_profiler.profiler = None
+        self.checkpoint("analysens slut")
+        # Ögonblicksbilden tas efter att profileraren stoppats så att den inte belastar stegen
+        self.snapshot = tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),))
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return False
+
+    def checkpoint(self, stage):
+        """Vid stegbyte: samla toppen och notera var mest minne är levande (bara billiga räknare).
+
+        StageTimer nollställer tracemalloc-toppen per steg, så toppen läses vid varje byte.
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak_bytes = max(self.peak_bytes, peak)
+        if self.max_live_stage is None or current > self.max_live_bytes:
+            self.max_live_bytes = current
+            self.max_live_stage = stage
+
+    def function_times(self):
+        """Lista av (funktion, egen tid, kumulativ tid) sorterad på egen tid"""
+        if PYINSTRUMENT_AVAILABLE:
+            totals = {}
+
+            def walk(frame, ancestors):
+                name = _frame_name(frame)
+                children = _real_children(frame)
+                self_time = frame.time - sum(child.time for child in children)
+                own, cumulative = totals.get(name, (0.0, 0.0))
+                # Rekursiva anrop räknas bara en gång i kumulativ tid
+                totals[name] = (own + self_time, cumulative + (0.0 if name in ancestors else frame.time))
+                for child in children:
+                    walk(child, ancestors | {name})
+
+            root = self.profiler.last_session.root_frame()
+            if root is not None:
+                walk(root, frozenset())
+            rows = [(name, own, cumulative) for name, (own, cumulative) in totals.items()]
+        else:
+            stats = pstats.Stats(self.profiler)
+            rows = [(f"{func[2]} ({func[0]}:{func[1]})", tottime, cumtime)
+                    for func, (_, _, tottime, cumtime, _) in stats.stats.items()]
+        return sorted(rows, key=lambda row: row[1], reverse=True)
+
+    def collapsed_stacks(self):
+        """Profilen som collapsed-stack-rader (för flamegraph-verktyg), tid i mikrosekunder"""
+        lines = []
+
+        def walk(frame, stack):
+            stack = stack + [_frame_name(frame)]
+            children = _real_children(frame)
+            self_time = frame.time - sum(child.time for child in children)
+            if self_time > 0:
+                lines.append(f"{';'.join(stack)} {int(self_time * 1e6)}")
+            for child in children:
+                walk(child, stack)
+
+        root = self.profiler.last_session.root_frame()
+        if root is not None:
+            walk(root, [])
+        return lines
+
+    def allocation_report(self):
+        """Minnestoppen, steget med mest levande minne och topp-N allokeringar som lever vid analysens slut"""
+        lines = [f"Minnestopp under analysen: {self.peak_bytes / 2**20:.1f} MB",
+                 f"Mest levande minne vid stegbyte: {self.max_live_bytes / 2**20:.1f} MB vid '{self.max_live_stage}'",
+                 f"Största levande allokeringar vid analysens slut (topp {self.top_n}):", ""]
+        for stat in self.snapshot.statistics('lineno')[:self.top_n]:
+            frame = stat.traceback[0]
+            lines.append(f"{stat.size / 2**20:9.2f} MB  {stat.count:8d} block  {frame.filename}:{frame.lineno}")
+        return "\n".join(lines)
+
+    def save(self):
+        """Spara profil (.prof eller collapsed-stack) och allokeringsrapport, returnerar sökvägarna"""
+        if PYINSTRUMENT_AVAILABLE:
+            profile_path = self.output_base + ".collapsed.txt"
+            with open(profile_path, 'w', encoding='utf-8') as f:
+                f.write("\n".join(self.collapsed_stacks()) + "\n")
+        else:
+            profile_path = self.output_base + ".prof"
+            self.profiler.dump_stats(profile_path)
+
+        allocation_path = self.output_base + "_allokeringar.txt"
+        with open(allocation_path, 'w', encoding='utf-8') as f:
+            f.write(self.allocation_report() + "\n")
+
+        return [profile_path, allocation_path]
+
+    def summary(self, top_n=15):
+        """Textsammanfattning av de hetaste funktionerna för dialogrutan"""
+        output = io.StringIO()
+        profiler_name = "pyinstrument (samplande)" if PYINSTRUMENT_AVAILABLE else "cProfile"
+        output.write(f"Profilerare: {profiler_name}\n")
+        output.write(f"Total tid: {self.elapsed:.2f} s\n")
+        output.write(f"Minnestopp: {self.peak_bytes / 2**20:.1f} MB\n\n")
+        output.write(f"{'Egen tid':>10} {'Kumulativ':>10}  Funktion\n")
+        for name, own, cumulative in self.function_times()[:top_n]:
+            output.write(f"{own:9.3f}s {cumulative:9.3f}s  {name}\n")
+        return output.getvalue()
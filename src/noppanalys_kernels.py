@@ -0,0 +1,188 @@
+"""Snabba varianter av beräkningskärnorna i NoppAnalysApp.
+
+Den ursprungliga koden i NoppAnalysApp är referens (orakel). En snabb variant
+används bara när dess flagga i FAST_PATHS är på, och flaggan slås på som
+standard först när varianten klarat paritetstestet (python -m benchmark parity).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from math import sqrt
+
+import numpy as np
+from scipy import ndimage
+from scipy.ndimage import uniform_filter
+from skimage.feature import local_binary_pattern
+
+# lbp parallelliserar bara över tre kanaler och har inte visat någon vinst än
+FAST_PATHS = {
+    'local_variance': True,
+    'lbp': False,
+    'dpca_feature_map': True,
+    'pilling_stats': True,
+    'watershed': True
+}
+
+
+@contextmanager
+def fast_paths(**flags):
+    """Slå på/av snabba varianter tillfälligt: with fast_paths(local_variance=True): ..."""
+    unknown = set(flags) - set(FAST_PATHS)
+    if unknown:
+        raise ValueError(f"Okända kärnor: {', '.join(sorted(unknown))}")
+    previous = dict(FAST_PATHS)
+    FAST_PATHS.update(flags)
+    try:
+        yield
+    finally:
+        FAST_PATHS.clear()
+        FAST_PATHS.update(previous)
+
+
+def local_variance_fast(image, size=9):
+    """Lokal varians som E[x²] - E[x]² med boxfilter (samma kantspegling som generic_filter)"""
+    values = np.asarray(image, dtype=np.float64)
+    mean = uniform_filter(values, size=size)
+    mean_sq = uniform_filter(values * values, size=size)
+    variance = np.maximum(mean_sq - mean * mean, 0.0)
+    return variance.astype(image.dtype, copy=False)
+
+
+def lbp_channels_fast(channels, n_points, radius, method):
+    """LBP för alla färgkanaler parallellt - skimage släpper GIL i sin Cython-loop"""
+    with ThreadPoolExecutor(max_workers=len(channels)) as pool:
+        return list(pool.map(lambda ch: local_binary_pattern(ch, n_points, radius, method), channels))
+
+
+def _window_sums(values, row_range, col_range, half):
+    """Summa av values[i+r0..i+r1, j+c0..j+c1] för alla patchcentrum (i, j) där patchen ryms"""
+    h, w = values.shape
+    n_i, n_j = h - 2 * half, w - 2 * half
+    (r0, r1), (c0, c1) = row_range, col_range
+
+    rows = np.cumsum(np.pad(values, ((1, 0), (0, 0))), axis=0)
+    row_sums = rows[half + r1 + 1:half + r1 + 1 + n_i] - rows[half + r0:half + r0 + n_i]
+    cols = np.cumsum(np.pad(row_sums, ((0, 0), (1, 0))), axis=1)
+    return cols[:, half + c1 + 1:half + c1 + 1 + n_j] - cols[:, half + c0:half + c0 + n_j]
+
+
+def dpca_feature_map_fast(gray_image, patch_size, sampling_step):
+    """Vektoriserad create_dpca_feature_map: patchvarians + medelgradient för alla patchar på en gång.
+
+    np.gradient inom en patch använder centrala differenser inuti och ensidiga
+    differenser på patchens kanter. Kantpixlarna summeras därför separat med
+    framåt-/bakåtdifferenser så att resultatet blir detsamma som i loopen.
+    """
+    half = patch_size // 2
+    side = 2 * half + 1
+    h, w = gray_image.shape
+    feature_map = np.zeros_like(gray_image, dtype=float)
+    if h - 2 * half <= 0 or w - 2 * half <= 0:
+        return feature_map
+
+    g = gray_image.astype(np.float64)
+    n = side * side
+
+    # Patchvarians från summor av heltal (exakta i float64)
+    s1 = _window_sums(g, (-half, half), (-half, half), half)
+    s2 = _window_sums(g * g, (-half, half), (-half, half), half)
+    variance = (s2 - s1 * s1 / n) / n
+
+    # Framåt-, central- och bakåtdifferens per axel (definierade där patcharna behöver dem)
+    def differences(axis):
+        forward = np.zeros_like(g)
+        central = np.zeros_like(g)
+        backward = np.zeros_like(g)
+        diff = np.diff(g, axis=axis)
+        if axis == 0:
+            forward[:-1], backward[1:] = diff, diff
+            central[1:-1] = (g[2:] - g[:-2]) / 2
+        else:
+            forward[:, :-1], backward[:, 1:] = diff, diff
+            central[:, 1:-1] = (g[:, 2:] - g[:, :-2]) / 2
+        return {'forward': forward, 'central': central, 'backward': backward}
+
+    # Vilka patchoffset som använder respektive differens
+    offsets = {'forward': (-half, -half), 'central': (-half + 1, half - 1), 'backward': (half, half)}
+    grad_y, grad_x = differences(0), differences(1)
+
+    gradient_sum = np.zeros_like(variance)
+    for row_kind, row_range in offsets.items():
+        for col_kind, col_range in offsets.items():
+            if row_range[0] > row_range[1] or col_range[0] > col_range[1]:
+                continue
+            magnitude = np.sqrt(grad_x[col_kind] ** 2 + grad_y[row_kind] ** 2)
+            gradient_sum += _window_sums(magnitude, row_range, col_range, half)
+
+    values = variance + gradient_sum / n
+
+    # Sampling: varje samplat centrum fyller sitt block, precis som i loopen
+    step = sampling_step
+    if step > 1:
+        sampled = values[::step, ::step]
+        rows_end = min(half + sampled.shape[0] * step, h)
+        cols_end = min(half + sampled.shape[1] * step, w)
+        blocks = np.repeat(np.repeat(sampled, step, axis=0), step, axis=1)
+        feature_map[half:rows_end, half:cols_end] = blocks[:rows_end - half, :cols_end - half]
+    else:
+        feature_map[half:h - half, half:w - half] = values
+    return feature_map
+
+
+@lru_cache(maxsize=2)
+def highpass_mask(rows, cols, sigma):
+    """Gaussiskt högpassfilter för Fourier-metoden, cachat per upplösning och sigma.
+
+    Beror inte på bildinnehållet, så bilder i en video eller batch med samma
+    storlek återanvänder samma filter. Arrayen är skrivskyddad.
+    """
+    crow, ccol = rows // 2, cols // 2
+    y, x = np.ogrid[:rows, :cols]
+    mask = 1 - np.exp(-((x - ccol)**2 + (y - crow)**2) / (2 * sigma**2))
+    mask.flags.writeable = False
+    return mask
+
+
+def region_areas_perimeters(labeled_mask):
+    """Area och omkrets per region i en märkt mask, samma värden som regionprops.
+
+    Omkretsen beräknas som skimage.measure.perimeter (4-grannskap) men för hela
+    bilden på en gång. Det går eftersom olika 8-sammanhängande regioner aldrig
+    är grannar, så ingen region påverkar en annans kantpixlar.
+    """
+    num_regions = int(labeled_mask.max())
+    if num_regions == 0:
+        return np.zeros(0), np.zeros(0)
+
+    flat_labels = labeled_mask.ravel()
+    areas = np.bincount(flat_labels, minlength=num_regions + 1)[1:].astype(np.float64)
+
+    image = (labeled_mask > 0).astype(np.uint8)
+    strel = np.array([[0, 1, 0], [1, 1, 1], [0, 1, 0]], dtype=np.uint8)
+    eroded = ndimage.binary_erosion(image, strel, border_value=0)
+    border = image - eroded
+
+    perimeter_weights = np.zeros(50, dtype=np.float64)
+    perimeter_weights[[5, 7, 15, 17, 25, 27]] = 1
+    perimeter_weights[[21, 33]] = sqrt(2)
+    perimeter_weights[[13, 23]] = (1 + sqrt(2)) / 2
+    perimeter_image = ndimage.convolve(border, np.array([[10, 2, 10], [2, 1, 2], [10, 2, 10]]),
+                                       mode='constant', cval=0)
+
+    pixel_weights = perimeter_weights[perimeter_image.ravel()]
+    perimeters = np.bincount(flat_labels, weights=pixel_weights, minlength=num_regions + 1)[1:]
+    return areas, perimeters
+
+
+def seeded_regions_fast(binary, markers):
+    """Samma mask som watershed(-distance, markers, mask=binary) > 0, utan själva floden.
+
+    Floden fyller hela det 4-sammanhängande område i binary som en seed ligger
+    i, oavsett avståndstransformen, så masken är de områden som innehåller minst
+    en seed.
+    """
+    regions, _ = ndimage.label(binary > 0)
+    seeded = np.zeros(regions.max() + 1, dtype=bool)
+    seeded[regions[markers > 0]] = True
+    seeded[0] = False
+    return seeded[regions].astype(np.uint8)
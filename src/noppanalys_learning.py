@@ -0,0 +1,169 @@
+"""Inkrementell inlärning av noppgraden från operatörens bekräftade eller korrigerade grader
+
+Varje etikett (featurevektor + ISO-grad) läggs till sist i en JSONL-fil som
+aldrig skrivs om. Klassificeraren (StandardScaler + SGDClassifier med
+logistisk förlust) uppdateras med partial_fit för varje ny etikett, vilket tar
+millisekunder. Vid start spelas etiketterna upp från filen - ingen modellfil
+behöver sparas. Featurevektorer av olika slag (DPCA-features, avancerade
+features, olika längd) får var sin modell.
+"""
+import importlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from noppanalys_instrumentation import json_default
+
+GRADES = (1, 2, 3, 4, 5)
+
+# Val i GUI:ts klassificerarlista för den inkrementellt tränade modellen
+ONLINE_CLASSIFIER = "Online (operatör)"
+
+# Modellen används först när så många etiketter med minst två olika grader finns
+MIN_LABELS = 5
+
+# Antal varv över sparade etiketter när modellen byggs upp vid start
+REPLAY_EPOCHS = 5
+
+# Regelbaserad gradering: (min norm, min std, grad, konfidens), första uppfyllda regeln gäller
+GRADE_RULES = (
+    (15, 2.0, 1, 0.85),  # Mycket allvarliga noppor
+    (10, 1.5, 2, 0.80),  # Allvarliga noppor
+    (7, 1.0, 3, 0.75),   # Medel noppor
+    (5, 0.5, 4, 0.70)    # Lätta noppor
+)
+DEFAULT_GRADE = (5, 0.90)  # Inga noppor
+
+
+def default_label_path():
+    """Etikettfil: NOPPANALYS_LABELS, annars i användarens datakatalog"""
+    if os.environ.get('NOPPANALYS_LABELS'):
+        return os.environ['NOPPANALYS_LABELS']
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+        return os.path.join(base, 'Noppanalys', 'noppgrader.jsonl')
+    base = os.environ.get('XDG_DATA_HOME', os.path.join(os.path.expanduser('~'), '.local', 'share'))
+    return os.path.join(base, 'noppanalys', 'noppgrader.jsonl')
+
+
+def feature_kind(name, features):
+    """Nyckel för en featuretyp, t.ex. 'dpca/32' - vektorer med olika nyckel tränas var för sig"""
+    return f"{name}/{len(features)}"
+
+
+def rule_based_grades(matrix):
+    """Regelbaserad noppgrad för varje rad i matrisen: (grader, konfidenser)"""
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=float))
+    norms = np.linalg.norm(matrix, axis=1)
+    stds = np.std(matrix, axis=1)
+    grades = np.full(len(matrix), DEFAULT_GRADE[0], dtype=int)
+    confidences = np.full(len(matrix), DEFAULT_GRADE[1])
+    undecided = np.ones(len(matrix), dtype=bool)
+    for min_norm, min_std, grade, confidence in GRADE_RULES:
+        hit = undecided & (norms > min_norm) & (stds > min_std)
+        grades[hit] = grade
+        confidences[hit] = confidence
+        undecided &= ~hit
+    return grades, confidences
+
+
+class LabelStore:
+    """Append-only JSONL med operatörens etiketter, en rad per bekräftad eller korrigerad grad"""
+
+    def __init__(self, path=None):
+        self.path = path or default_label_path()
+        self.lock = threading.Lock()
+
+    def append(self, kind, features, grade, **info):
+        """Lägg till en etikett; info (t.ex. bild och föreslagen grad) sparas för spårbarhet"""
+        record = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'kind': kind, 'grade': int(grade),
+                  'features': np.asarray(features, dtype=float), **info}
+        line = json.dumps(record, default=json_default, ensure_ascii=False) + "\n"
+        with self.lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+    def load(self, kind):
+        """(X, y) för alla etiketter av en featuretyp, i den ordning de lades till"""
+        features, grades = [], []
+        if not os.path.exists(self.path):
+            return np.empty((0, 0)), np.empty(0, dtype=int)
+        with self.lock, open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Halvskriven sista rad efter avbrott
+                if record.get('kind') == kind:
+                    features.append(record['features'])
+                    grades.append(record['grade'])
+        if not features:
+            return np.empty((0, 0)), np.empty(0, dtype=int)
+        return np.array(features, dtype=float), np.array(grades, dtype=int)
+
+
+class OnlineGradeClassifier:
+    """Noppgradsklassificerare per featuretyp som uppdateras en etikett i taget med partial_fit"""
+
+    def __init__(self, store=None):
+        self.store = store or LabelStore()
+        self.models = {}
+        self.lock = threading.Lock()
+
+    def model(self, kind):
+        """(scaler, klassificerare, grader sedda) för featuretypen, uppbyggd från etikettfilen första gången"""
+        if kind not in self.models:
+            preprocessing = importlib.import_module('sklearn.preprocessing')
+            linear_model = importlib.import_module('sklearn.linear_model')
+            scaler = preprocessing.StandardScaler()
+            classifier = linear_model.SGDClassifier(loss='log_loss', alpha=1e-3, random_state=0)
+            X, y = self.store.load(kind)
+            if len(y):
+                scaler.fit(X)
+                scaled = scaler.transform(X)
+                rng = np.random.default_rng(0)
+                for _ in range(REPLAY_EPOCHS):
+                    order = rng.permutation(len(y))
+                    classifier.partial_fit(scaled[order], y[order], classes=GRADES)
+            self.models[kind] = (scaler, classifier, list(y))
+        return self.models[kind]
+
+    def label_count(self, kind):
+        """Antal etiketter för featuretypen"""
+        with self.lock:
+            return len(self.model(kind)[2])
+
+    def is_ready(self, kind):
+        """Tillräckligt många etiketter (med minst två olika grader) för att modellen ska användas"""
+        with self.lock:
+            grades = self.model(kind)[2]
+            return len(grades) >= MIN_LABELS and len(set(grades)) >= 2
+
+    def update(self, kind, features, grade, **info):
+        """Spara etiketten och uppdatera modellen med den, returnerar antal etiketter för featuretypen"""
+        if int(grade) not in GRADES:
+            raise ValueError(f"Ogiltig noppgrad: {grade}")
+        x = np.asarray(features, dtype=float).reshape(1, -1)
+        with self.lock:
+            # Modellen byggs (från tidigare etiketter) innan den nya etiketten skrivs till filen
+            scaler, classifier, grades = self.model(kind)
+            self.store.append(kind, features, grade, **info)
+            scaler.partial_fit(x)
+            classifier.partial_fit(scaler.transform(x), [int(grade)], classes=GRADES)
+            grades.append(int(grade))
+            return len(grades)
+
+    def predict(self, kind, features):
+        """(grad, konfidens) från modellen, None om den inte har tillräckligt många etiketter än"""
+        if not self.is_ready(kind):
+            return None
+        x = np.asarray(features, dtype=float).reshape(1, -1)
+        with self.lock:
+            scaler, classifier, _ = self.model(kind)
+            probabilities = classifier.predict_proba(scaler.transform(x))[0]
+        best = int(np.argmax(probabilities))
+        return int(classifier.classes_[best]), float(probabilities[best])
@@ -0,0 +1,175 @@
+"""Bildinläsning: läsning och avkodning, med förhämtning av nästa bilder i batchläge
+
+cv2.imdecode släpper GIL, så avkodning i trådar överlappar analysen av
+föregående bild. Vid förhandsvisning används IMREAD_REDUCED_* som avkodar
+JPEG direkt i halv, fjärdedels eller åttondels upplösning.
+"""
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from noppanalys_instrumentation import StageTimer
+
+# Nedskalningsfaktor -> flagga för avkodning i reducerad upplösning
+REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+DEFAULT_PREFETCH = 2
+DEFAULT_PREFETCH_BYTES = 512 * 2**20
+
+
+def image_size(file_path):
+    """(bredd, höjd) från filhuvudet utan att avkoda bilden, None om okänt format"""
+    from PIL import Image
+    try:
+        with Image.open(file_path) as image:
+            return image.size
+    except OSError:
+        return None
+
+
+def reduction_for(size, max_megapixels):
+    """Största faktor (1, 2, 4, 8) som ger minst max_megapixels"""
+    if size is None or not max_megapixels:
+        return 1
+    pixels = size[0] * size[1]
+    factor = 1
+    for candidate in (2, 4, 8):
+        if pixels / candidate**2 >= max_megapixels * 1_000_000:
+            factor = candidate
+    return factor
+
+
+def decode_image(file_bytes, file_path=None, reduction=1):
+    """Avkoda bildbytes till BGR, med PIL som reserv för format som OpenCV inte kan läsa"""
+    image = cv2.imdecode(np.frombuffer(file_bytes, np.uint8), REDUCED_FLAGS[reduction])
+    if image is None and file_path is not None:
+        from PIL import Image
+        with Image.open(file_path) as pil_image:
+            if reduction > 1:
+                pil_image.draft('RGB', (pil_image.width // reduction, pil_image.height // reduction))
+            image = cv2.cvtColor(np.array(pil_image.convert('RGB')), cv2.COLOR_RGB2BGR)
+        if reduction > 1:
+            size = (max(1, image.shape[1] // reduction), max(1, image.shape[0] // reduction))
+            if image.shape[1::-1] != size:
+                image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    return image
+
+
+def read_image(file_path, reduction=1, timer=None):
+    """Läs en bild som BGR (klarar svenska tecken i sökvägen), med 'read'/'decode' i timer"""
+    timer = timer or StageTimer()
+    with timer.stage('read'):
+        with open(file_path, 'rb') as f:
+            file_bytes = f.read()
+    with timer.stage('decode'):
+        return decode_image(file_bytes, file_path, reduction)
+
+
+def write_image(file_path, image):
+    """Spara en bild (klarar svenska tecken i sökvägen, till skillnad från cv2.imwrite)"""
+    extension = os.path.splitext(file_path)[1] or '.png'
+    ok, encoded = cv2.imencode(extension, image)
+    if not ok:
+        raise ValueError(f"Kunde inte koda bilden som {extension}")
+    encoded.tofile(file_path)
+
+
+class LoadedImage:
+    """Resultat från ImageSource: bild (None vid fel), sökväg och tidsuppdelning för inläsningen"""
+
+    def __init__(self, path, image, timer, error=None):
+        self.path = path
+        self.image = image
+        self.timer = timer
+        self.error = error
+
+    @property
+    def nbytes(self):
+        return self.image.nbytes if self.image is not None else 0
+
+
+class ImageSource:
+    """Läser och avkodar kommande bilder i en trådpool medan den aktuella analyseras.
+
+    Bilderna lämnas ut i samma ordning som paths. Högst prefetch bilder läses i
+    förväg (0 = ingen förhämtning), och inga nya läsningar startas när avkodade
+    men ännu inte hämtade bilder upptar max_bytes (minst en bild läses alltid).
+
+    max_megapixels anger förhandsvisning: bilden avkodas då i reducerad
+    upplösning (IMREAD_REDUCED_*) så länge den blir minst så stor.
+    """
+
+    def __init__(self, paths, prefetch=DEFAULT_PREFETCH, max_bytes=DEFAULT_PREFETCH_BYTES,
+                 workers=None, max_megapixels=None):
+        self.paths = deque(paths)
+        self.prefetch = max(0, prefetch)
+        self.max_bytes = max_bytes
+        self.max_megapixels = max_megapixels
+        self.pool = ThreadPoolExecutor(max_workers=workers or max(1, min(self.prefetch, os.cpu_count() or 1)))
+        self.pending = deque()
+        # Uppskattad storlek för bilder som läses just nu (senast avkodade bildens storlek)
+        self.typical_bytes = 0
+
+    def load(self, path):
+        timer = StageTimer()
+        try:
+            reduction = 1
+            if self.max_megapixels:
+                with timer.stage('header'):
+                    reduction = reduction_for(image_size(path), self.max_megapixels)
+            image = read_image(path, reduction, timer)
+            if image is None:
+                return LoadedImage(path, None, timer, "Kunde inte läsa bildfilen - okänt format")
+            return LoadedImage(path, image, timer)
+        except Exception as e:
+            return LoadedImage(path, None, timer, str(e))
+
+    def buffered_bytes(self):
+        """Avkodade men ej hämtade bilder, plus uppskattning för pågående läsningar"""
+        total = 0
+        for future in self.pending:
+            total += future.result().nbytes if future.done() else self.typical_bytes
+        return total
+
+    def fill(self, count):
+        """Starta läsningar tills count bilder är på gång"""
+        while self.paths and len(self.pending) < count:
+            if self.pending and self.buffered_bytes() + self.typical_bytes > self.max_bytes:
+                break
+            self.pending.append(self.pool.submit(self.load, self.paths.popleft()))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.fill(max(1, self.prefetch))
+        if not self.pending:
+            self.close()
+            raise StopIteration
+        loaded = self.pending.popleft().result()
+        if loaded.image is not None:
+            self.typical_bytes = loaded.nbytes
+        # Nästa läsning startar innan anroparen börjar analysera den här bilden
+        self.fill(self.prefetch)
+        return loaded
+
+    def close(self):
+        self.paths.clear()
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.pool.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
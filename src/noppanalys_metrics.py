@@ -0,0 +1,12 @@
+"""Jämförelsemått för masker - delas av parametersvep, utvärdering och paritetstest"""
+import numpy as np
+
+
+def mask_iou(reference, candidate):
+    """Intersection over union för två binära masker (två tomma masker räknas som 1.0)"""
+    reference = np.asarray(reference) > 0
+    candidate = np.asarray(candidate) > 0
+    union = np.logical_or(reference, candidate).sum()
+    if union == 0:
+        return 1.0
+    return float(np.logical_and(reference, candidate).sum() / union)
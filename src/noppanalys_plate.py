@@ -0,0 +1,294 @@
+"""Provplatta: hitta flera runda Martindale-prover i en bild och analysera alla på en gång
+
+Körs från src-katalogen:
+
+    python noppanalys_plate.py platta.jpg --method "LBP + Varians" --workers 4
+
+Proverna hittas med Hough-cirklar på en nedskalad gråskalebild, med konturer
+som reserv. Varje prov analyseras i sin omskrivna kvadrat där ytan utanför
+cirkeln fyllts med provets medianfärg, och masken begränsas sedan till
+cirkeln (minus en kantmarginal) så att underlaget inte ger falska noppor.
+"""
+import argparse
+import json
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from noppanalys_instrumentation import StageTimer, append_jsonl
+
+# Bilden skalas ner så att längsta sidan blir högst så här lång vid sökningen
+DETECTION_MAX_SIDE = 800
+# Andel av radien närmast provets kant som inte räknas (kanteffekter från utfyllnaden)
+RIM_MARGIN = 0.04
+MAX_SPECIMENS = 12
+
+
+def find_specimens(image, max_specimens=MAX_SPECIMENS, min_radius_fraction=0.08, max_radius_fraction=0.3):
+    """Runda prover som lista av (x, y, radie) i bildpixlar, sorterade radvis uppifrån"""
+    h, w = image.shape[:2]
+    scale = min(1.0, DETECTION_MAX_SIDE / max(h, w))
+    small = cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+    # Kraftig utjämning - textilstrukturen ska inte ge cirkelkandidater
+    gray = cv2.medianBlur(gray, 7)
+
+    short_side = min(gray.shape)
+    min_radius = int(short_side * min_radius_fraction)
+    max_radius = int(short_side * max_radius_fraction)
+
+    circles = find_circles_hough(gray, min_radius, max_radius)
+    if not circles:
+        circles = find_circles_contours(gray, min_radius, max_radius)
+
+    circles = remove_overlapping(circles)[:max_specimens]
+    specimens = [(int(round(x / scale)), int(round(y / scale)), int(round(r / scale))) for x, y, r in circles]
+    return sort_reading_order(specimens)
+
+
+def find_circles_hough(gray, min_radius, max_radius):
+    """Cirkelkandidater med Hough-transform, starkast först"""
+    found = cv2.HoughCircles(gray, cv2.HOUGH_GRADIENT, dp=1.5, minDist=1.8 * min_radius, param1=100,
+                             param2=40, minRadius=min_radius, maxRadius=max_radius)
+    if found is None:
+        return []
+    return [tuple(float(v) for v in circle) for circle in found[0]]
+
+
+def find_circles_contours(gray, min_radius, max_radius):
+    """Reserv: runda konturer efter Otsu-tröskling (prover mot kontrasterande underlag)"""
+    circles = []
+    for inverted in (False, True):
+        flag = cv2.THRESH_BINARY_INV if inverted else cv2.THRESH_BINARY
+        _, binary = cv2.threshold(gray, 0, 255, flag + cv2.THRESH_OTSU)
+        contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        for contour in contours:
+            (x, y), radius = cv2.minEnclosingCircle(contour)
+            if not min_radius <= radius <= max_radius:
+                continue
+            # Konturen ska fylla sin omskrivna cirkel för att räknas som rund
+            if cv2.contourArea(contour) / (np.pi * radius**2) > 0.75:
+                circles.append((x, y, radius))
+        if circles:
+            break
+    return sorted(circles, key=lambda circle: -circle[2])
+
+
+def remove_overlapping(circles):
+    """Behåll cirklar i given ordning som inte överlappar en redan vald cirkel"""
+    kept = []
+    for x, y, r in circles:
+        if all(np.hypot(x - kx, y - ky) >= 0.9 * (r + kr) for kx, ky, kr in kept):
+            kept.append((x, y, r))
+    return kept
+
+
+def sort_reading_order(specimens):
+    """Sortera radvis uppifrån och vänster till höger inom varje rad"""
+    if not specimens:
+        return []
+    radius = np.median([r for _, _, r in specimens])
+    rows = []
+    for specimen in sorted(specimens, key=lambda s: s[1]):
+        if rows and abs(specimen[1] - rows[-1][0][1]) < radius:
+            rows[-1].append(specimen)
+        else:
+            rows.append([specimen])
+    return [specimen for row in rows for specimen in sorted(row, key=lambda s: s[0])]
+
+
+def crop_specimen(image, specimen):
+    """Omskriven kvadrat runt provet och cirkelmask (bool) i kvadratens koordinater"""
+    x, y, r = specimen
+    h, w = image.shape[:2]
+    x0, x1 = max(0, x - r), min(w, x + r + 1)
+    y0, y1 = max(0, y - r), min(h, y + r + 1)
+    crop = image[y0:y1, x0:x1].copy()
+    yy, xx = np.ogrid[y0:y1, x0:x1]
+    circle = (xx - x)**2 + (yy - y)**2 <= r**2
+    # Utanför cirkeln: provets medianfärg, så att underlagets kant inte ser ut som noppor
+    crop[~circle] = np.median(crop[circle], axis=0).astype(crop.dtype)
+    return crop, circle, (x0, y0, x1, y1)
+
+
+def specimen_stats(analyzer, nop_mask, feature_map, method_stats, circle):
+    """Noppstatistik räknad bara inom provets cirkel (minus kantmarginal)"""
+    # Radien ur cirkelns yta, så att ett prov som skärs av bildkanten får rätt kantmarginal
+    r = np.sqrt(circle.sum() / np.pi)
+    inner = cv2.erode(circle.astype(np.uint8), cv2.getStructuringElement(
+        cv2.MORPH_ELLIPSE, (2 * int(r * RIM_MARGIN) + 1,) * 2)) > 0
+    mask = (nop_mask > 0) & inner
+
+    stats = dict(method_stats)
+    stats.update(analyzer.calculate_pilling_stats(mask.astype(np.uint8), feature_map))
+    area = int(inner.sum())
+    values = np.asarray(feature_map)[inner]
+    stats.update({
+        'total_pixels': area,
+        'nop_percentage': stats['nop_pixels'] / area * 100 if area else 0.0,
+        'pill_density': stats['num_pills'] / (area / 10000) if area and stats['num_pills'] else 0,
+        'mean_intensity': float(values.mean()) if values.size else 0.0,
+        'max_intensity': float(values.max()) if values.size else 0.0,
+        'std_intensity': float(values.std()) if values.size else 0.0
+    })
+    return mask, stats
+
+
+def _init_worker(parameters):
+    """Förbered en arbetsprocess med en analysator för alla prover"""
+    global _worker_analyzer
+    from noppanalys_headless import HeadlessAnalyzer
+    _worker_analyzer = HeadlessAnalyzer(parameters)
+
+
+def analyze_specimen(crop, circle, method_name, analyzer=None):
+    """Kör metoden på ett provs kvadrat, returnerar (mask inom cirkeln, stats)"""
+    analyzer = analyzer or _worker_analyzer
+    analyzer.set_image(crop)
+    timer = StageTimer()
+    nop_mask, feature_map, method_stats = analyzer.run_method(method_name, timer)
+    if nop_mask is None:
+        raise ValueError(f"{method_name} gav inget resultat")
+    mask, stats = specimen_stats(analyzer, nop_mask, feature_map, method_stats, circle)
+    stats['timings'] = timer.to_dict()
+    return np.packbits(mask), stats
+
+
+def aggregate_results(results):
+    """Sammanställning över alla prover eller områden: medel, spridning och sämsta"""
+    stats_list = [result['stats'] for result in results if 'stats' in result]
+    if not stats_list:
+        return {'count': 0}
+
+    summary = {'count': len(stats_list)}
+    for name in ('num_pills', 'nop_percentage', 'pill_density', 'avg_pill_area', 'avg_circularity'):
+        values = [float(stats[name]) for stats in stats_list]
+        summary[name] = {'mean': float(np.mean(values)), 'std': float(np.std(values)),
+                         'min': float(np.min(values)), 'max': float(np.max(values))}
+
+    grades = [stats['pilling_grade'] for stats in stats_list if 'pilling_grade' in stats]
+    if grades:
+        # Sämsta provet avgör plattan, medianen visar den typiska graden
+        summary['pilling_grade'] = {'median': float(np.median(grades)), 'min': int(min(grades)),
+                                    'max': int(max(grades))}
+    worst = max(results, key=lambda result: result.get('stats', {}).get('nop_percentage', -1))
+    summary['worst'] = worst['index']
+    return summary
+
+
+def analyze_plate(image, method_name, parameters=None, specimens=None, workers=None):
+    """Hitta proverna (om inte givna) och analysera dem parallellt, returnerar rapport-dict"""
+    if specimens is None:
+        specimens = find_specimens(image)
+    if not specimens:
+        return {'method': method_name, 'specimens': [], 'summary': {'count': 0}}
+
+    crops = [crop_specimen(image, specimen) for specimen in specimens]
+    workers = max(1, min(workers or multiprocessing.cpu_count(), len(specimens)))
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                             initargs=(parameters or {},)) as pool:
+        futures = [pool.submit(analyze_specimen, crop, circle, method_name) for crop, circle, _ in crops]
+
+        results = []
+        for index, (specimen, (crop, circle, box), future) in enumerate(zip(specimens, crops, futures), start=1):
+            result = {'index': index, 'center': specimen[:2], 'radius': specimen[2], 'box': box}
+            try:
+                bits, stats = future.result()
+                result['mask'] = np.unpackbits(bits, count=circle.size).reshape(circle.shape).astype(bool)
+                result['stats'] = stats
+            except Exception as e:
+                result['error'] = str(e)
+            results.append(result)
+
+    return {'method': method_name, 'parameters': parameters or {}, 'specimens': results,
+            'summary': aggregate_results(results)}
+
+
+def annotate_plate(image, report):
+    """Bild med provcirklar, nummer och detekterade noppor i grönt"""
+    annotated = image.copy()
+    thickness = max(2, image.shape[1] // 800)
+    for result in report['specimens']:
+        x, y = result['center']
+        if 'mask' in result:
+            x0, y0, x1, y1 = result['box']
+            region = annotated[y0:y1, x0:x1]
+            overlay = region.copy()
+            overlay[result['mask']] = [0, 255, 0]
+            annotated[y0:y1, x0:x1] = cv2.addWeighted(region, 0.7, overlay, 0.3, 0)
+        cv2.circle(annotated, (x, y), result['radius'], (0, 0, 255), thickness)
+        cv2.putText(annotated, str(result['index']), (x - 10 * thickness, y + 10 * thickness),
+                    cv2.FONT_HERSHEY_SIMPLEX, thickness, (0, 0, 255), thickness * 2)
+    return annotated
+
+
+def format_plate_report(report):
+    """Textrapport: en rad per prov och sammanställning"""
+    lines = [f"=== PROVPLATTA - {report['method'].upper()} ===", ""]
+    lines.append(f"{'Prov':<6} {'Centrum':<14} {'Noppor':<8} {'Andel%':<8} {'Densitet':<10} {'Grad':<5}")
+    lines.append("-" * 56)
+    for result in report['specimens']:
+        center = f"({result['center'][0]}, {result['center'][1]})"
+        if 'stats' not in result:
+            lines.append(f"{result['index']:<6} {center:<14} fel: {result['error']}")
+            continue
+        stats = result['stats']
+        grade = str(stats.get('pilling_grade', '-'))
+        lines.append(f"{result['index']:<6} {center:<14} {stats['num_pills']:<8} "
+                     f"{stats['nop_percentage']:<8.2f} {stats['pill_density']:<10.2f} {grade:<5}")
+
+    summary = report['summary']
+    lines.append("")
+    if not summary['count']:
+        lines.append("Inga prover hittades")
+        return "\n".join(lines)
+    lines.append(f"Antal prover: {summary['count']}")
+    lines.append(f"Andel noppor: medel {summary['nop_percentage']['mean']:.2f}% "
+                 f"(min {summary['nop_percentage']['min']:.2f}, max {summary['nop_percentage']['max']:.2f})")
+    lines.append(f"Noppor per prov: medel {summary['num_pills']['mean']:.1f}")
+    if 'pilling_grade' in summary:
+        grade = summary['pilling_grade']
+        lines.append(f"Noppgrad: median {grade['median']:.1f}, sämsta {grade['min']}, bästa {grade['max']}")
+    lines.append(f"Mest noppigt prov: {summary['worst']}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    from noppanalys_headless import read_image
+    from noppanalys_loader import write_image
+
+    parser = argparse.ArgumentParser(description="Analysera alla prover på en provplatta")
+    parser.add_argument('image', help="Bild på provplattan")
+    parser.add_argument('--method', default="LBP + Varians", help="Analysmetod")
+    parser.add_argument('--parameters', type=json.loads, default=None,
+                        help='Analysparametrar som JSON, t.ex. \'{"threshold": 90}\'')
+    parser.add_argument('--workers', type=int, default=None, help="Antal arbetsprocesser (standard: antal kärnor)")
+    parser.add_argument('--output', default=None, help="JSONL-fil att lägga till en post per prov i")
+    parser.add_argument('--annotated', default=None, help="Spara bild med markerade prover och noppor")
+    args = parser.parse_args(argv)
+
+    image = read_image(args.image)
+    if image is None:
+        print(f"Kunde inte läsa {args.image}")
+        return 1
+
+    report = analyze_plate(image, args.method, parameters=args.parameters, workers=args.workers)
+    print(format_plate_report(report))
+
+    if args.output:
+        for result in report['specimens']:
+            record = {key: value for key, value in result.items() if key != 'mask'}
+            append_jsonl(args.output, {'image': args.image, 'method': args.method,
+                                       'parameters': report['parameters'], **record,
+                                       'plate_summary': report['summary']})
+    if args.annotated:
+        write_image(args.annotated, annotate_plate(image, report))
+    return 0 if report['summary']['count'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
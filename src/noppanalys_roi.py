@@ -0,0 +1,303 @@
+"""Analys av flera områden (ROI) i samma bild i ett svep
+
+Körs från src-katalogen:
+
+    python noppanalys_roi.py prov.jpg --grid 3x3 --method "LBP + Varians"
+    python noppanalys_roi.py prov.jpg --rois-from noppanalys_timings.jsonl --method "Fourier + Gauss"
+    python noppanalys_roi.py prov.jpg --roi 100,100,900,900 --roi 1000,100,1800,900
+
+Mellanresultat för hela bilden (LBP, lokal varians, högpassfiltrerad FFT,
+wavelet-detaljenergi, top-hat och DPCA:s feature map) beräknas en gång och
+skärs ut för varje område. Tröskling, morfologi och statistik görs per område.
+Nära områdets kant skiljer sig resultatet därför något från en separat analys
+av en utklippt bild: filtren ser verkliga grannpixlar istället för kantutfyllnad.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from noppanalys_headless import HeadlessAnalyzer, read_image
+from noppanalys_instrumentation import StageTimer, append_jsonl
+from noppanalys_plate import aggregate_results
+
+# Samma minsta områdesstorlek som vid zoom i GUI:t
+MIN_ROI_SIZE = 50
+
+
+def grid_rois(shape, rows, cols, margin=0):
+    """Rutnätsmall: rows x cols lika stora områden, med margin pixlar mellan och runt dem"""
+    h, w = shape[:2]
+    cell_w = (w - margin * (cols + 1)) // cols
+    cell_h = (h - margin * (rows + 1)) // rows
+    return [(margin + c * (cell_w + margin), margin + r * (cell_h + margin),
+             margin + c * (cell_w + margin) + cell_w, margin + r * (cell_h + margin) + cell_h)
+            for r in range(rows) for c in range(cols)]
+
+
+def rois_from_export(path, image_path=None):
+    """Sparade roi_coords ur en JSONL-export från GUI:t, valfritt bara för en viss bild"""
+    rois = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            roi = record.get('roi')
+            if not roi:
+                continue
+            if image_path and os.path.basename(record.get('image') or '') != os.path.basename(image_path):
+                continue
+            if tuple(roi) not in rois:
+                rois.append(tuple(roi))
+    return rois
+
+
+def clip_roi(roi, shape):
+    """ROI (x1, y1, x2, y2) i rätt ordning och inom bilden, ValueError om den blir för liten"""
+    h, w = shape[:2]
+    x1, y1, x2, y2 = (int(v) for v in roi)
+    x1, x2 = max(0, min(x1, x2)), min(w, max(x1, x2))
+    y1, y2 = max(0, min(y1, y2)), min(h, max(y1, y2))
+    if x2 - x1 < MIN_ROI_SIZE or y2 - y1 < MIN_ROI_SIZE:
+        raise ValueError(f"För litet område: {roi}")
+    return x1, y1, x2, y2
+
+
+class RegionAnalyzer(HeadlessAnalyzer):
+    """HeadlessAnalyzer som skär ut områden ur mellanresultat beräknade en gång för hela bilden.
+
+    Mellanresultaten sparas per parameteruppsättning, så flera metoder (och
+    Kombinerad, som kör fyra metoder) delar t.ex. samma LBP och FFT.
+    """
+
+    def __init__(self, parameters=None, track_memory=False):
+        super().__init__(parameters, track_memory=track_memory)
+        self.region = None
+        self.full_gray = None
+        self.full_digest = None
+        self.shared = {}
+
+    def set_image(self, image, image_path=None, load_timer=None):
+        """Använd en ny helbild, mellanresultat från föregående bild kastas"""
+        self.region = None
+        self.shared = {}
+        super().set_image(image, image_path, load_timer)
+        self.full_gray = self.gray_image
+        self.full_digest = self.image_digest
+
+    def select_region(self, roi):
+        """Analysera området roi = (x1, y1, x2, y2), None = hela bilden"""
+        self.region = roi
+        self.roi_coords = roi
+        self.lbp_rgb = None
+        # Bildhashen gäller helbilden och får inte nyckla resultat för ett område
+        self.image_digest = self.full_digest if roi is None else None
+        if roi is None:
+            self.original_image = self.full_original_image
+            self.gray_image = self.full_gray
+        else:
+            self.original_image = self.crop(self.full_original_image)
+            self.gray_image = self.crop(self.full_gray)
+
+    def crop(self, array):
+        """Vy av aktuellt område ur en helbildsarray"""
+        x1, y1, x2, y2 = self.region
+        return array[y1:y2, x1:x2]
+
+    def shared_result(self, key, compute):
+        """Mellanresultat för hela bilden, beräknat första gången det behövs"""
+        if key not in self.shared:
+            with self.timed_stage('shared'):
+                self.shared[key] = compute()
+        return self.shared[key]
+
+    def process_image(self):
+        """LBP per kanal, utskuren ur helbildens LBP"""
+        if self.region is None:
+            return super().process_image()
+        full = self.shared_result(('lbp',), self.full_lbp)
+        self.lbp_rgb = [self.crop(channel) for channel in full]
+
+    def full_lbp(self):
+        """LBP för hela bilden (anropas en gång via shared_result)"""
+        region, self.region = self.region, None
+        original, self.original_image = self.original_image, self.full_original_image
+        try:
+            super().process_image()
+            return self.lbp_rgb
+        finally:
+            self.region, self.original_image = region, original
+
+    def local_variance(self, image, size=9):
+        """Lokal varians av en LBP-kanal, utskuren ur helbildens varians"""
+        index = next((i for i, channel in enumerate(self.lbp_rgb or []) if channel is image), None)
+        if self.region is None or index is None:
+            return super().local_variance(image, size)
+        full_lbp = self.shared[('lbp',)][index]
+        parent = super().local_variance
+        return self.crop(self.shared_result(('variance', index, size), lambda: parent(full_lbp, size)))
+
+    def fourier_highpass(self, gray):
+        """Högpassfiltrerad bild, utskuren ur helbildens FFT-filtrering"""
+        if self.region is None:
+            return super().fourier_highpass(gray)
+        parent = super().fourier_highpass
+        return self.crop(self.shared_result(('fourier', self.gauss_sigma_var.get()),
+                                            lambda: parent(self.full_gray)))
+
+    def wavelet_detail_energy(self, gray):
+        """Wavelet-detaljenergi, utskuren ur helbildens nedbrytning"""
+        if self.region is None:
+            return super().wavelet_detail_energy(gray)
+        parent = super().wavelet_detail_energy
+        return self.crop(self.shared_result(('wavelet', self.wavelet_var.get()),
+                                            lambda: parent(self.full_gray)))
+
+    def wavelet_level_energy(self, gray, level):
+        """Detaljenergi på en pyramidnivå, utskuren ur helbildens pyramid"""
+        if self.region is None:
+            return super().wavelet_level_energy(gray, level)
+        # Pyramiderna i wavelet_pyramids gäller alltid helbilden
+        energy = super().wavelet_level_energy(self.full_gray, level)
+        x1, y1, x2, y2 = self.region
+        scale = 2 ** level
+        return energy[y1 // scale:-(-y2 // scale), x1 // scale:-(-x2 // scale)]
+
+    def morphological_enhance(self, gray):
+        """Top-hat/bottom-hat-förstärkning, utskuren ur helbildens"""
+        if self.region is None:
+            return super().morphological_enhance(gray)
+        parent = super().morphological_enhance
+        return self.crop(self.shared_result(('morphology',), lambda: parent(self.full_gray)))
+
+    def create_dpca_feature_map(self, gray_image):
+        """DPCA:s feature map, utskuren ur helbildens"""
+        if self.region is None:
+            return super().create_dpca_feature_map(gray_image)
+        parent = super().create_dpca_feature_map
+        key = ('dpca', self.patch_size_var.get(), self.sampling_step_var.get())
+        return self.crop(self.shared_result(key, lambda: parent(self.full_gray)))
+
+    def analyze_regions(self, rois, method_name):
+        """Kör metoden på varje område i aktuell bild, returnerar en resultat-dict per område"""
+        results = []
+        for index, roi in enumerate(rois, start=1):
+            result = {'index': index, 'roi': roi}
+            self.select_region(roi)
+            timer = StageTimer(track_memory=self.track_memory)
+            try:
+                nop_mask, _, stats = self.run_method(method_name, timer)
+                if nop_mask is None:
+                    raise ValueError(f"{method_name} gav inget resultat")
+                stats['timings'] = timer.to_dict()
+                result['stats'] = stats
+            except Exception as e:
+                result['error'] = str(e)
+            results.append(result)
+        self.select_region(None)
+        return results
+
+
+def analyze_rois(image, rois, methods, parameters=None, image_path=None):
+    """Analysera alla områden med alla metoder i ett svep över bilden, returnerar en rapport per metod"""
+    analyzer = RegionAnalyzer(parameters)
+    unknown = [name for name in methods if name not in analyzer.available_methods]
+    if unknown:
+        raise ValueError(f"Okända analysmetoder: {', '.join(unknown)}")
+    rois = [clip_roi(roi, image.shape) for roi in rois]
+
+    analyzer.set_image(image, image_path)
+    reports = []
+    for method_name in methods:
+        start = time.perf_counter()
+        results = analyzer.analyze_regions(rois, method_name)
+        reports.append({'method': method_name, 'image': image_path, 'regions': results,
+                        'summary': aggregate_results(results), 'seconds': time.perf_counter() - start})
+    return reports
+
+
+def format_roi_report(report):
+    """Textrapport: en rad per område och sammanställning"""
+    lines = [f"=== OMRÅDEN - {report['method'].upper()} ===", ""]
+    lines.append(f"{'ROI':<5} {'Område (x1, y1, x2, y2)':<26} {'Noppor':<8} {'Andel%':<8} {'Densitet':<10} {'Grad':<5}")
+    lines.append("-" * 66)
+    for result in report['regions']:
+        area = "({}, {}, {}, {})".format(*result['roi'])
+        if 'stats' not in result:
+            lines.append(f"{result['index']:<5} {area:<26} fel: {result['error']}")
+            continue
+        stats = result['stats']
+        grade = str(stats.get('pilling_grade', '-'))
+        lines.append(f"{result['index']:<5} {area:<26} {stats['num_pills']:<8} "
+                     f"{stats['nop_percentage']:<8.2f} {stats['pill_density']:<10.2f} {grade:<5}")
+
+    summary = report['summary']
+    lines.append("")
+    if not summary['count']:
+        lines.append("Inga områden kunde analyseras")
+        return "\n".join(lines)
+    lines.append(f"Antal områden: {summary['count']} ({report['seconds']:.2f} s)")
+    lines.append(f"Andel noppor: medel {summary['nop_percentage']['mean']:.2f}% "
+                 f"(min {summary['nop_percentage']['min']:.2f}, max {summary['nop_percentage']['max']:.2f})")
+    lines.append(f"Noppor per område: medel {summary['num_pills']['mean']:.1f}")
+    if 'pilling_grade' in summary:
+        grade = summary['pilling_grade']
+        lines.append(f"Noppgrad: median {grade['median']:.1f}, sämsta {grade['min']}, bästa {grade['max']}")
+    lines.append(f"Mest noppigt område: {summary['worst']}")
+    return "\n".join(lines)
+
+
+def parse_grid(value):
+    """'3x4' -> (3, 4) rader x kolumner"""
+    rows, _, cols = value.lower().partition('x')
+    return int(rows), int(cols or rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analysera flera områden i samma bild i ett svep")
+    parser.add_argument('image', help="Bildfil")
+    parser.add_argument('--method', action='append', dest='methods',
+                        help="Analysmetod, kan anges flera gånger (standard: LBP + Varians)")
+    parser.add_argument('--parameters', type=json.loads, default=None,
+                        help='Analysparametrar som JSON, t.ex. \'{"threshold": 90}\'')
+    parser.add_argument('--grid', type=parse_grid, default=None, help="Rutnätsmall, t.ex. 3x3")
+    parser.add_argument('--margin', type=int, default=0, help="Marginal i pixlar mellan rutorna i --grid")
+    parser.add_argument('--roi', action='append', default=[],
+                        type=lambda value: tuple(int(v) for v in value.split(',')),
+                        help="Område x1,y1,x2,y2, kan anges flera gånger")
+    parser.add_argument('--rois-from', default=None,
+                        help="JSONL-export från GUI:t - sparade roi_coords för den här bilden används")
+    parser.add_argument('--output', default=None, help="JSONL-fil att lägga till en post per område i")
+    args = parser.parse_args(argv)
+
+    image = read_image(args.image)
+    if image is None:
+        print(f"Kunde inte läsa {args.image}")
+        return 1
+
+    rois = list(args.roi)
+    if args.grid:
+        rois.extend(grid_rois(image.shape, *args.grid, margin=args.margin))
+    if args.rois_from:
+        rois.extend(rois_from_export(args.rois_from, args.image))
+    if not rois:
+        parser.error("Ange områden med --roi, --grid eller --rois-from")
+
+    try:
+        reports = analyze_rois(image, rois, args.methods or ["LBP + Varians"], args.parameters, args.image)
+    except ValueError as e:
+        print(f"Fel: {e}")
+        return 1
+
+    for report in reports:
+        print(format_roi_report(report))
+        print()
+        if args.output:
+            for result in report['regions']:
+                append_jsonl(args.output, {'image': args.image, 'method': report['method'], **result,
+                                           'roi_summary': report['summary']})
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
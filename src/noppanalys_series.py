@@ -0,0 +1,271 @@
+"""Serieanalys av samma provbit efter allt fler nötningscykler (500, 1000, 2000 ...)
+
+Körs från src-katalogen:
+
+    python noppanalys_series.py prov3_*.jpg --method "LBP + Varians" --output serie.jsonl
+
+Varje ny bild justeras mot föregående (fascorrelation, heltalsförskjutning) och
+jämförs ruta för ruta. LBP, lokal varians och DPCA:s feature map är lokala
+operationer, så de räknas bara om i ändrade rutor plus närmaste grannrutor -
+övriga värden tas från föregående bild. Tröskling, morfologi och statistik
+beror på hela bilden (percentiltröskel) och körs alltid om, men är billiga.
+
+skimages LBP avrundar interpolerade grannvärden olika beroende på absolut
+koordinat, så enstaka LBP-koder vid exakt lika grannvärden kan skilja mot en
+fullständig omräkning (maskens IoU mot full analys är i praktiken > 0.99).
+"""
+import argparse
+import json
+import re
+import sys
+
+import cv2
+import numpy as np
+from skimage.feature import local_binary_pattern
+
+from noppanalys_headless import HeadlessAnalyzer, expand_paths
+from noppanalys_instrumentation import StageTimer, append_jsonl
+from noppanalys_loader import ImageSource
+
+DEFAULT_TILE_SIZE = 64
+# Medelavvikelse i gråskalenivåer per ruta som räknas som förändring
+DEFAULT_CHANGE_THRESHOLD = 4.0
+# Blockstorlek för differensens medelvärde (delar rutstorleken)
+BLOCK_SIZE = 8
+# Räkna om hela bilden när en större andel än så har ändrats
+MAX_DELTA_FRACTION = 0.5
+
+
+def estimate_shift(reference_gray, gray):
+    """Förskjutning (dx, dy) i hela pixlar som lägger gray ovanpå reference_gray"""
+    window = cv2.createHanningWindow(gray.shape[::-1], cv2.CV_32F)
+    (dx, dy), _ = cv2.phaseCorrelate(gray.astype(np.float32), reference_gray.astype(np.float32), window)
+    return int(round(dx)), int(round(dy))
+
+
+def shift_image(image, shift):
+    """Flytta bilden (dx, dy) hela pixlar, kanterna fylls med närmaste pixel"""
+    dx, dy = shift
+    if dx == 0 and dy == 0:
+        return image
+    matrix = np.float32([[1, 0, dx], [0, 1, dy]])
+    return cv2.warpAffine(image, matrix, image.shape[1::-1], flags=cv2.INTER_NEAREST,
+                          borderMode=cv2.BORDER_REPLICATE)
+
+
+def changed_tiles(previous_gray, gray, tile_size=DEFAULT_TILE_SIZE, threshold=DEFAULT_CHANGE_THRESHOLD):
+    """Boolesk rutmatris: True där något block i rutan avviker mer än threshold i medel.
+
+    Differensen medelvärdesbildas i block om BLOCK_SIZE x BLOCK_SIZE pixlar så
+    att brus per pixel jämnas ut, medan en lokal förändring som bara täcker en
+    liten del av rutan ändå upptäcks.
+    """
+    h, w = gray.shape
+    rows, cols = -(-h // tile_size), -(-w // tile_size)
+    difference = cv2.absdiff(previous_gray, gray)
+    padded = np.zeros((rows * tile_size, cols * tile_size), dtype=np.uint8)
+    padded[:h, :w] = difference
+
+    blocks_per_tile = tile_size // BLOCK_SIZE
+    block_means = cv2.resize(padded, (cols * blocks_per_tile, rows * blocks_per_tile),
+                             interpolation=cv2.INTER_AREA).astype(np.float32)
+    tile_max = block_means.reshape(rows, blocks_per_tile, cols, blocks_per_tile).max(axis=(1, 3))
+    return tile_max > threshold
+
+
+def border_tiles(tiles_shape, tile_size, shape, shift):
+    """Rutor som berörs av kanten som fyllts ut när bilden flyttats"""
+    dx, dy = shift
+    h, w = shape
+    border = np.zeros(tiles_shape, dtype=bool)
+    if dy > 0:
+        border[:-(-dy // tile_size)] = True
+    elif dy < 0:
+        border[(h + dy) // tile_size:] = True
+    if dx > 0:
+        border[:, :-(-dx // tile_size)] = True
+    elif dx < 0:
+        border[:, (w + dx) // tile_size:] = True
+    return border
+
+
+def dirty_regions(tiles, tile_size, shape):
+    """Rektanglar (y0, y1, x0, x1) att räkna om: ändrade rutor plus en ring av grannrutor.
+
+    Grannringen gör att alla pixlar som en ändring kan påverka via ett lokalt
+    fönster (mindre än en ruta) räknas om. Angränsande rutor i samma rad slås
+    ihop till en rektangel för att minska antalet anrop.
+    """
+    dirty = cv2.dilate(tiles.astype(np.uint8), np.ones((3, 3), np.uint8)) > 0
+    h, w = shape
+    regions = []
+    for row in range(dirty.shape[0]):
+        col = 0
+        while col < dirty.shape[1]:
+            if not dirty[row, col]:
+                col += 1
+                continue
+            start = col
+            while col < dirty.shape[1] and dirty[row, col]:
+                col += 1
+            regions.append((row * tile_size, min((row + 1) * tile_size, h),
+                            start * tile_size, min(col * tile_size, w)))
+    return regions
+
+
+class SeriesAnalyzer(HeadlessAnalyzer):
+    """HeadlessAnalyzer som återanvänder lokala mellanresultat från föregående bild i en serie"""
+
+    def __init__(self, parameters=None, tile_size=DEFAULT_TILE_SIZE, change_threshold=DEFAULT_CHANGE_THRESHOLD,
+                 cache=None):
+        super().__init__(parameters, cache=cache)
+        self.tile_size = tile_size
+        self.change_threshold = change_threshold
+        self.reference_gray = None
+        # Rektanglar att räkna om för aktuell bild, None = räkna om allt
+        self.delta_regions = None
+        # Mellanresultat: nyckel -> (bildens nummer i serien, array)
+        self.delta_cache = {}
+        self.capture_index = -1
+
+    def analyze_capture(self, image, image_path, methods, load_timer=None):
+        """Justera bilden mot föregående, hitta ändrade rutor och kör metoderna"""
+        load_timer = load_timer or StageTimer()
+        self.capture_index += 1
+        with load_timer.stage('align'):
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            shift = (0, 0)
+            if self.reference_gray is not None and self.reference_gray.shape == gray.shape:
+                shift = estimate_shift(self.reference_gray, gray)
+                image = shift_image(image, shift)
+                gray = shift_image(gray, shift)
+
+        with load_timer.stage('change_detection'):
+            if self.reference_gray is None or self.reference_gray.shape != gray.shape:
+                self.delta_regions = None
+                self.delta_cache = {}
+                changed_fraction = 1.0
+            else:
+                tiles = changed_tiles(self.reference_gray, gray, self.tile_size, self.change_threshold)
+                tiles |= border_tiles(tiles.shape, self.tile_size, gray.shape, shift)
+                self.delta_regions = dirty_regions(tiles, self.tile_size, gray.shape)
+                changed_fraction = sum((y1 - y0) * (x1 - x0) for y0, y1, x0, x1 in self.delta_regions) / gray.size
+                if changed_fraction > MAX_DELTA_FRACTION:
+                    self.delta_regions = None
+                    changed_fraction = 1.0
+
+        records = self.analyze_image(image, image_path, methods, load_timer)
+        self.reference_gray = gray
+        for record in records:
+            # Förskjutningen är relativ första bilden, eftersom föregående bild redan är justerad
+            record['series'] = {'shift': shift, 'recomputed_fraction': changed_fraction}
+        return records
+
+    def recompute(self, key, full, compute, source, halo):
+        """Räkna om en lokal operation bara i delta_regions.
+
+        compute(region) ska ge samma resultat för regionens inre som full ger
+        på motsvarande pixlar, så länge regionen har minst halo pixlar marginal.
+        Cachen används bara om den hör till föregående bild i serien.
+        """
+        cached_index, cached = self.delta_cache.get(key, (None, None))
+        if cached_index == self.capture_index:
+            return cached  # Redan beräknad för den här bilden (t.ex. av Kombinerad)
+        if (self.delta_regions is None or cached_index != self.capture_index - 1
+                or cached.shape[:2] != source.shape[:2]):
+            result = full()
+        else:
+            result = cached.copy()
+            h, w = source.shape[:2]
+            for y0, y1, x0, x1 in self.delta_regions:
+                iy0, iy1 = max(0, y0 - halo), min(h, y1 + halo)
+                ix0, ix1 = max(0, x0 - halo), min(w, x1 + halo)
+                region = compute(source[iy0:iy1, ix0:ix1])
+                result[y0:y1, x0:x1] = region[y0 - iy0:y1 - iy0, x0 - ix0:x1 - ix0]
+        self.delta_cache[key] = (self.capture_index, result)
+        return result
+
+    def process_image(self):
+        """LBP per kanal, omräknad bara i ändrade rutor"""
+        channels = cv2.split(self.original_image)
+        halo = self.radius + 2
+        self.lbp_rgb = [
+            self.recompute(('lbp', index), lambda ch=channel: local_binary_pattern(ch, self.n_points, self.radius,
+                                                                                   self.method),
+                           lambda region: local_binary_pattern(region, self.n_points, self.radius, self.method),
+                           channel, halo)
+            for index, channel in enumerate(channels)
+        ]
+
+    def local_variance(self, image, size=9):
+        """Lokal varians av en LBP-kanal, omräknad bara i ändrade rutor"""
+        index = next((i for i, channel in enumerate(self.lbp_rgb or []) if channel is image), None)
+        if index is None:
+            return super().local_variance(image, size)
+        parent = super().local_variance
+        return self.recompute(('variance', index, size), lambda: parent(image, size),
+                              lambda region: parent(region, size), image, size // 2 + 1)
+
+    def create_dpca_feature_map(self, gray_image):
+        """DPCA:s feature map, omräknad bara i ändrade rutor (när varje pixel samplas)"""
+        parent = super().create_dpca_feature_map
+        patch_size = self.patch_size_var.get()
+        if self.sampling_step_var.get() != 1 or patch_size // 2 + 1 > self.tile_size:
+            return parent(gray_image)
+        return self.recompute(('dpca', patch_size), lambda: parent(gray_image), parent, gray_image,
+                              patch_size // 2 + 1)
+
+
+def natural_key(path):
+    """Sorteringsnyckel där tal jämförs som tal (prov_500 före prov_1000)"""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', path)]
+
+
+def run_series(file_paths, methods, parameters=None, output=None, tile_size=DEFAULT_TILE_SIZE,
+               change_threshold=DEFAULT_CHANGE_THRESHOLD):
+    """Analysera en bildserie i ordning, returnerar alla poster"""
+    analyzer = SeriesAnalyzer(parameters, tile_size=tile_size, change_threshold=change_threshold)
+    unknown = [name for name in methods if name not in analyzer.available_methods]
+    if unknown:
+        raise ValueError(f"Okända analysmetoder: {', '.join(unknown)}")
+
+    all_records = []
+    with ImageSource(file_paths) as source:
+        for loaded in source:
+            if loaded.image is None:
+                print(f"Fel i {loaded.path}: {loaded.error}")
+                continue
+            records = analyzer.analyze_capture(loaded.image, loaded.path, methods, loaded.timer)
+            for record in records:
+                stats = record['stats']
+                print(f"{loaded.path}: {record['method']}: {stats['num_pills']} noppor, "
+                      f"{stats['nop_percentage']:.2f}% (omräknat {record['series']['recomputed_fraction']:.0%}, "
+                      f"{stats['timings']['total_seconds']:.2f} s)")
+                if output:
+                    append_jsonl(output, record)
+            all_records.extend(records)
+    return all_records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serieanalys av samma provbit efter allt fler nötningscykler")
+    parser.add_argument('images', nargs='+', help="Bildfiler i serien (sorteras naturligt, t.ex. efter antal cykler)")
+    parser.add_argument('--method', action='append', dest='methods',
+                        help="Analysmetod, kan anges flera gånger (standard: LBP + Varians)")
+    parser.add_argument('--parameters', type=json.loads, default=None,
+                        help='Analysparametrar som JSON, t.ex. \'{"threshold": 90}\'')
+    parser.add_argument('--output', default='noppanalys_serie.jsonl', help="JSONL-fil att lägga till resultat i")
+    parser.add_argument('--tile-size', type=int, default=DEFAULT_TILE_SIZE, help="Rutstorlek i pixlar")
+    parser.add_argument('--change-threshold', type=float, default=DEFAULT_CHANGE_THRESHOLD,
+                        help="Medelavvikelse (gråskalenivåer) för att en ruta ska räknas som ändrad")
+    args = parser.parse_args(argv)
+
+    paths = sorted(expand_paths(args.images), key=natural_key)
+    records = run_series(paths, args.methods or ["LBP + Varians"], parameters=args.parameters, output=args.output,
+                         tile_size=args.tile_size, change_threshold=args.change_threshold)
+    print(f"{len(records)} resultat tillagda i {args.output}")
+    return 0 if records else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
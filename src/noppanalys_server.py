@@ -0,0 +1,332 @@
+"""Lokal HTTP-tjänst för noppanalys - andra program kan hämta noppstatistik utan GUI:t
+
+Körs från src-katalogen:
+
+    python noppanalys_server.py --port 8765 --workers 2
+
+Anrop:
+
+    POST /analyze  bilddata i kroppen, ?method=...&parameters={json}&mask=1
+    POST /analyze  JSON {"path": "...", "method": "...", "parameters": {...}, "mask": true}
+    GET  /metrics  antal anrop, kö och svarstider (percentiler)
+    GET  /health   tillgängliga metoder och antal arbetsprocesser
+
+Svaret är JSON med stats från calculate_pilling_stats och, om mask begärts,
+masken som base64-kodad PNG. Tjänsten lyssnar bara på localhost som standard
+eftersom den kan läsa filer via "path".
+"""
+import argparse
+import base64
+import json
+import multiprocessing
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from noppanalys_instrumentation import json_default
+
+DEFAULT_PORT = 8765
+MAX_BODY_BYTES = 256 * 2**20
+
+
+def _init_worker():
+    """Förbered en arbetsprocess: alla tunga moduler importeras innan första anropet"""
+    global _worker_analyzer
+    from noppanalys_gui import WARM_UP_MODULES, lazy_import
+    from noppanalys_headless import HeadlessAnalyzer
+    for module_name in WARM_UP_MODULES + ['skimage.filters', 'skimage.morphology']:
+        lazy_import(module_name)
+    _worker_analyzer = HeadlessAnalyzer()
+
+
+def _analyze_job(image_bytes, path, method_name, parameters, want_mask):
+    """Analysera en bild i arbetsprocessen, returnerar en JSON-serialiserbar dict"""
+    import cv2
+    from noppanalys_headless import DEFAULT_PARAMETERS, read_image
+
+    analyzer = _worker_analyzer
+    # Parametrar från ett tidigare anrop får inte följa med till nästa
+    analyzer.set_parameters({**DEFAULT_PARAMETERS, **(parameters or {})})
+
+    if image_bytes is not None:
+        image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    else:
+        try:
+            image = read_image(path)
+        except FileNotFoundError:
+            raise
+        except OSError as e:
+            raise ValueError(f"Kunde inte läsa {path}: {e}") from e
+    if image is None:
+        raise ValueError("Kunde inte avkoda bilden")
+
+    start = time.perf_counter()
+    analyzer.set_image(image, path)
+    nop_mask, _, stats = analyzer.run_method(method_name)
+    if nop_mask is None:
+        raise ValueError(f"{method_name} gav inget resultat")
+
+    result = {
+        'method': method_name,
+        'shape': image.shape[:2],
+        'parameters': analyzer.get_parameter_snapshot(),
+        'stats': stats,
+        'analysis_seconds': time.perf_counter() - start
+    }
+    if want_mask:
+        ok, png = cv2.imencode('.png', (nop_mask > 0).astype(np.uint8) * 255)
+        if ok:
+            result['mask_png'] = base64.b64encode(png.tobytes()).decode('ascii')
+    # Omvandla numpy-typer här så att huvudprocessen bara skickar vidare
+    return json.loads(json.dumps(result, default=json_default))
+
+
+def _warm_up(_):
+    """Tom uppgift som tvingar fram start av arbetsprocesserna"""
+    return True
+
+
+class LatencyMetrics:
+    """Räknare och svarstider för de senaste anropen (trådsäkert)"""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counts = {'requests': 0, 'ok': 0, 'errors': 0, 'rejected': 0}
+        self.latencies = deque(maxlen=window)
+        self.queue_waits = deque(maxlen=window)
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def observe(self, latency, queue_wait):
+        with self.lock:
+            self.latencies.append(latency)
+            self.queue_waits.append(queue_wait)
+
+    @staticmethod
+    def percentiles(values):
+        if not values:
+            return {'p50': None, 'p90': None, 'p99': None, 'max': None}
+        p50, p90, p99 = np.percentile(values, [50, 90, 99])
+        return {'p50': float(p50), 'p90': float(p90), 'p99': float(p99), 'max': float(max(values))}
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'uptime_seconds': time.time() - self.started,
+                **self.counts,
+                'window': len(self.latencies),
+                'latency_seconds': self.percentiles(list(self.latencies)),
+                'queue_wait_seconds': self.percentiles(list(self.queue_waits))
+            }
+
+
+class AnalysisService:
+    """Kö och pool av förstartade arbetsprocesser för analysanrop.
+
+    Högst workers analyser körs samtidigt. Upp till max_queue anrop till får
+    vänta i kö (högst queue_timeout sekunder) - fler än så avvisas direkt.
+    """
+
+    def __init__(self, workers=1, max_queue=16, queue_timeout=30.0):
+        from noppanalys_headless import HeadlessAnalyzer
+        self.methods = list(HeadlessAnalyzer().available_methods)
+        self.workers = workers
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.slots = threading.BoundedSemaphore(workers)
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.metrics = LatencyMetrics()
+
+        context = multiprocessing.get_context('spawn')
+        self.pool = ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker)
+        list(self.pool.map(_warm_up, range(workers)))
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+    def analyze(self, image_bytes=None, path=None, method_name="LBP + Varians", parameters=None,
+                want_mask=False):
+        """Kör en analys, returnerar (HTTP-status, svar)"""
+        if method_name not in self.methods:
+            self.metrics.count('errors')
+            return 400, {'error': f"Okänd analysmetod: {method_name}", 'methods': self.methods}
+
+        start = time.perf_counter()
+        with self.lock:
+            if self.queued >= self.max_queue:
+                self.metrics.count('rejected')
+                return 503, {'error': "Kön är full, försök igen senare"}
+            self.queued += 1
+        try:
+            acquired = self.slots.acquire(timeout=self.queue_timeout)
+        finally:
+            with self.lock:
+                self.queued -= 1
+        if not acquired:
+            self.metrics.count('rejected')
+            return 503, {'error': "Tidsgräns i kön, försök igen senare"}
+
+        queue_wait = time.perf_counter() - start
+        with self.lock:
+            self.running += 1
+        try:
+            result = self.pool.submit(_analyze_job, image_bytes, path, method_name, parameters,
+                                      want_mask).result()
+        except FileNotFoundError as e:
+            self.metrics.count('errors')
+            return 404, {'error': f"Filen finns inte: {e.filename}"}
+        except ValueError as e:
+            self.metrics.count('errors')
+            return 400, {'error': str(e)}
+        except Exception as e:
+            self.metrics.count('errors')
+            return 500, {'error': f"{type(e).__name__}: {e}"}
+        finally:
+            with self.lock:
+                self.running -= 1
+            self.slots.release()
+
+        latency = time.perf_counter() - start
+        self.metrics.count('ok')
+        self.metrics.observe(latency, queue_wait)
+        result['latency_seconds'] = latency
+        result['queue_wait_seconds'] = queue_wait
+        return 200, result
+
+    def metrics_snapshot(self):
+        with self.lock:
+            load = {'queued': self.queued, 'running': self.running, 'workers': self.workers,
+                    'max_queue': self.max_queue}
+        return {**self.metrics.snapshot(), **load}
+
+
+class AnalysisRequestHandler(BaseHTTPRequestHandler):
+    """HTTP-gränssnitt mot AnalysisService (server.service)"""
+
+    server_version = "Noppanalys/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, default=json_default, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 503:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.service
+        path = urlparse(self.path).path
+        if path == '/metrics':
+            self.send_json(200, service.metrics_snapshot())
+        elif path == '/health':
+            self.send_json(200, {'status': 'ok', 'methods': service.methods, 'workers': service.workers})
+        else:
+            self.send_json(404, {'error': f"Okänd sökväg: {path}"})
+
+    def do_POST(self):
+        service = self.server.service
+        url = urlparse(self.path)
+        if url.path != '/analyze':
+            self.send_json(404, {'error': f"Okänd sökväg: {url.path}"})
+            return
+
+        service.metrics.count('requests')
+        try:
+            length = self.content_length()
+            if length > MAX_BODY_BYTES:
+                self.send_json(413, {'error': f"Bilden är större än {MAX_BODY_BYTES // 2**20} MB"})
+                return
+            body = self.rfile.read(length)
+            request = self.parse_request_options(url.query, body)
+        except (ValueError, json.JSONDecodeError) as e:
+            service.metrics.count('errors')
+            self.send_json(400, {'error': str(e)})
+            return
+
+        status, payload = service.analyze(**request)
+        self.send_json(status, payload)
+
+    def content_length(self):
+        """Content-Length som heltal, ValueError om huvudet är felaktigt"""
+        value = self.headers.get('Content-Length') or '0'
+        if not value.strip().isdigit():
+            raise ValueError(f"Ogiltig Content-Length: {value!r}")
+        return int(value)
+
+    def parse_request_options(self, query, body):
+        """Anropets bild och inställningar, antingen som JSON eller som bilddata + query-parametrar"""
+        content_type = self.headers.get('Content-Type', '').split(';')[0].strip()
+        if content_type == 'application/json':
+            options = json.loads(body or b'{}')
+            path = options.get('path') if isinstance(options, dict) else None
+            if not isinstance(path, str) or not path:
+                raise ValueError("JSON-anrop måste ange \"path\"")
+            return {'path': options['path'],
+                    'method_name': options.get('method', "LBP + Varians"),
+                    'parameters': options.get('parameters'),
+                    'want_mask': bool(options.get('mask', False))}
+
+        if not body:
+            raise ValueError("Ingen bilddata i anropet")
+        options = parse_qs(query)
+        parameters = options.get('parameters', [None])[0]
+        return {'image_bytes': body,
+                'method_name': options.get('method', ["LBP + Varians"])[0],
+                'parameters': json.loads(parameters) if parameters else None,
+                'want_mask': options.get('mask', ['0'])[0].lower() in ('1', 'true', 'ja')}
+
+
+def create_server(host='127.0.0.1', port=DEFAULT_PORT, workers=1, max_queue=16, queue_timeout=30.0,
+                  verbose=False):
+    """Skapa servern (port 0 väljer en ledig port, se server.server_address)"""
+    server = ThreadingHTTPServer((host, port), AnalysisRequestHandler)
+    server.daemon_threads = True
+    server.verbose = verbose
+    server.service = AnalysisService(workers, max_queue, queue_timeout)
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lokal HTTP-tjänst för noppanalys")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=1, help="Antal förstartade arbetsprocesser")
+    parser.add_argument('--max-queue', type=int, default=16, help="Högst så många väntande anrop")
+    parser.add_argument('--queue-timeout', type=float, default=30.0, help="Längsta väntetid i kön (s)")
+    parser.add_argument('--verbose', action='store_true', help="Logga varje anrop")
+    args = parser.parse_args(argv)
+
+    server = create_server(args.host, args.port, args.workers, args.max_queue, args.queue_timeout,
+                           args.verbose)
+    host, port = server.server_address[:2]
+    print(f"Noppanalys lyssnar på http://{host}:{port} ({args.workers} arbetsprocesser)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Avslutar")
+    finally:
+        server.server_close()
+        server.service.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,300 @@
+"""Parametersvep: kör alla kombinationer i ett parameterrutnät över en uppsättning bilder
+
+Körs från src-katalogen:
+
+    python noppanalys_sweep.py bilder/*.jpg --method "LBP + Varians" \\
+        --grid '{"threshold": [80, 85, 90, 95], "red": [0.2, 0.3], "blue": [0.4, 0.5]}' --truth masker/
+    python noppanalys_sweep.py bilder/*.jpg --method "Fourier + Gauss" \\
+        --grid '{"threshold": [85, 90], "gauss_sigma": [1, 2, 4]}' --rank-by num_pills --target 40
+
+Kombinationer som bara skiljer sig i billiga parametrar (tröskel, kanalvikter)
+körs i samma jobb, där dyra mellanresultat (LBP, varianskartor, FFT, wavelet,
+DPCA-features) beräknas en gång per bild och parametervärde. Med --truth
+rankas kombinationerna efter medel-IoU mot facitmasker med samma filnamn,
+annars efter --rank-by (närmast --target om angivet).
+"""
+import argparse
+import glob
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+from noppanalys_headless import DEFAULT_PARAMETERS, HeadlessAnalyzer, expand_paths, read_image
+from noppanalys_instrumentation import StageTimer, append_jsonl
+from noppanalys_metrics import mask_iou
+
+# Parametrar som styr de dyra mellanresultaten för varje metod. Kombinationer
+# med samma värden på dessa delar mellanresultat. Okända metoder grupperas inte.
+STAGE_PARAMETERS = {
+    "LBP + Varians": (),
+    "Fourier + Gauss": ('gauss_sigma',),
+    "Morfologisk": (),
+    "Wavelet Transform": ('wavelet',),
+    "Kombinerad": ('gauss_sigma', 'wavelet'),
+    "DPCA + ML": ('patch_size', 'sampling_step', 'num_filters', 'feature_augment')
+}
+
+# Mått som medelvärdesbildas per kombination
+SWEEP_FIELDS = ('num_pills', 'nop_percentage', 'pill_density', 'avg_pill_area', 'avg_circularity')
+
+
+def expand_grid(grid):
+    """{'threshold': [85, 90], 'wavelet': ['db4']} -> lista av parameter-dictar, en per kombination"""
+    unknown = [name for name in grid if name not in DEFAULT_PARAMETERS]
+    if unknown:
+        raise ValueError(f"Okända parametrar: {', '.join(unknown)}")
+    names = list(grid)
+    values = [value if isinstance(value, list) else [value] for value in grid.values()]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def group_combinations(method_name, combinations):
+    """Dela kombinationerna i grupper med samma värden på metodens dyra parametrar"""
+    stage_names = STAGE_PARAMETERS.get(method_name)
+    groups = {}
+    for combination in combinations:
+        if stage_names is None:
+            key = tuple(sorted(combination.items()))
+        else:
+            key = tuple(combination.get(name) for name in stage_names)
+        groups.setdefault(key, []).append(combination)
+    return list(groups.values())
+
+
+def find_truth_mask(image_path, truth_dir):
+    """Facitmask i truth_dir med samma filnamnsstam som bilden, None om den saknas"""
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    for candidate in sorted(glob.glob(os.path.join(glob.escape(truth_dir), stem + '.*'))):
+        mask = read_image(candidate)
+        if mask is not None:
+            return cv2.cvtColor(mask, cv2.COLOR_BGR2GRAY) > 0
+    return None
+
+
+class SweepAnalyzer(HeadlessAnalyzer):
+    """HeadlessAnalyzer som sparar dyra mellanresultat för aktuell bild, nycklade på parametervärdena"""
+
+    def __init__(self, parameters=None):
+        super().__init__(parameters)
+        self.stages = {}
+
+    def set_image(self, image, image_path=None, load_timer=None):
+        """Ny bild - sparade mellanresultat kastas"""
+        self.stages = {}
+        super().set_image(image, image_path, load_timer)
+
+    def reset_parameters(self, parameters):
+        """Standardvärden plus parameters, så att inget följer med från föregående kombination"""
+        self.set_parameters({**DEFAULT_PARAMETERS, **parameters})
+
+    def stage_result(self, key, compute):
+        if key not in self.stages:
+            self.stages[key] = compute()
+        return self.stages[key]
+
+    def local_variance(self, image, size=9):
+        """Lokal varians av en LBP-kanal, en gång per kanal och bild"""
+        index = next((i for i, channel in enumerate(self.lbp_rgb or []) if channel is image), None)
+        if index is None:
+            return super().local_variance(image, size)
+        parent = super().local_variance
+        return self.stage_result(('variance', index, size), lambda: parent(image, size))
+
+    def fourier_highpass(self, gray):
+        """Högpassfiltrerad bild, en gång per sigma"""
+        parent = super().fourier_highpass
+        return self.stage_result(('fourier', self.gauss_sigma_var.get()), lambda: parent(gray))
+
+    def wavelet_detail_energy(self, gray):
+        """Wavelet-detaljenergi, en gång per wavelet"""
+        parent = super().wavelet_detail_energy
+        return self.stage_result(('wavelet', self.wavelet_var.get()), lambda: parent(gray))
+
+    def morphological_enhance(self, gray):
+        """Top-hat/bottom-hat-förstärkning, en gång per bild"""
+        parent = super().morphological_enhance
+        return self.stage_result(('morphology',), lambda: parent(gray))
+
+    def extract_dpca_features(self, gray_image):
+        """DPCA-features, en gång per patchstorlek och filterantal"""
+        parent = super().extract_dpca_features
+        key = ('dpca_features', self.patch_size_var.get(), self.num_filters_var.get())
+        return self.stage_result(key, lambda: parent(gray_image))
+
+    def extract_advanced_features(self, gray_image):
+        """Avancerade features, en gång per val av feature-augmentering"""
+        parent = super().extract_advanced_features
+        return self.stage_result(('advanced_features', self.feature_augment_var.get()), lambda: parent(gray_image))
+
+    def create_dpca_feature_map(self, gray_image):
+        """DPCA:s feature map, en gång per patchstorlek och samplingssteg"""
+        parent = super().create_dpca_feature_map
+        key = ('dpca_map', self.patch_size_var.get(), self.sampling_step_var.get())
+        return self.stage_result(key, lambda: parent(gray_image))
+
+
+def _init_worker():
+    """Förbered en arbetsprocess med en analysator som lever över alla jobb"""
+    global _worker_analyzer, _worker_truth
+    _worker_analyzer = SweepAnalyzer()
+    _worker_truth = None
+
+
+def _sweep_job(image_path, method_name, combinations, truth_dir=None):
+    """Kör en grupp kombinationer på en bild, returnerar en rad per kombination"""
+    global _worker_truth
+    analyzer = _worker_analyzer
+    if analyzer.image_path != image_path:
+        image = read_image(image_path)
+        if image is None:
+            raise ValueError(f"Kunde inte läsa bildfilen: {image_path}")
+        analyzer.set_image(image, image_path)
+        _worker_truth = find_truth_mask(image_path, truth_dir) if truth_dir else None
+
+    rows = []
+    for combination in combinations:
+        analyzer.reset_parameters(combination)
+        timer = StageTimer()
+        nop_mask, _, stats = analyzer.run_method(method_name, timer)
+        if nop_mask is None:
+            continue
+        row = {'image': image_path, 'method': method_name, 'parameters': combination,
+               'seconds': timer.total_seconds()}
+        row.update({name: stats[name] for name in SWEEP_FIELDS if name in stats})
+        if 'pilling_grade' in stats:
+            row['pilling_grade'] = stats['pilling_grade']
+        if _worker_truth is not None and _worker_truth.shape == nop_mask.shape:
+            row['iou'] = mask_iou(_worker_truth, nop_mask)
+        rows.append(row)
+    return rows
+
+
+def run_sweep(file_paths, methods, grid, workers=None, truth_dir=None, output=None):
+    """Kör alla kombinationer på alla bilder i en processpool, returnerar alla rader"""
+    combinations = expand_grid(grid)
+    unknown = [name for name in methods if name not in HeadlessAnalyzer().available_methods]
+    if unknown:
+        raise ValueError(f"Okända analysmetoder: {', '.join(unknown)}")
+
+    # Ett jobb per bild, metod och grupp; bildvis ordning så att en process oftast behåller sin bild
+    jobs = [(path, method_name, group) for path in file_paths for method_name in methods
+            for group in group_combinations(method_name, combinations)]
+    print(f"{len(combinations)} kombinationer x {len(methods)} metoder x {len(file_paths)} bilder "
+          f"i {len(jobs)} jobb")
+
+    rows = []
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers or multiprocessing.cpu_count(), mp_context=context,
+                             initializer=_init_worker) as pool:
+        futures = {pool.submit(_sweep_job, *job, truth_dir): job for job in jobs}
+        for future in as_completed(futures):
+            path, method_name, _ = futures[future]
+            try:
+                job_rows = future.result()
+            except Exception as e:
+                print(f"Fel i {path} ({method_name}): {e}")
+                continue
+            rows.extend(job_rows)
+            if output:
+                for row in job_rows:
+                    append_jsonl(output, row)
+    return rows
+
+
+def rank_configurations(rows, rank_by=None, target=None):
+    """En rad per metod och kombination med medelvärden över bilderna, bästa först.
+
+    Med IoU (facitmasker) rankas efter högst medel-IoU, annars efter rank_by:
+    närmast target om angivet, annars högst värde.
+    """
+    configurations = {}
+    for row in rows:
+        key = (row['method'], json.dumps(row['parameters'], sort_keys=True))
+        configurations.setdefault(key, []).append(row)
+
+    ranked = []
+    for (method_name, _), config_rows in configurations.items():
+        entry = {'method': method_name, 'parameters': config_rows[0]['parameters'], 'images': len(config_rows),
+                 'seconds': float(np.mean([row['seconds'] for row in config_rows]))}
+        for name in SWEEP_FIELDS + ('iou', 'pilling_grade'):
+            values = [row[name] for row in config_rows if name in row]
+            if values:
+                entry[name] = float(np.mean(values))
+                entry[f"{name}_std"] = float(np.std(values))
+        ranked.append(entry)
+
+    if rank_by is None:
+        rank_by = 'iou' if any('iou' in entry for entry in ranked) else 'num_pills'
+    if target is not None:
+        score = lambda entry: abs(entry.get(rank_by, np.inf) - target)
+    else:
+        score = lambda entry: -entry.get(rank_by, -np.inf)
+    ranked.sort(key=score)
+    return ranked, rank_by
+
+
+def format_ranking(ranked, rank_by, limit=20):
+    """Textuppställning av de bästa kombinationerna"""
+    lines = [f"=== PARAMETERSVEP - RANKAT EFTER {rank_by.upper()} ===", ""]
+    lines.append(f"{'#':<4} {'Metod':<18} {rank_by:<12} {'Noppor':<8} {'Andel%':<8} {'Tid (s)':<8} Parametrar")
+    lines.append("-" * 90)
+    for position, entry in enumerate(ranked[:limit], start=1):
+        value = entry.get(rank_by)
+        value_text = f"{value:.4f}" if value is not None else "-"
+        parameters = ", ".join(f"{name}={value}" for name, value in entry['parameters'].items())
+        lines.append(f"{position:<4} {entry['method']:<18} {value_text:<12} {entry.get('num_pills', 0):<8.1f} "
+                     f"{entry.get('nop_percentage', 0):<8.2f} {entry['seconds']:<8.2f} {parameters}")
+    if len(ranked) > limit:
+        lines.append(f"... och {len(ranked) - limit} kombinationer till")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parametersvep över ett rutnät av analysparametrar")
+    parser.add_argument('images', nargs='+', help="Bildfiler eller mönster, t.ex. bilder/*.jpg")
+    parser.add_argument('--method', action='append', dest='methods',
+                        help="Analysmetod, kan anges flera gånger (standard: LBP + Varians)")
+    parser.add_argument('--grid', type=json.loads, required=True,
+                        help='Parameterrutnät som JSON, t.ex. \'{"threshold": [85, 90, 95]}\'')
+    parser.add_argument('--truth', default=None,
+                        help="Katalog med facitmasker (samma filnamnsstam som bilden) för IoU-ranking")
+    parser.add_argument('--rank-by', default=None, help="Mått att ranka efter (standard: iou eller num_pills)")
+    parser.add_argument('--target', type=float, default=None, help="Målvärde för --rank-by (närmast först)")
+    parser.add_argument('--workers', type=int, default=None, help="Antal arbetsprocesser (standard: antal kärnor)")
+    parser.add_argument('--output', default=None, help="JSONL-fil för en rad per bild och kombination")
+    parser.add_argument('--ranking', default=None, help="JSON-fil för den rankade tabellen")
+    parser.add_argument('--top', type=int, default=20, help="Antal kombinationer att skriva ut")
+    args = parser.parse_args(argv)
+
+    file_paths = expand_paths(args.images)
+    if not file_paths:
+        print("Inga bildfiler hittades")
+        return 1
+
+    start = time.perf_counter()
+    try:
+        rows = run_sweep(file_paths, args.methods or ["LBP + Varians"], args.grid, workers=args.workers,
+                         truth_dir=args.truth, output=args.output)
+    except ValueError as e:
+        print(f"Fel: {e}")
+        return 1
+
+    ranked, rank_by = rank_configurations(rows, args.rank_by, args.target)
+    print(format_ranking(ranked, rank_by, args.top))
+    print(f"\n{len(rows)} körningar på {time.perf_counter() - start:.1f} s")
+    if args.ranking:
+        with open(args.ranking, 'w', encoding='utf-8') as f:
+            json.dump({'rank_by': rank_by, 'target': args.target, 'ranking': ranked}, f,
+                      ensure_ascii=False, indent=2)
+    return 0 if rows else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""Analys av video eller numrerade bildsekvenser (t.ex. tyg under rörlig kamera)
+
+Körs från src-katalogen:
+
+    python noppanalys_video.py prov.mp4 --method "Fourier + Gauss" --fps 5 --overlay prov_overlay.mp4
+    python noppanalys_video.py bilder/frame_%04d.png --method Morfologisk --output serie.jsonl
+
+Bildsekvenser anges med printf-mönster som cv2.VideoCapture förstår. Med
+--realtime hoppas bilder över när analysen inte hinner med målhastigheten,
+annars analyseras var n:e bild så att --fps uppnås i videotid.
+"""
+import argparse
+import json
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from noppanalys_headless import HeadlessAnalyzer
+from noppanalys_instrumentation import StageTimer, append_jsonl, json_default
+
+# Bildfrekvens som antas för bildsekvenser och filer utan angiven frekvens
+DEFAULT_SOURCE_FPS = 25.0
+
+# Mått som tas med i tidsserien för varje analyserad bild
+SERIES_FIELDS = ('num_pills', 'nop_percentage', 'pill_density', 'avg_pill_area', 'avg_circularity')
+
+
+def create_overlay(frame, nop_mask, stats, frame_index, timestamp):
+    """Videobild med detekterade noppor i grönt och nyckeltal i hörnet (samma blandning som i GUI:t)"""
+    nop_overlay = np.zeros_like(frame)
+    nop_overlay[nop_mask > 0] = [0, 255, 0]
+    result_image = cv2.addWeighted(frame, 0.7, nop_overlay, 0.3, 0)
+
+    lines = [f"Bild {frame_index}  {timestamp:.2f} s",
+             f"Noppor: {stats['num_pills']}  Andel: {stats['nop_percentage']:.2f}%"]
+    scale = max(0.5, frame.shape[1] / 1600)
+    for i, line in enumerate(lines):
+        origin = (10, int((i + 1) * 30 * scale))
+        cv2.putText(result_image, line, origin, cv2.FONT_HERSHEY_SIMPLEX, scale, (0, 0, 0), int(3 * scale) + 1)
+        cv2.putText(result_image, line, origin, cv2.FONT_HERSHEY_SIMPLEX, scale, (255, 255, 255), int(scale) + 1)
+    return result_image
+
+
+class VideoAnalyzer:
+    """Kör en analysmetod på bilder ur en cv2.VideoCapture med en målhastighet i bilder per sekund.
+
+    Analysatorn och cachar per upplösning (t.ex. Fouriermetodens högpassfilter)
+    återanvänds mellan bilderna. Överhoppade bilder läses med grab() och
+    avkodas aldrig.
+    """
+
+    def __init__(self, method_name, parameters=None, target_fps=None, realtime=False):
+        self.analyzer = HeadlessAnalyzer(parameters)
+        if method_name not in self.analyzer.available_methods:
+            raise ValueError(f"Okänd analysmetod: {method_name}")
+        self.method_name = method_name
+        self.target_fps = target_fps
+        self.realtime = realtime
+
+    def analyze(self, source, output=None, overlay_path=None, max_frames=None):
+        """Analysera källan, returnerar tidsserien som en lista av dictar (en per analyserad bild)"""
+        capture = cv2.VideoCapture(source)
+        if not capture.isOpened():
+            raise ValueError(f"Kunde inte öppna video eller bildsekvens: {source}")
+
+        source_fps = capture.get(cv2.CAP_PROP_FPS) or DEFAULT_SOURCE_FPS
+        target_fps = min(self.target_fps or source_fps, source_fps)
+        interval = 1.0 / target_fps
+        writer = None
+        # Överlägget skrivs i källans takt: senaste överlägget upprepas för överhoppade bilder
+        last_overlay = None
+        written = 0
+        series = []
+        frame_index = -1
+        next_time = 0.0
+        skipped = 0
+        start = time.perf_counter()
+
+        try:
+            while max_frames is None or len(series) < max_frames:
+                if not capture.grab():
+                    break
+                frame_index += 1
+                timestamp = frame_index / source_fps
+
+                # Bilder före nästa schemalagda tidpunkt hoppas över utan avkodning
+                if timestamp + 1e-9 < next_time:
+                    skipped += 1
+                    continue
+                ok, frame = capture.retrieve()
+                if not ok:
+                    break
+
+                timer = StageTimer()
+                self.analyzer.set_image(frame, f"{source}#{frame_index}")
+                frame_start = time.perf_counter()
+                nop_mask, _, stats = self.analyzer.run_method(self.method_name, timer)
+                analysis_seconds = time.perf_counter() - frame_start
+                if nop_mask is None:
+                    skipped += 1
+                    continue
+
+                entry = {'frame': frame_index, 'timestamp': timestamp, 'skipped_before': skipped,
+                         'analysis_seconds': analysis_seconds}
+                entry.update({name: stats[name] for name in SERIES_FIELDS if name in stats})
+                if 'pilling_grade' in stats:
+                    entry['pilling_grade'] = stats['pilling_grade']
+                series.append(entry)
+                skipped = 0
+
+                if output:
+                    stats['timings'] = timer.to_dict()
+                    record = self.analyzer.create_timing_record(self.method_name, stats)
+                    record.update({'frame': frame_index, 'timestamp': timestamp})
+                    append_jsonl(output, record)
+
+                if overlay_path:
+                    if writer is None:
+                        writer = cv2.VideoWriter(overlay_path, cv2.VideoWriter_fourcc(*'mp4v'), source_fps,
+                                                 (frame.shape[1], frame.shape[0]))
+                    overlay = create_overlay(frame, nop_mask, stats, frame_index, timestamp)
+                    # Bilder före den första analyserade får det första överlägget
+                    fill = overlay if last_overlay is None else last_overlay
+                    while written < frame_index:
+                        writer.write(fill)
+                        written += 1
+                    writer.write(overlay)
+                    written = frame_index + 1
+                    last_overlay = overlay
+
+                next_time = timestamp + interval
+                if self.realtime:
+                    # Ligger analysen efter källans klocka hoppar nästa bild fram till "nu"
+                    next_time = max(next_time, time.perf_counter() - start)
+
+                print(f"Bild {frame_index} ({timestamp:.2f} s): {stats['num_pills']} noppor, "
+                      f"{stats['nop_percentage']:.2f}% ({analysis_seconds:.2f} s)")
+            # Bilderna efter den sist analyserade
+            while last_overlay is not None and written <= frame_index:
+                writer.write(last_overlay)
+                written += 1
+        finally:
+            capture.release()
+            if writer is not None:
+                writer.release()
+        return series
+
+
+def summarize_series(series):
+    """Medel, min och max över tidsserien för varje mått"""
+    summary = {'frames': len(series)}
+    for name in SERIES_FIELDS:
+        values = [entry[name] for entry in series if name in entry]
+        if values:
+            summary[name] = {'mean': float(np.mean(values)), 'min': float(np.min(values)),
+                             'max': float(np.max(values))}
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Noppanalys av video eller bildsekvens")
+    parser.add_argument('source', help="Videofil eller bildsekvens med printf-mönster, t.ex. bild_%%04d.png")
+    parser.add_argument('--method', default="Fourier + Gauss", help="Analysmetod")
+    parser.add_argument('--parameters', type=json.loads, default=None,
+                        help='Analysparametrar som JSON, t.ex. \'{"threshold": 90}\'')
+    parser.add_argument('--fps', type=float, default=None,
+                        help="Analyserade bilder per sekund videotid (standard: alla bilder)")
+    parser.add_argument('--realtime', action='store_true',
+                        help="Hoppa över bilder när analysen ligger efter videons klocka")
+    parser.add_argument('--max-frames', type=int, default=None, help="Sluta efter så många analyserade bilder")
+    parser.add_argument('--output', default=None, help="JSONL-fil för fullständiga poster per bild")
+    parser.add_argument('--series', default=None, help="JSON-fil för tidsserien och sammanfattningen")
+    parser.add_argument('--overlay', default=None, help="Video med overlay att skriva (mp4)")
+    args = parser.parse_args(argv)
+
+    video = VideoAnalyzer(args.method, parameters=args.parameters, target_fps=args.fps, realtime=args.realtime)
+    series = video.analyze(args.source, output=args.output, overlay_path=args.overlay, max_frames=args.max_frames)
+    summary = summarize_series(series)
+    if args.series:
+        with open(args.series, 'w', encoding='utf-8') as f:
+            json.dump({'source': args.source, 'method': args.method, 'series': series, 'summary': summary},
+                      f, default=json_default, ensure_ascii=False, indent=2)
+    print(f"{summary['frames']} bilder analyserade")
+    if 'num_pills' in summary:
+        print(f"Noppor per bild: medel {summary['num_pills']['mean']:.1f}, "
+              f"min {summary['num_pills']['min']:.0f}, max {summary['num_pills']['max']:.0f}")
+    return 0 if series else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
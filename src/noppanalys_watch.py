@@ -0,0 +1,351 @@
+"""Bevakad katalog: analysera nya bilder från provningsutrustningen löpande
+
+Körs från src-katalogen:
+
+    python noppanalys_watch.py //server/martindale/bilder --method "Fourier + Gauss" --output qc.jsonl
+
+Nya filer upptäcks med filsystemshändelser (watchdog, inotify i Linux) om
+paketet finns, annars genom att katalogen avsöks med jämna mellanrum. På
+nätverksresurser kommer händelser för filer som skrivs från en annan dator
+ofta inte fram - använd då --poll.
+"""
+import argparse
+import fnmatch
+import importlib.util
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from noppanalys_cache import DEFAULT_MAX_BYTES, ResultCache
+from noppanalys_instrumentation import append_jsonl
+
+# watchdog är valfritt - utan det avsöks katalogen
+WATCHDOG_AVAILABLE = importlib.util.find_spec('watchdog') is not None
+
+# Antal senaste latenser som sparas (demonen kan köra obegränsat länge)
+LATENCY_WINDOW = 1000
+
+IMAGE_PATTERNS = ('*.jpg', '*.jpeg', '*.png', '*.bmp', '*.tif', '*.tiff')
+
+
+class FolderWatcher:
+    """Håller reda på nya bildfiler i en katalog och släpper dem först när de skrivits klart.
+
+    En fil räknas som färdigskriven när storlek och ändringstid varit oförändrade
+    i settle_time sekunder. Filer som inte hunnit hämtas (se ready) ligger kvar
+    som kandidater, så katalogen fungerar som kö när analysen inte hinner med.
+    """
+
+    def __init__(self, directory, patterns=IMAGE_PATTERNS, recursive=False, settle_time=0.3,
+                 use_events=True):
+        self.directory = os.path.abspath(directory)
+        self.patterns = tuple(pattern.lower() for pattern in patterns)
+        self.recursive = recursive
+        self.settle_time = settle_time
+        self.use_events = use_events and WATCHDOG_AVAILABLE
+        self.wake = threading.Event()
+
+        # sökväg -> (storlek, ändringstid, stabil sedan, upptäckt)
+        self.candidates = {}
+        # sökväg -> (storlek, ändringstid) för filer som redan lämnats ut
+        self.handled = {}
+        self._lock = threading.Lock()
+        self._observer = None
+
+    def matches(self, path):
+        name = os.path.basename(path).lower()
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.patterns)
+
+    def start(self, include_existing=True):
+        """Börja bevaka; befintliga filer analyseras också om include_existing"""
+        if include_existing:
+            self.scan()
+        else:
+            for path in self.list_files():
+                info = self.stat(path)
+                if info is not None:
+                    self.handled[path] = info
+
+        if self.use_events:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+
+            watcher = self
+
+            class Handler(FileSystemEventHandler):
+                def on_any_event(self, event):
+                    if event.is_directory:
+                        return
+                    path = getattr(event, 'dest_path', None) or event.src_path
+                    if watcher.matches(path):
+                        watcher.add(path)
+
+            self._observer = Observer()
+            self._observer.schedule(Handler(), self.directory, recursive=self.recursive)
+            self._observer.start()
+        print(f"Bevakar {self.directory} ({'händelser' if self.use_events else 'avsökning'})")
+
+    def stop(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+
+    def list_files(self):
+        """Alla bildfiler i katalogen (och underkataloger om recursive)"""
+        paths = []
+        stack = [self.directory]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if self.recursive:
+                        stack.append(entry.path)
+                elif self.matches(entry.name):
+                    paths.append(entry.path)
+        return paths
+
+    @staticmethod
+    def stat(path):
+        try:
+            info = os.stat(path)
+        except OSError:
+            return None
+        return info.st_size, info.st_mtime_ns
+
+    def add(self, path):
+        """Registrera en ny eller ändrad fil (anropas från händelsetråden eller scan)"""
+        info = self.stat(path)
+        if info is None or self.handled.get(path) == info:
+            return
+        now = time.monotonic()
+        with self._lock:
+            previous = self.candidates.get(path)
+            if previous is None or previous[:2] != info:
+                detected = previous[3] if previous is not None else now
+                self.candidates[path] = (info[0], info[1], now, detected)
+        self.wake.set()
+
+    def scan(self):
+        """Avsök katalogen efter nya filer.
+
+        Redan utlämnade filer stat:as inte igen och filer som försvunnit glöms,
+        så kostnaden och minnet växer inte med allt som passerat katalogen. En fil
+        som skrivs över under samma namn upptäcks därför bara via händelser.
+        """
+        paths = self.list_files()
+        present = set(paths)
+        with self._lock:
+            for path in [path for path in self.handled if path not in present]:
+                del self.handled[path]
+        for path in paths:
+            if path not in self.candidates and path not in self.handled:
+                self.add(path)
+
+    def ready(self, limit, now=None):
+        """Upp till limit färdigskrivna filer som (sökväg, upptäckt), äldst först"""
+        now = time.monotonic() if now is None else now
+        stable = []
+        with self._lock:
+            for path, (size, mtime, since, detected) in list(self.candidates.items()):
+                info = self.stat(path)
+                if info is None:
+                    del self.candidates[path]  # Flyttad eller borttagen innan den hann analyseras
+                elif info != (size, mtime):
+                    self.candidates[path] = (info[0], info[1], now, detected)
+                elif size > 0 and now - since >= self.settle_time:
+                    stable.append((detected, path))
+
+            stable.sort()
+            released = []
+            for detected, path in stable[:max(limit, 0)]:
+                size, mtime = self.candidates.pop(path)[:2]
+                self.handled[path] = (size, mtime)
+                released.append((path, detected))
+        return released
+
+    def next_deadline(self):
+        """Sekunder tills nästa kandidat kan bli stabil (None om inga kandidater)"""
+        now = time.monotonic()
+        with self._lock:
+            if not self.candidates:
+                return None
+            return max(0.0, min(since for _, _, since, _ in self.candidates.values()) + self.settle_time - now)
+
+
+def _init_worker(parameters, cache_settings):
+    """Förbered en arbetsprocess: tunga moduler importeras och analysatorn skapas en gång"""
+    global _worker_analyzer
+    from noppanalys_headless import HeadlessAnalyzer
+    cache = ResultCache(*cache_settings) if cache_settings is not None else None
+    _worker_analyzer = HeadlessAnalyzer(parameters, cache=cache)
+
+
+def _analyze_job(file_path, methods):
+    """Analysera en fil i arbetsprocessen"""
+    return _worker_analyzer.analyze_file(file_path, methods)
+
+
+def _warm_up(_):
+    """Tom uppgift som tvingar fram start av arbetsprocesserna"""
+    return os.getpid()
+
+
+class WatchDaemon:
+    """Analyserar filer från en FolderWatcher på en pool av arbetsprocesser.
+
+    Högst max_pending filer skickas till poolen samtidigt. När gränsen nåtts
+    hämtas inga fler filer från katalogen (mottryck) tills analyser blivit klara.
+    """
+
+    def __init__(self, watcher, methods, parameters=None, output=None, workers=None,
+                 max_pending=None, poll_interval=0.2, rescan_interval=5.0, cache_settings=None,
+                 include_existing=True):
+        self.watcher = watcher
+        self.methods = list(methods)
+        self.parameters = parameters or {}
+        self.output = output
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 2 * self.workers
+        self.poll_interval = poll_interval
+        self.rescan_interval = rescan_interval
+        self.cache_settings = cache_settings
+        self.include_existing = include_existing
+        self.stop_event = threading.Event()
+        self.pending = {}
+        self.processed = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self._backlog_warned = False
+
+    def run(self, max_files=None):
+        """Kör tills stop() anropas (eller max_files analyserats)"""
+        from noppanalys_headless import HeadlessAnalyzer
+        unknown = [name for name in self.methods if name not in HeadlessAnalyzer().available_methods]
+        if unknown:
+            raise ValueError(f"Okända analysmetoder: {', '.join(unknown)}")
+
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(self.workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(self.parameters, self.cache_settings)) as pool:
+            # Starta alla arbetsprocesser innan första filen kommer
+            list(pool.map(_warm_up, range(self.workers)))
+            self.watcher.start(self.include_existing)
+            last_scan = time.monotonic()
+            try:
+                while not self.stop_event.is_set():
+                    if max_files is not None and self.processed + self.failed >= max_files:
+                        break
+
+                    # Avsökning: alltid utan händelser, annars som skyddsnät för missade händelser
+                    interval = self.rescan_interval if self.watcher.use_events else self.poll_interval
+                    if time.monotonic() - last_scan >= interval:
+                        self.watcher.scan()
+                        last_scan = time.monotonic()
+
+                    for path, detected in self.watcher.ready(self.max_pending - len(self.pending)):
+                        future = pool.submit(_analyze_job, path, self.methods)
+                        self.pending[future] = (path, detected)
+                    self.report_backlog()
+
+                    self.wait_for_work()
+            finally:
+                self.watcher.stop()
+                self.collect(wait(self.pending).done)
+
+    def wait_for_work(self):
+        """Vänta tills en analys blir klar, en fil kan bli stabil eller en händelse kommer"""
+        timeout = self.poll_interval
+        deadline = self.watcher.next_deadline()
+        if deadline is not None:
+            timeout = min(timeout, deadline)
+
+        if self.pending:
+            done, _ = wait(self.pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            self.collect(done)
+        else:
+            self.watcher.wake.wait(timeout)
+        self.watcher.wake.clear()
+
+    def collect(self, done):
+        """Spara resultaten från klara analyser"""
+        for future in done:
+            path, detected = self.pending.pop(future)
+            try:
+                records = future.result()
+            except Exception as e:
+                self.failed += 1
+                print(f"Fel i {path}: {e}")
+                continue
+
+            latency = time.monotonic() - detected
+            self.latencies.append(latency)
+            self.processed += 1
+            for record in records:
+                record['latency_seconds'] = latency
+                stats = record['stats']
+                print(f"{path}: {record['method']}: {stats['num_pills']} noppor, "
+                      f"{stats['nop_percentage']:.2f}% ({latency:.2f} s)")
+                if self.output:
+                    append_jsonl(self.output, record)
+
+    def report_backlog(self):
+        """Varna en gång när filer väntar i katalogen för att poolen är full"""
+        waiting = len(self.watcher.candidates)
+        if waiting > self.max_pending and not self._backlog_warned:
+            print(f"Analysen hinner inte med: {waiting} filer väntar i katalogen")
+            self._backlog_warned = True
+        elif waiting == 0:
+            self._backlog_warned = False
+
+    def stop(self):
+        self.stop_event.set()
+        self.watcher.wake.set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analysera nya bilder i en katalog löpande")
+    parser.add_argument('directory', help="Katalog att bevaka")
+    parser.add_argument('--method', action='append', dest='methods',
+                        help="Analysmetod, kan anges flera gånger (standard: LBP + Varians)")
+    parser.add_argument('--parameters', type=json.loads, default=None,
+                        help='Analysparametrar som JSON, t.ex. \'{"threshold": 90}\'')
+    parser.add_argument('--output', default='noppanalys_resultat.jsonl', help="JSONL-fil att lägga till resultat i")
+    parser.add_argument('--pattern', action='append', dest='patterns', help="Filmönster (standard: vanliga bildformat)")
+    parser.add_argument('--recursive', action='store_true', help="Bevaka även underkataloger")
+    parser.add_argument('--workers', type=int, default=None, help="Antal arbetsprocesser (standard: antal kärnor)")
+    parser.add_argument('--max-pending', type=int, default=None,
+                        help="Högst så många filer i poolen samtidigt (standard: 2 per arbetsprocess)")
+    parser.add_argument('--settle-time', type=float, default=0.3,
+                        help="Sekunder en fil ska vara oförändrad innan den analyseras")
+    parser.add_argument('--poll', action='store_true', help="Avsök katalogen även om watchdog finns")
+    parser.add_argument('--poll-interval', type=float, default=0.2)
+    parser.add_argument('--skip-existing', action='store_true', help="Analysera bara filer som tillkommer")
+    parser.add_argument('--cache-dir', help="Katalog för resultatcachen (standard: ingen cache)")
+    args = parser.parse_args(argv)
+
+    watcher = FolderWatcher(args.directory, patterns=args.patterns or IMAGE_PATTERNS, recursive=args.recursive,
+                            settle_time=args.settle_time, use_events=not args.poll)
+    cache_settings = (args.cache_dir, DEFAULT_MAX_BYTES) if args.cache_dir else None
+    daemon = WatchDaemon(watcher, args.methods or ["LBP + Varians"], parameters=args.parameters,
+                         output=args.output, workers=args.workers, max_pending=args.max_pending,
+                         poll_interval=args.poll_interval, cache_settings=cache_settings,
+                         include_existing=not args.skip_existing)
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        print("Avbryter - väntar in pågående analyser")
+    print(f"{daemon.processed} filer analyserade, {daemon.failed} fel")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())